@@ -1,9 +1,11 @@
-import pandas as pd
+import os
 import json
 import csv
 import argparse
-from ete3 import NCBITaxa
-import requests
+
+from mirror import Mirror
+
+# pandas, requests and the taxonomy are imported where they are first needed, so --help and argument errors return at once
 
 # Example:
 # python Make_Pathogen_Database_one_per_species.py \
@@ -18,10 +20,16 @@ KNOWN_SYNONYMS = {
     # "Some tricky name": 12345,
 }
 
-# Initialise NCBI Taxa
-ncbi = NCBITaxa()
+# NCBI taxonomy handle, set by load_ncbi in main: ete3's NCBITaxa, or a memory-mapped
+# snapshot from taxonomy.py which answers the same calls without a sqlite query each time
+ncbi = None
+# Local copies of NCBI files tried before NCBI itself (see mirror.py), set in main from --mirror
+mirror = Mirror()
+# Journal of finished work for --resume, set in main
+checkpoint = None
 # If you need to refresh the local taxonomy, run once manually:
-# ncbi.update_taxonomy_database()
+# NCBITaxa().update_taxonomy_database()
+# then re-export any snapshot: python scripts/taxonomy.py export -o taxonomy_snapshot
 
 # --------------------------
 # Helpers
@@ -35,7 +43,20 @@ def normalise_name(name: str) -> str:
     return s.strip().strip('"').strip("'")
 
 
+def load_ncbi(taxonomy_snapshot=None):
+    global ncbi
+    if taxonomy_snapshot:
+        from taxonomy import TaxonomySnapshot
+        print("Loading taxonomy snapshot", taxonomy_snapshot)
+        ncbi = TaxonomySnapshot(taxonomy_snapshot)
+    else:
+        from ete3 import NCBITaxa
+        ncbi = NCBITaxa()
+    return ncbi
+
+
 def download_file(url, filename):
+    import requests
     resp = requests.get(url, timeout=REQUEST_TIMEOUT)
     resp.raise_for_status()
     with open(filename, 'wb') as fh:
@@ -77,6 +98,28 @@ def get_taxid(species_name):
         return None
 
 
+def suggest_taxa(failed_names, taxonomy_snapshot):
+    """Closest NCBI names for names with no TaxID, using the snapshot's name index if it has one."""
+    unresolved = [{"species_name": name, "species_taxid": None, "reason": "no TaxID"} for name in failed_names]
+    if not unresolved:
+        return unresolved
+    if not taxonomy_snapshot:
+        print("No suggestions for names with no TaxID, they need a taxonomy snapshot (--taxonomy_snapshot)")
+        return unresolved
+    from name_matcher import NameMatcher
+    try:
+        # The name index is built into the snapshot the first time it is needed
+        matcher = NameMatcher(taxonomy_snapshot, snapshot=ncbi)
+    except OSError as e:
+        print(f"Could not build the name index in {taxonomy_snapshot}, no suggestions: {e}")
+        return unresolved
+    for entry in unresolved:
+        entry["suggestions"] = matcher.suggest(normalise_name(entry["species_name"]))
+        best = ", ".join(f"{s['name']} ({s['taxid']}, {s['score']})" for s in entry["suggestions"][:3]) or "none"
+        print(f"Suggestions for {entry['species_name']}: {best}")
+    return unresolved
+
+
 def expand_to_descendant_taxa(taxid):
     """Include all descendants such as subspecies, forma specialis and strains."""
     try:
@@ -102,12 +145,15 @@ def download_and_parse_assembly_stats(ftp_path):
     base = to_https(base)
     asm = base.split("/")[-1]
     stats_url = f"{base}/{asm}_assembly_stats.txt"
+    if checkpoint is not None and ftp_path in checkpoint.stats:
+        return checkpoint.stats[ftp_path]
     try:
-        response = requests.get(stats_url, stream=True, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
-        for line in response.text.splitlines():
+        # From a local mirror if one has it, otherwise NCBI
+        for line in mirror.read_text(stats_url).splitlines():
             if "all\tall\tall\tall\ttotal-length" in line:
                 size = int(line.split('\t')[-1])
+                if checkpoint is not None:
+                    checkpoint.record({"kind": "stats", "ftp_path": ftp_path, "size": size})
                 return size
     except Exception as e:
         print(f"Failed to process {stats_url}: {e}")
@@ -180,6 +226,136 @@ def generate_download_links_row(ftp_path):
     return genomic_url, md5_url
 
 
+# Columns of the download list, in the JSON and the JSON Lines stream
+DL_COLS = ["species_name", "species_taxid", "selected_taxid", "organism_name",
+           "assembly_accession", "dlLink", "dlLinkMD5", "type", "source_db"]
+
+
+class DownloadStream:
+    """download_input.jsonl written one selected assembly at a time, so download.py --follow can start straight away.
+
+    The last line is {"end": true, "complete": ...}; complete is false if selection stopped early.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        # line buffered, each record is flushed as soon as it is written
+        self.handle = open(path, 'w', buffering=1)
+
+    def write(self, row):
+        self.handle.write(json.dumps({col: row[col] for col in DL_COLS}) + "\n")
+        self.count += 1
+
+    def close(self, complete=True):
+        self.handle.write(json.dumps({"end": True, "complete": complete, "count": self.count}) + "\n")
+        self.handle.close()
+
+
+class Checkpoint:
+    """Append-only journal of finished work, so --resume can carry on after a crash with the same output.
+
+    One JSON line per resolved species name (TaxID or none), fetched assembly size and finished species selection,
+    after a first line recording the inputs. Failed assembly stats fetches are not recorded so they are retried.
+    """
+
+    def __init__(self, path, inputs, resume=False):
+        self.path = path
+        self.taxids = {}
+        self.stats = {}
+        self.species = {}
+        if resume and os.path.exists(path):
+            self._load(inputs)
+            self.handle = open(path, 'a')
+        else:
+            self.handle = open(path, 'w')
+            self.record({"kind": "start", "inputs": inputs})
+
+    def _load(self, inputs):
+        valid_bytes = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # a line cut short by the crash, dropped below
+                if not line.endswith(b"\n"):
+                    break
+                valid_bytes += len(line)
+                kind = entry.get("kind")
+                if kind == "start" and entry["inputs"] != inputs:
+                    raise ValueError(f"{self.path} was written for different inputs, run again without --resume")
+                if kind == "taxid":
+                    self.taxids[entry["name"]] = entry["taxid"]
+                elif kind == "stats":
+                    self.stats[entry["ftp_path"]] = entry["size"]
+                elif kind == "species":
+                    self.species[(entry["species_name"], entry["species_taxid"])] = entry
+        # Appending after a partial line would corrupt the next record
+        os.truncate(self.path, valid_bytes)
+        print(f"Resuming from {self.path}: {len(self.taxids)} TaxIDs, {len(self.stats)} assembly sizes, {len(self.species)} species done")
+
+    def record(self, entry):
+        self.handle.write(json.dumps(entry) + "\n")
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+
+    def close(self):
+        self.handle.close()
+
+
+def input_signature(paths):
+    """Size and modification time of each input, a resumed run must see the same files."""
+    signature = {}
+    for path in paths:
+        if os.path.exists(path):
+            st = os.stat(path)
+            signature[path] = [st.st_size, st.st_mtime_ns]
+        else:
+            signature[path] = None
+    return signature
+
+
+def resolve_taxids(names):
+    """get_taxid for each name, reusing and recording resolutions in the checkpoint."""
+    taxids = []
+    for name in names:
+        if checkpoint is not None and name in checkpoint.taxids:
+            taxids.append(checkpoint.taxids[name])
+            continue
+        taxid = get_taxid(name)
+        if checkpoint is not None:
+            checkpoint.record({"kind": "taxid", "name": name, "taxid": taxid})
+        taxids.append(taxid)
+    return taxids
+
+
+def read_assembly_tables():
+    """RefSeq and GenBank assembly summaries merged into one table, GenBank copies of RefSeq assemblies removed."""
+    import pandas as pd
+    print("Reading in RefSeq dataframe")
+    refseq = pd.read_csv("assembly_summary_refseq.txt", sep='\t', skiprows=1, header=0, dtype='object', low_memory=False)
+    refseq = refseq.loc[:, refseq.columns.notna()]
+    refseq = refseq.rename(columns={'#assembly_accession': 'assembly_accession'})
+
+    print("Reading in GenBank dataframe")
+    genbank = pd.read_csv("assembly_summary_genbank.txt", sep='\t', skiprows=1, header=0, dtype='object', low_memory=False)
+    genbank = genbank.loc[:, genbank.columns.notna()]
+    genbank = genbank.rename(columns={'#assembly_accession': 'assembly_accession'})
+
+    # Merge, removing GenBank entries mirrored in RefSeq
+    refseq_set = set(refseq['gbrs_paired_asm'])
+    genbank_filtered = genbank[~genbank['assembly_accession'].isin(refseq_set)]
+    ref_gen = pd.concat([refseq, genbank_filtered], ignore_index=True)
+
+    # Keep any ftp or https entry, we rewrite for downloads later
+    ref_gen = ref_gen[ref_gen['ftp_path'].astype(str).str.contains("://", na=False)].copy()
+
+    # Dtypes
+    ref_gen['taxid'] = ref_gen['taxid'].astype(int)
+    return ref_gen
+
+
 def save_to_json(df, output_path):
     records = df.to_dict(orient='records')
     with open(output_path, 'w') as json_file:
@@ -203,6 +379,70 @@ def save_summary_and_missing(accessions_df, output_path_prefix, missing_species_
         json.dump(missing_species_list, fh, indent=4)
     print(f"Missing species list saved to {missing_path}")
 
+def select_assemblies(species_df, ref_gen, accessions_rows, missing_species, stream):
+    """Pick one assembly per species, appending to accessions_rows/missing_species and the stream as each is decided."""
+    print(f"Total input species with TaxIDs: {len(species_df)}")
+    for _, srow in species_df.iterrows():
+        species_name = srow['species_name']
+        species_taxid = int(srow['species_taxid'])
+
+        # Already selected before a crash, replay the result
+        done = checkpoint.species.get((species_name, species_taxid)) if checkpoint is not None else None
+        if done is not None:
+            if done["row"] is None:
+                missing_species.append(done["missing"])
+            else:
+                accessions_rows.append(done["row"])
+                stream.write(done["row"])
+            continue
+
+        # Expand to descendants so subspecies and formae speciales are included
+        expanded_taxids = expand_to_descendant_taxa(species_taxid)
+
+        # Candidate assemblies for this species including descendants
+        cand = ref_gen[ref_gen['taxid'].isin(expanded_taxids)].copy()
+        print(f"[SELECT] {species_name} (taxid {species_taxid}) candidates: {len(cand)}")
+
+        # Pick the single best assembly
+        best = select_best_assembly(cand)
+        if best is None:
+            # record as missing
+            missing = {
+                "species_name": species_name,
+                "species_taxid": species_taxid
+            }
+            missing_species.append(missing)
+            record_species(species_name, species_taxid, None, missing)
+            print(f"[MISS] No assembly selected for {species_name}")
+            continue
+
+        # Build download links and source db flag
+        dl, md5 = generate_download_links_row(best['ftp_path'])
+        source_db = "RefSeq" if "refseq" in str(best['ftp_path']).lower() else "GenBank"
+
+        row = {
+            "species_name": species_name,                    # input species
+            "species_taxid": species_taxid,                  # input species taxid
+            "selected_taxid": int(best['taxid']),            # taxid of chosen assembly (may be descendant)
+            "organism_name": best['organism_name'],          # organism label from assembly table
+            "assembly_accession": best['assembly_accession'],
+            "ftp_path": best['ftp_path'],
+            "type": best['assembly_level'],
+            "source_db": source_db,
+            "dlLink": dl,
+            "dlLinkMD5": md5
+        }
+        accessions_rows.append(row)
+        stream.write(row)
+        record_species(species_name, species_taxid, row, None)
+
+
+def record_species(species_name, species_taxid, row, missing):
+    if checkpoint is not None:
+        checkpoint.record({"kind": "species", "species_name": species_name, "species_taxid": species_taxid,
+                           "row": row, "missing": missing})
+
+
 # --------------------------
 # Main
 # --------------------------
@@ -212,8 +452,33 @@ def main():
     parser.add_argument("-p", "--phibase", required=True, help="Path to the PHIbase input CSV file")
     parser.add_argument("-r", "--risk_register", required=True, help="Path to the Risk Register input CSV file")
     parser.add_argument("-o", "--output", default="download", help="Output file prefix for the download JSON")
+    parser.add_argument("-t", "--taxonomy_snapshot", help="Taxonomy snapshot directory from taxonomy.py export, used instead of ete3's NCBITaxa")
+    parser.add_argument("-m", "--mirror", action="append", default=[],
+                        help="Local directory or HTTP base URL laid out like the NCBI FTP site, tried before NCBI (can be repeated)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Carry on from <output>checkpoint.jsonl left by an interrupted run with the same inputs")
     args = parser.parse_args()
 
+    # The last run's stream would otherwise be on disk until selection starts, a download.py --follow started
+    # in the meantime would read and download the previous selection
+    stream_path = args.output + "download_input.jsonl"
+    if os.path.exists(stream_path):
+        os.remove(stream_path)
+    import pandas as pd
+
+    global mirror, checkpoint
+    mirror = Mirror(args.mirror)
+    # Everything the selection depends on, a resumed run must have the same
+    from taxonomy import DEFAULT_TAXDB
+    taxonomy_source = os.path.join(args.taxonomy_snapshot, "meta.json") if args.taxonomy_snapshot else DEFAULT_TAXDB
+    inputs = input_signature([args.phibase, args.risk_register, "assembly_summary_refseq.txt", "assembly_summary_genbank.txt",
+                              taxonomy_source])
+    try:
+        checkpoint = Checkpoint(args.output + "checkpoint.jsonl", inputs, resume=args.resume)
+    except ValueError as e:
+        parser.error(str(e))
+    load_ncbi(args.taxonomy_snapshot)
+
     # Read sources
     print("Reading in", args.risk_register)
     risk_register = pd.read_csv(args.risk_register)
@@ -235,13 +500,15 @@ def main():
     print("Number of unique before taxaID species:", len(species_df))
 
     # Resolve taxids for species
-    species_df['species_taxid'] = species_df['species_name'].apply(get_taxid)
+    species_df['species_taxid'] = resolve_taxids(species_df['species_name'])
     print("Finished getting TaxaIDs")
 
     # Report failures
     failed = species_df[species_df['species_taxid'].isna()]
     if not failed.empty:
         print("Names with no TaxID:", list(failed['species_name']))
+    # Suggest close matches for them, written into the missing species list
+    unresolved_species = suggest_taxa(list(failed['species_name']), args.taxonomy_snapshot)
 
     # Keep only resolved
     species_df = species_df.dropna(subset=['species_taxid']).copy()
@@ -256,85 +523,40 @@ def main():
     # print("Downloading GenBank dataframe")
     # download_file("https://ftp.ncbi.nlm.nih.gov/genomes/ASSEMBLY_REPORTS/assembly_summary_genbank.txt", "assembly_summary_genbank.txt")
 
-    # Read them
-    print("Reading in RefSeq dataframe")
-    refseq = pd.read_csv("assembly_summary_refseq.txt", sep='\t', skiprows=1, header=0, dtype='object', low_memory=False)
-    refseq = refseq.loc[:, refseq.columns.notna()]
-    refseq = refseq.rename(columns={'#assembly_accession': 'assembly_accession'})
-
-    print("Reading in GenBank dataframe")
-    genbank = pd.read_csv("assembly_summary_genbank.txt", sep='\t', skiprows=1, header=0, dtype='object', low_memory=False)
-    genbank = genbank.loc[:, genbank.columns.notna()]
-    genbank = genbank.rename(columns={'#assembly_accession': 'assembly_accession'})
-
-    # Merge, removing GenBank entries mirrored in RefSeq
-    refseq_set = set(refseq['gbrs_paired_asm'])
-    genbank_filtered = genbank[~genbank['assembly_accession'].isin(refseq_set)]
-    ref_gen = pd.concat([refseq, genbank_filtered], ignore_index=True)
-
-    # Keep any ftp or https entry, we rewrite for downloads later
-    ref_gen = ref_gen[ref_gen['ftp_path'].astype(str).str.contains("://", na=False)].copy()
-
-    # Dtypes
-    ref_gen['taxid'] = ref_gen['taxid'].astype(int)
+    # A resumed run that had finished selecting only needs to write the outputs
+    if all((name, taxid) in checkpoint.species for name, taxid in zip(species_df['species_name'], species_df['species_taxid'])):
+        ref_gen = None
+    else:
+        ref_gen = read_assembly_tables()
 
     # For each species, expand to descendants and pick one best assembly
     accessions_rows = []
-    missing_species = []
+    missing_species = list(unresolved_species)
 
-    print(f"Total input species with TaxIDs: {len(species_df)}")
-    for _, srow in species_df.iterrows():
-        species_name = srow['species_name']
-        species_taxid = int(srow['species_taxid'])
-
-        # Expand to descendants so subspecies and formae speciales are included
-        expanded_taxids = expand_to_descendant_taxa(species_taxid)
-
-        # Candidate assemblies for this species including descendants
-        cand = ref_gen[ref_gen['taxid'].isin(expanded_taxids)].copy()
-        print(f"[SELECT] {species_name} (taxid {species_taxid}) candidates: {len(cand)}")
-
-        # Pick the single best assembly
-        best = select_best_assembly(cand)
-        if best is None:
-            # record as missing
-            missing_species.append({
-                "species_name": species_name,
-                "species_taxid": species_taxid
-            })
-            print(f"[MISS] No assembly selected for {species_name}")
-            continue
-
-        # Build download links and source db flag
-        dl, md5 = generate_download_links_row(best['ftp_path'])
-        source_db = "RefSeq" if "refseq" in str(best['ftp_path']).lower() else "GenBank"
-
-        accessions_rows.append({
-            "species_name": species_name,                    # input species
-            "species_taxid": species_taxid,                  # input species taxid
-            "selected_taxid": int(best['taxid']),            # taxid of chosen assembly (may be descendant)
-            "organism_name": best['organism_name'],          # organism label from assembly table
-            "assembly_accession": best['assembly_accession'],
-            "ftp_path": best['ftp_path'],
-            "type": best['assembly_level'],
-            "source_db": source_db,
-            "dlLink": dl,
-            "dlLinkMD5": md5
-        })
+    # Each selection is also streamed for download.py --follow
+    stream = DownloadStream(stream_path)
+    try:
+        select_assemblies(species_df, ref_gen, accessions_rows, missing_species, stream)
+    except BaseException:
+        stream.close(complete=False)
+        raise
+    stream.close()
+    checkpoint.close()
 
     # One row per species by construction
     accessions_df = pd.DataFrame(accessions_rows)
 
     # Write the download list expected by downstream tooling
-    dl_cols = ["species_name", "species_taxid", "selected_taxid", "organism_name",
-               "assembly_accession", "dlLink", "dlLinkMD5", "type", "source_db"]
     output_path = args.output + "download_input.json"
-    save_to_json(accessions_df[dl_cols], output_path)
+    save_to_json(accessions_df[DL_COLS], output_path)
     print(f"Wrote one-genome-per-species download list to {output_path}")
 
     # Save summary and missing species list
     save_summary_and_missing(accessions_df, args.output, missing_species)
 
+    if mirror.summary():
+        print(mirror.summary())
+
     # Friendly tail line
     if missing_species:
         names = ", ".join(ms['species_name'] for ms in missing_species[:10])
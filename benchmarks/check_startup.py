@@ -0,0 +1,63 @@
+#!/usr/bin/python
+
+#Checks every pathogen_db.py command starts quickly: runs "<command> --help" in a fresh interpreter a few times
+#and fails (exit 1) if the best time is over the budget, a heavy module was imported just to print the help or it raised an error
+#Import times of the slowest modules are shown for any command that fails, from python -X importtime
+#python benchmarks/check_startup.py
+#python benchmarks/check_startup.py --budget 0.2 --commands select download
+#The same checks run under pytest in tests/test_startup.py
+
+import os, sys, time, argparse, subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+from pathogen_db import COMMANDS
+
+#Only the subcommands that do the work should load these
+HEAVY_MODULES = ("pandas", "numpy", "requests", "tqdm", "ete3", "Bio")
+DEFAULT_BUDGET = 0.5  #seconds, also used by tests/test_startup.py
+
+def run_help(command):
+    #Wall time of one "--help", the -X importtime report (module, cumulative microseconds), whether it raised and its exit code
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", os.path.join(REPO_DIR, "pathogen_db.py"), command, "--help"],
+                            capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    imports = []
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            _, cumulative, module = line[len("import time:"):].split("|")
+            if cumulative.strip().isdigit():
+                imports.append((module.strip(), int(cumulative)))
+    # A module missing here would raise before --help printed, which is a failure too
+    crashed = "Traceback (most recent call last)" in result.stderr
+    return wall, imports, crashed, result.returncode
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the pathogen_db.py commands start within a time budget.")
+    parser.add_argument("-b", "--budget", type=float, default=DEFAULT_BUDGET, help=f"Seconds allowed for <command> --help (default: {DEFAULT_BUDGET})")
+    parser.add_argument("-r", "--repeats", type=int, default=3, help="Runs per command, the fastest counts (default: 3)")
+    parser.add_argument("--commands", nargs="+", choices=list(COMMANDS), default=list(COMMANDS), help="Commands to check (default: all)")
+    args = parser.parse_args()
+
+    failed = []
+    print(f"{'command':<18}{'best s':>8}  heavy imports")
+    for command in args.commands:
+        runs = [run_help(command) for _ in range(args.repeats)]
+        wall, imports, crashed, returncode = min(runs, key=lambda run: run[0])
+        # --help exits 0, a script printing its own usage message and exiting 1 does not count as starting
+        crashed = crashed or returncode != 0
+        heavy = sorted({module.split(".")[0] for module, _ in imports if module.split(".")[0] in HEAVY_MODULES})
+        print(f"{command:<18}{wall:>8.3f}  {', '.join(heavy) or '-'}{'  (raised an error or exited non-zero)' if crashed else ''}")
+        if wall > args.budget or heavy or crashed:
+            failed.append(command)
+            slowest = sorted((m for m in imports if "." not in m[0]), key=lambda m: -m[1])[:5]
+            print("    slowest imports: " + ", ".join(f"{module} {us / 1e6:.3f}s" for module, us in slowest))
+
+    if failed:
+        sys.exit(f"Over the {args.budget}s startup budget or importing heavy modules for --help: {', '.join(failed)}")
+    print(f"All {len(args.commands)} commands within {args.budget}s")
+
+if __name__ == "__main__":
+    main()
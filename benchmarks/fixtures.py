@@ -0,0 +1,263 @@
+#!/usr/bin/python
+
+#Synthetic inputs for the benchmarks, sized by a scale preset (see SCALES) so runs at the same scale are comparable
+#Everything is generated from a fixed seed into one fixture directory:
+#  taxonomy.sqlite / taxonomy_snapshot   ete3 format taxonomy (genera > species > strains) and its snapshot
+#  phibase.csv, risk_register.csv        species lists in the layout of the real downloads
+#  assembly_summary_refseq.txt / _genbank.txt   NCBI assembly tables, candidates for every listed species plus filler rows
+#  ncbi/genomes/all/...                  NCBI genomes tree (assembly stats, md5checksums.txt, gzipped genomes) served over HTTP
+#  barcode01/01_mapped.paf, genome_lengths.tsv   minimap2 style PAF against the listed taxa
+#The fixture is only regenerated when the scale or base URL changes
+#python benchmarks/fixtures.py -s small -o bench_work/fixtures
+
+import os, sys, csv, gzip, json, random, sqlite3, hashlib, argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from taxonomy import export_snapshot
+
+FIXTURE_VERSION = 1
+SEED = 1
+
+SCALES = {
+    #listed species, assembly table rows, MB per genome, distinct genome files, one extra large genome (MB), PAF alignments
+    "tiny":   {"species": 20, "assembly_rows": 5000, "genome_mb": 0.2, "genome_pool": 4, "big_genome_mb": 0, "alignments": 50000},
+    "small":  {"species": 100, "assembly_rows": 100000, "genome_mb": 1, "genome_pool": 8, "big_genome_mb": 0, "alignments": 1000000},
+    "medium": {"species": 500, "assembly_rows": 1000000, "genome_mb": 5, "genome_pool": 16, "big_genome_mb": 500, "alignments": 10000000},
+    "large":  {"species": 2000, "assembly_rows": 3000000, "genome_mb": 10, "genome_pool": 32, "big_genome_mb": 3000, "alignments": 30000000},
+}
+
+#Column order of the NCBI assembly_summary files
+ASSEMBLY_COLUMNS = [
+    "assembly_accession", "bioproject", "biosample", "wgs_master", "refseq_category", "taxid", "species_taxid",
+    "organism_name", "infraspecific_name", "isolate", "version_status", "assembly_level", "release_type", "genome_rep",
+    "seq_rel_date", "asm_name", "asm_submitter", "gbrs_paired_asm", "paired_asm_comp", "ftp_path",
+    "excluded_from_refseq", "relation_to_type_material", "asm_not_live_date", "assembly_type", "group", "genome_size",
+    "genome_size_ungapped", "gc_percent", "replicon_count", "scaffold_count", "contig_count", "annotation_provider",
+    "annotation_name", "annotation_date", "total_gene_count", "protein_coding_gene_count", "non_coding_gene_count", "pubmed_id",
+]
+LEVELS = ["Complete Genome", "Chromosome", "Scaffold", "Contig"]
+CATEGORIES = ["reference genome", "representative genome", "na", "na"]
+PEST_TYPES = ["Fungus", "Bacterium", "Oomycete", "Virus", "Insect", "Nematode"]
+
+FIRST_TAXID = 100000
+STRAINS_PER_SPECIES = 2
+CANDIDATES_PER_SPECIES = 4
+LINE_WIDTH = 80
+BASES = bytes.maketrans(bytes(range(256)), b"ACGT" * 64)
+
+def build_taxonomy(path, n_species):
+    #root > Eukaryota > Fungi > genera > species > strains, twice as many species as are listed so filler rows have taxa
+    if os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE species (taxid INT PRIMARY KEY, parent INT, spname VARCHAR(50) COLLATE NOCASE, common VARCHAR(50) COLLATE NOCASE, rank VARCHAR(50), track TEXT)")
+    db.execute("CREATE TABLE synonym (taxid INT, spname VARCHAR(50) COLLATE NOCASE, PRIMARY KEY (spname, taxid))")
+    db.execute("CREATE TABLE merged (taxid_old INT, taxid_new INT)")
+    rows = [(1, 1, "root", "no rank"), (2759, 1, "Eukaryota", "superkingdom"), (4751, 2759, "Fungi", "kingdom")]
+    species = []
+    taxid = FIRST_TAXID
+    n_genera = max(1, (2 * n_species) // 10)
+    for g in range(n_genera):
+        genus_taxid, genus_name = taxid, f"Benchgenus{g}"
+        rows.append((genus_taxid, 4751, genus_name, "genus"))
+        taxid += 1
+        for s in range(10):
+            species_taxid, species_name = taxid, f"{genus_name} species{s}"
+            rows.append((species_taxid, genus_taxid, species_name, "species"))
+            strains = list(range(taxid + 1, taxid + 1 + STRAINS_PER_SPECIES))
+            for k, strain in enumerate(strains):
+                rows.append((strain, species_taxid, f"{species_name} strain{k}", "strain"))
+            species.append((species_taxid, species_name, strains))
+            taxid += 1 + STRAINS_PER_SPECIES
+    db.executemany("INSERT INTO species VALUES (?,?,?,'',?,'')", rows)
+    db.commit()
+    db.close()
+    return species
+
+def random_sequence(rng, length):
+    return rng.randbytes(length).translate(BASES)
+
+def write_genome(path, rng, size_mb):
+    #Gzipped FASTA of contigs (~1MB each) with 80 base lines, written a contig at a time
+    remaining = max(1, int(size_mb * 1_000_000))
+    contig = 0
+    with gzip.open(path, 'wb') as out:
+        while remaining > 0:
+            length = min(remaining, 1_000_000)
+            seq = random_sequence(rng, length)
+            out.write(f">NZ_BENCH{contig:06d}.1 synthetic contig {contig}\n".encode())
+            out.write(b"\n".join(seq[i:i + LINE_WIDTH] for i in range(0, length, LINE_WIDTH)) + b"\n")
+            remaining -= length
+            contig += 1
+    return md5_of(path)
+
+def md5_of(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def write_species_lists(fixture_dir, listed, rng):
+    with open(os.path.join(fixture_dir, "phibase.csv"), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Record ID", "PHI_MolConn_ID", "Pathogen_species", "Host_species", "Phenotype"])
+        for i, (_, name, _) in enumerate(listed):
+            #PHI-base has many interactions per pathogen
+            for _ in range(rng.randint(1, 5)):
+                writer.writerow([f"Record-{i}", f"PHI:{rng.randint(1, 99999)}", name, "Triticum aestivum", "reduced virulence"])
+    with open(os.path.join(fixture_dir, "risk_register.csv"), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(["Type of pest", "Pest Name", "EU and EPPO listing", "UK", "Pathways", "Likelihood", "Impact ",
+                         "UK Relative Risk Rating (unmitigated)", "Regulation", "Likelihood.1", "Impact .1",
+                         "UK Relative Risk Rating (mitigated)", "Scenario for Risk Register"])
+        for _, name, _ in listed[::2]:
+            writer.writerow([rng.choice(PEST_TYPES), f"'{name}'", rng.choice(["Regulated quarantine pest", "EPPO A2 list", ""]),
+                             "Absent", rng.choice(["Plants for planting; Natural spread", "Seed"]), rng.randint(1, 5),
+                             rng.randint(1, 5), rng.randint(1, 60), "", rng.randint(1, 5), rng.randint(1, 5), rng.randint(1, 60), ""])
+
+def assembly_row(accession, taxid, species_taxid, organism_name, level, category, date, ftp_path, paired):
+    row = dict.fromkeys(ASSEMBLY_COLUMNS, "na")
+    row.update({"assembly_accession": accession, "refseq_category": category, "taxid": taxid, "species_taxid": species_taxid,
+                "organism_name": organism_name, "version_status": "latest", "assembly_level": level,
+                "release_type": "Major", "genome_rep": "Full", "seq_rel_date": date, "asm_name": accession.split("_")[1],
+                "gbrs_paired_asm": paired, "ftp_path": ftp_path, "group": "fungi"})
+    return "\t".join(str(row[c]) for c in ASSEMBLY_COLUMNS) + "\n"
+
+def write_assembly_tables(fixture_dir, species, listed, base_url, scale, rng):
+    #Candidates (with a genomes tree entry) for each listed species, then filler rows for unlisted taxa up to assembly_rows
+    tree = os.path.join(fixture_dir, "ncbi")
+    pool_dir = os.path.join(fixture_dir, "genome_pool")
+    os.makedirs(pool_dir, exist_ok=True)
+    pool = []
+    for i in range(scale["genome_pool"]):
+        path = os.path.join(pool_dir, f"genome{i}.fna.gz")
+        pool.append((path, write_genome(path, rng, scale["genome_mb"]), int(scale["genome_mb"] * 1_000_000)))
+    big = None
+    if scale["big_genome_mb"]:
+        path = os.path.join(pool_dir, "big_genome.fna.gz")
+        big = (path, write_genome(path, rng, scale["big_genome_mb"]), int(scale["big_genome_mb"] * 1_000_000))
+
+    headers = "#   See ftp://ftp.ncbi.nlm.nih.gov/genomes/README_assembly_summary.txt for a description of the columns in this file.\n"
+    headers += "#" + "\t".join(ASSEMBLY_COLUMNS) + "\n"
+    refseq = open(os.path.join(fixture_dir, "assembly_summary_refseq.txt"), 'w')
+    genbank = open(os.path.join(fixture_dir, "assembly_summary_genbank.txt"), 'w')
+    refseq.write(headers)
+    genbank.write(headers)
+    n_rows = 0
+    accession = 0
+    for species_index, (species_taxid, name, strains) in enumerate(listed):
+        for c in range(CANDIDATES_PER_SPECIES):
+            accession += 1
+            prefix = "GCF" if c % 2 == 0 else "GCA"
+            acc = f"{prefix}_{accession:09d}.1"
+            asm_dir = f"{acc}_Bench{accession}"
+            digits = f"{accession:09d}"
+            rel = f"genomes/all/{prefix}/{digits[0:3]}/{digits[3:6]}/{digits[6:9]}/{asm_dir}"
+            taxid = species_taxid if c == 0 else rng.choice(strains)
+            #the first two candidates tie on category and level so selection has to fetch assembly stats
+            level = LEVELS[0] if c < 2 else rng.choice(LEVELS)
+            category = CATEGORIES[1] if c < 2 else rng.choice(CATEGORIES)
+            genome_path, md5, genome_length = big if (big and species_index == 0 and c < 2) else rng.choice(pool)
+
+            asm_path = os.path.join(tree, rel)
+            os.makedirs(asm_path, exist_ok=True)
+            genome_name = f"{asm_dir}_genomic.fna.gz"
+            link = os.path.join(asm_path, genome_name)
+            if not os.path.exists(link):
+                os.link(genome_path, link)
+            with open(os.path.join(asm_path, f"{asm_dir}_assembly_stats.txt"), 'w') as stats:
+                stats.write(f"# Assembly name:  Bench{accession}\n# Organism name:  {name}\n")
+                stats.write("# unit-name\tmolecule-name\tmolecule-type/loc\tsequence-type\tstatistic\tvalue\n")
+                stats.write(f"all\tall\tall\tall\ttotal-length\t{genome_length + c}\n")
+                stats.write(f"all\tall\tall\tall\tcontig-count\t{max(1, genome_length // 1_000_000)}\n")
+            with open(os.path.join(asm_path, "md5checksums.txt"), 'w') as md5_file:
+                md5_file.write(f"{md5}  ./{genome_name}\n")
+            out = refseq if prefix == "GCF" else genbank
+            out.write(assembly_row(acc, taxid, species_taxid, name, level, category, f"20{rng.randint(10, 24)}/01/01",
+                                   f"{base_url}/{rel}", "na"))
+            n_rows += 1
+
+    unlisted = species[len(listed):] or species
+    while n_rows < scale["assembly_rows"]:
+        accession += 1
+        species_taxid, name, strains = rng.choice(unlisted)
+        prefix = rng.choice(["GCF", "GCA"])
+        acc = f"{prefix}_{accession:09d}.1"
+        digits = f"{accession:09d}"
+        (refseq if prefix == "GCF" else genbank).write(assembly_row(
+            acc, rng.choice(strains), species_taxid, name, rng.choice(LEVELS), rng.choice(CATEGORIES), "2020/01/01",
+            f"{base_url}/genomes/all/{prefix}/{digits[0:3]}/{digits[3:6]}/{digits[6:9]}/{acc}_Bench{accession}", "na"))
+        n_rows += 1
+    refseq.close()
+    genbank.close()
+    return n_rows
+
+def write_paf(fixture_dir, listed, n_alignments, rng):
+    #Reads with 1-5 alignments each, written in blocks
+    barcode_dir = os.path.join(fixture_dir, "barcode01")
+    os.makedirs(barcode_dir, exist_ok=True)
+    taxa = [str(rng.choice([t] + s)) for t, _, s in listed]
+    with open(os.path.join(fixture_dir, "genome_lengths.tsv"), 'w') as lengths:
+        lengths.write("taxaID\tgenome_length\n")
+        for taxaID in dict.fromkeys(taxa):
+            lengths.write(f"{taxaID}\t{rng.randint(10**6, 10**8)}\n")
+    written = 0
+    read = 0
+    with open(os.path.join(barcode_dir, "01_mapped.paf"), 'w', buffering=1 << 20) as paf:
+        while written < n_alignments:
+            lines = []
+            for _ in range(10000):
+                read += 1
+                q_length = rng.randint(200, 20000)
+                for k in range(rng.choice((1, 1, 1, 2, 3, 5))):
+                    taxaID = rng.choice(taxa)
+                    a_length = rng.randint(100, q_length + 500)
+                    matches = rng.randint(a_length // 2, a_length)
+                    q_start = rng.randint(0, max(0, q_length - a_length))
+                    t_start = rng.randint(0, 5_000_000)
+                    lines.append(f"read{read:09d}\t{q_length}\t{q_start}\t{min(q_length, q_start + a_length)}\t+\t"
+                                 f"taxid|{taxaID}|Bench organism|NZ_BENCH{k:06d}.1 synthetic\t5000000\t{t_start}\t"
+                                 f"{t_start + a_length}\t{matches}\t{a_length}\t{rng.choice((0, 0, 1, 3, 5, 10, 60, 60))}\t"
+                                 f"tp:A:P\tcg:Z:{a_length}M\n")
+            paf.write("".join(lines))
+            written += len(lines)
+    return written
+
+def generate(fixture_dir, scale_name, base_url):
+    #Returns the fixture description, reusing an existing fixture made with the same settings
+    scale = SCALES[scale_name]
+    description_path = os.path.join(fixture_dir, "fixture.json")
+    settings = {"version": FIXTURE_VERSION, "seed": SEED, "scale": scale_name, "params": scale, "base_url": base_url}
+    if os.path.exists(description_path):
+        with open(description_path, 'r') as f:
+            description = json.load(f)
+        if description["settings"] == settings:
+            return description
+    os.makedirs(fixture_dir, exist_ok=True)
+    rng = random.Random(SEED)
+
+    print(f"Generating {scale_name} fixture in {fixture_dir}")
+    species = build_taxonomy(os.path.join(fixture_dir, "taxonomy.sqlite"), scale["species"])
+    export_snapshot(os.path.join(fixture_dir, "taxonomy.sqlite"), os.path.join(fixture_dir, "taxonomy_snapshot"))
+    listed = species[:scale["species"]]
+    write_species_lists(fixture_dir, listed, rng)
+    n_rows = write_assembly_tables(fixture_dir, species, listed, base_url, scale, rng)
+    n_alignments = write_paf(fixture_dir, listed, scale["alignments"], rng)
+
+    description = {"settings": settings, "species": len(listed), "assembly_rows": n_rows, "alignments": n_alignments}
+    with open(description_path, 'w') as f:
+        json.dump(description, f, indent=4)
+    return description
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic benchmark inputs.")
+    parser.add_argument("-s", "--scale", choices=sorted(SCALES), default="small", help="Scale preset (default: small)")
+    parser.add_argument("-o", "--output", default="bench_work/fixtures", help="Fixture directory (default: bench_work/fixtures)")
+    parser.add_argument("--base_url", default="http://127.0.0.1:8765", help="URL the genomes tree will be served from")
+    args = parser.parse_args()
+    description = generate(args.output, args.scale, args.base_url)
+    print(json.dumps(description, indent=4))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+#!/usr/bin/python
+
+#A local HTTP server standing in for https://ftp.ncbi.nlm.nih.gov, serving the genomes tree of a benchmark fixture
+#so assembly stats, md5checksums.txt and genome downloads are timed without the network
+#python benchmarks/ncbi_server.py bench_work/fixtures/ncbi --port 8765
+
+import argparse, threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    #No line per request on stderr, there are thousands of them
+    def log_message(self, format, *args):
+        pass
+
+def start_server(tree_dir, port=8765, host="127.0.0.1"):
+    #Serves tree_dir from a background thread, returns the server (call shutdown() when done)
+    server = ThreadingHTTPServer((host, port), partial(QuietHandler, directory=tree_dir))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fixture's NCBI genomes tree over HTTP.")
+    parser.add_argument("tree", help="Genomes tree directory (<fixture dir>/ncbi)")
+    parser.add_argument("-p", "--port", type=int, default=8765, help="Port to listen on (default: 8765)")
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), partial(QuietHandler, directory=args.tree))
+    print(f"Serving {args.tree} on http://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
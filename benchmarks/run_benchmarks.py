@@ -0,0 +1,159 @@
+#!/usr/bin/python
+
+#Times each pipeline stage on synthetic inputs (see fixtures.py) and appends the results to a JSON Lines history
+#Each stage runs as its own process (through stage_wrapper.py): wall time, peak RSS of that process and throughput of its main input are recorded,
+#then compared with the last run in the history at the same scale
+#Stages run in pipeline order and later ones use earlier outputs (download needs make_database's JSON, genome_lengths the database)
+#python benchmarks/run_benchmarks.py --scale small
+#python benchmarks/run_benchmarks.py --scale tiny --stages paf_parse coverage
+
+import os, sys, json, time, shutil, socket, platform, argparse, subprocess
+
+from fixtures import SCALES, generate
+from ncbi_server import start_server
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+DEFAULT_HISTORY = "history.jsonl"  #inside the work directory, so runs do not write into the source tree
+DATE = "000000"
+
+def script(name):
+    return os.path.join(REPO_DIR, name)
+
+def size_of(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(path) for f in files)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+#name -> function(work_dir, fixture_dir, description) returning (command, input path for throughput, records or None)
+#Commands run with work_dir as the working directory
+def make_database(work, fixtures, description):
+    return ([sys.executable, script("Make_Pathogen_Database.py"), "-p", os.path.join(fixtures, "phibase.csv"),
+             "-r", os.path.join(fixtures, "risk_register.csv"), "-o", "bench_", "-t", os.path.join(fixtures, "taxonomy_snapshot")],
+            os.path.join(fixtures, "assembly_summary_refseq.txt"), description["assembly_rows"])
+
+def download(work, fixtures, description):
+    # Start from an empty download directory so every genome is fetched
+    shutil.rmtree(os.path.join(work, "download"), ignore_errors=True)
+    shutil.rmtree(os.path.join(work, "bench_db"), ignore_errors=True)
+    return ([sys.executable, script("download.py"), "-i", "bench_download_input", "-d", DATE, "-o", "bench_db"],
+            os.path.join(work, "download"), description["species"])
+
+def genome_lengths(work, fixtures, description):
+    database = os.path.join("bench_db", f"pathogen_database_{DATE}.fa")
+    return ([sys.executable, script("genome_lengths_from_fasta.py"), database, os.path.join("bench_db", DATE)],
+            os.path.join(work, database), None)
+
+def paf_parse(work, fixtures, description):
+    # paf_parse.py appends to the counts file, start clean so every run does the same work
+    shutil.rmtree(os.path.join(work, "barcode01"), ignore_errors=True)
+    os.makedirs(os.path.join(work, "barcode01"))
+    paf = os.path.join(fixtures, "barcode01", "01_mapped.paf")
+    return ([sys.executable, script("paf_parse.py"), "-b", "01", "--paf", paf], paf, description["alignments"])
+
+def coverage(work, fixtures, description):
+    paf = os.path.join(fixtures, "barcode01", "01_mapped.paf")
+    os.makedirs(os.path.join(work, "barcode01"), exist_ok=True)
+    return ([sys.executable, script("pathogen_genome_coverage_from_paf.py"), "01", os.path.join(fixtures, "genome_lengths.tsv"),
+             "--paf", paf], paf, description["alignments"])
+
+STAGES = {"make_database": make_database, "download": download, "genome_lengths": genome_lengths,
+          "paf_parse": paf_parse, "coverage": coverage}
+
+def run_stage(name, command, work_dir, log_path):
+    #Runs one stage, returns wall time, peak RSS in MB and the exit code
+    peak_file = log_path + ".peak_rss"
+    if os.path.exists(peak_file):
+        os.remove(peak_file)
+    command = [command[0], os.path.join(BENCH_DIR, "stage_wrapper.py"), peak_file] + command[1:]
+    with open(log_path, 'w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=work_dir, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if os.path.exists(peak_file):
+        with open(peak_file, 'r') as f:
+            peak_rss_mb = int(f.read()) / (1 << 20)
+        os.remove(peak_file)
+    else:
+        # No /proc (macOS): fall back to ru_maxrss (bytes on macOS, KB on Linux), which can include the runner's own memory
+        peak_rss_mb = usage.ru_maxrss / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+    return wall, peak_rss_mb, process.returncode
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def last_run(history_path, scale):
+    previous = None
+    if os.path.exists(history_path):
+        with open(history_path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    run = json.loads(line)
+                    if run.get("scale") == scale:
+                        previous = run
+    return previous
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic inputs.")
+    parser.add_argument("-s", "--scale", choices=sorted(SCALES), default="small", help="Scale preset (default: small)")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES), help="Stages to run (default: all)")
+    parser.add_argument("-w", "--work_dir", default="bench_work", help="Directory for fixtures and stage outputs (default: bench_work)")
+    parser.add_argument("--history", help=f"JSON Lines history to append to (default: <work_dir>/{DEFAULT_HISTORY})")
+    parser.add_argument("-p", "--port", type=int, default=8765, help="Port for the local NCBI server (default: 8765)")
+    parser.add_argument("--note", default="", help="Free text stored with the run, e.g. what changed")
+    args = parser.parse_args()
+
+    work_dir = os.path.abspath(args.work_dir)
+    history_path = args.history or os.path.join(work_dir, DEFAULT_HISTORY)
+    fixture_dir = os.path.join(work_dir, "fixtures")
+    base_url = f"http://127.0.0.1:{args.port}"
+    description = generate(fixture_dir, args.scale, base_url)
+    # Make_Pathogen_Database.py reads the assembly tables from its working directory
+    for table in ("assembly_summary_refseq.txt", "assembly_summary_genbank.txt"):
+        link = os.path.join(work_dir, table)
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.join(fixture_dir, table), link)
+
+    server = start_server(os.path.join(fixture_dir, "ncbi"), args.port)
+    results = []
+    try:
+        for name in [stage for stage in STAGES if stage in args.stages]:
+            command, input_path, records = STAGES[name](work_dir, fixture_dir, description)
+            log_path = os.path.join(work_dir, f"{name}.log")
+            print(f"Running {name} ...", flush=True)
+            wall, peak_rss_mb, returncode = run_stage(name, command, work_dir, log_path)
+            input_mb = size_of(input_path) / 1e6
+            result = {"stage": name, "wall_s": round(wall, 3), "peak_rss_mb": round(peak_rss_mb, 1),
+                      "input_mb": round(input_mb, 2), "throughput_mb_s": round(input_mb / wall, 2) if wall else None,
+                      "records": records, "records_per_s": round(records / wall) if records and wall else None,
+                      "returncode": returncode}
+            results.append(result)
+            if returncode != 0:
+                print(f"  {name} failed with exit code {returncode}, see {log_path}")
+    finally:
+        server.shutdown()
+
+    run = {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"), "commit": git_commit(), "scale": args.scale,
+           "params": SCALES[args.scale], "host": socket.gethostname(), "platform": platform.platform(),
+           "python": platform.python_version(), "cpus": os.cpu_count(), "note": args.note, "results": results}
+    previous = last_run(history_path, args.scale)
+    with open(history_path, 'a') as f:
+        f.write(json.dumps(run) + "\n")
+
+    previous_results = {r["stage"]: r for r in previous["results"]} if previous else {}
+    print(f"\n{'stage':<16}{'wall s':>10}{'peak MB':>10}{'MB/s':>10}{'records/s':>12}  vs {previous['commit'] if previous else '-'}")
+    for r in results:
+        before = previous_results.get(r["stage"])
+        change = f"{(r['wall_s'] / before['wall_s'] - 1) * 100:+.1f}%" if before and before["wall_s"] and before["returncode"] == 0 and r["returncode"] == 0 else ""
+        print(f"{r['stage']:<16}{r['wall_s']:>10.2f}{r['peak_rss_mb']:>10.1f}{r['throughput_mb_s'] or 0:>10.2f}"
+              f"{r['records_per_s'] or 0:>12}  {change}")
+    print(f"Appended to {history_path}")
+
+if __name__ == "__main__":
+    main()
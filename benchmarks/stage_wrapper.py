@@ -0,0 +1,25 @@
+#!/usr/bin/python
+
+#Runs a pipeline script as __main__ and records its peak RSS when it exits
+#The wait4/getrusage peak of a child also counts the benchmark runner's memory at the fork, so the peak is read from
+#VmHWM in /proc/self/status instead, which only covers the script's own address space (Linux only)
+#python benchmarks/stage_wrapper.py <peak_rss_file> <script.py> [script args...]
+
+import os, sys, atexit, runpy
+
+def write_peak_rss(path):
+    try:
+        with open("/proc/self/status", 'r') as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    with open(path, 'w') as out:
+                        out.write(str(int(line.split()[1]) * 1024))
+                    return
+    except OSError:
+        pass
+
+if __name__ == "__main__":
+    atexit.register(write_peak_rss, sys.argv[1])
+    sys.argv = sys.argv[2:]
+    sys.path[0] = os.path.dirname(os.path.abspath(sys.argv[0]))
+    runpy.run_path(sys.argv[0], run_name="__main__")
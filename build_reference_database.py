@@ -0,0 +1,315 @@
+#!/usr/bin/python
+
+#Builds the reference database, replacing the fixed sequence of steps in build_reference_database.sh (which now calls this)
+#Stages: risk table, species selection (Make_Pathogen_Database.py), download and concatenation (download.py), genome lengths,
+#and with a taxonomy snapshot the name index that suggests taxa for names with no TaxID (name_matcher.py) before selection
+#A stage is skipped when a hash of its inputs (file contents, the script and the local modules it imports, and its arguments) matches the last
+#successful run and its outputs are as that run left them, so after a failure only the failed stage and those after it run again
+#Stages that do not depend on each other run at the same time: the risk table alongside species selection, and downloads
+#start while species are still being selected (download.py --follow)
+#State is kept in <output>/logs/stage_state.json, each stage's output in <output>/logs/stage_<name>.log
+#Run inside the pathogen_database conda environment
+#python scripts/build_reference_database.py -p Pathogen_Database_Test/phibase_test.csv -r Pathogen_Database_Test/Risk_Register_Test.csv \
+#  -d 042024 -o Pathogen_Database_Test
+#python scripts/build_reference_database.py ... --force genome_lengths   (run a stage even if it is up to date)
+
+import os, sys, ast, json, time, hashlib, argparse, subprocess
+
+from taxonomy import DEFAULT_TAXDB
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_VERSION = 1
+HASH_BUFFER = 1 << 20
+POLL_INTERVAL = 0.5  #seconds between checks on running stages
+
+class Stage:
+    #command(follow) gives the argument list, follow is True when started alongside the stage it follows
+    #stale are files removed before the followed stage starts, so they are not read until it writes them again
+    def __init__(self, name, script, command, inputs, outputs, needs=(), follows=None, stale=()):
+        self.name = name
+        self.script = script
+        self.command = command
+        self.inputs = inputs
+        self.outputs = outputs
+        self.needs = list(needs)
+        self.follows = follows
+        self.stale = list(stale)
+        self.status = "waiting"  #waiting, running, done, skipped, failed, blocked (something it needs failed)
+        self.process = None
+        self.log = None
+        self.start = self.end = None
+        self.resumed = False
+
+def file_digest(path, hash_cache):
+    #Content hash of a file, reused while its size and mtime are unchanged so a multi-GB database is only read when it changes
+    st = os.stat(path)
+    cached = hash_cache.get(path)
+    if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BUFFER), b""):
+            digest.update(block)
+    hash_cache[path] = [st.st_size, st.st_mtime_ns, digest.hexdigest()]
+    return digest.hexdigest()
+
+def local_modules(script):
+    #The script and every module next to it that it imports, directly or through another of them,
+    #including imports made inside functions
+    found = []
+    pending = [os.path.join(SCRIPT_DIR, script)]
+    while pending:
+        path = pending.pop()
+        if path in found:
+            continue
+        found.append(path)
+        with open(path, 'r') as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module_path = os.path.join(SCRIPT_DIR, name.split(".")[0] + ".py")
+                if os.path.isfile(module_path):
+                    pending.append(module_path)
+    return found
+
+def stage_key(stage, hash_cache):
+    #Hash of everything the stage's result depends on, None if an input is missing
+    key = hashlib.sha256()
+    key.update(json.dumps(stage.command(False)).encode())
+    for path in local_modules(stage.script) + stage.inputs:
+        if not os.path.isfile(path):
+            return None
+        key.update(path.encode() + b"\0" + file_digest(path, hash_cache).encode())
+    return key.hexdigest()
+
+def output_signature(stage):
+    return {path: [os.stat(path).st_size, os.stat(path).st_mtime_ns] if os.path.exists(path) else None for path in stage.outputs}
+
+def up_to_date(stage, state, key):
+    recorded = state["stages"].get(stage.name)
+    if key is None or not recorded or recorded.get("key") != key:
+        return False
+    # Outputs removed, truncated or rewritten since the last run are made again
+    return all(signature is not None for signature in recorded["outputs"].values()) and recorded["outputs"] == output_signature(stage)
+
+def load_state(path):
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            state = json.load(f)
+        if state.get("version") == STATE_VERSION:
+            return state
+    return {"version": STATE_VERSION, "stages": {}, "hashes": {}}
+
+def save_state(path, state):
+    with open(path + ".tmp", 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+def build_stages(args):
+    out = args.output
+    prefix = os.path.join(out, f"{args.date}_")
+    database = os.path.join(out, f"pathogen_database_{args.date}.fa")
+    python = sys.executable
+
+    def script(name):
+        return os.path.join(SCRIPT_DIR, name)
+
+    select_extra = ["--taxonomy_snapshot", args.taxonomy_snapshot] if args.taxonomy_snapshot else []
+    mirrors = [option for m in args.mirror for option in ("--mirror", m)]
+    download_extra = (["--previous", args.previous] if args.previous else []) + (["--packed"] if args.packed else [])
+    download_outputs = [database, os.path.splitext(database)[0] + "_manifest.json"]
+    if args.packed:
+        download_outputs.append(os.path.join(os.path.splitext(database)[0] + "_packed", "meta.json"))
+    select_inputs = [args.phibase, args.risk_register, "assembly_summary_refseq.txt", "assembly_summary_genbank.txt"]
+    if args.taxonomy_snapshot:
+        select_inputs.append(os.path.join(args.taxonomy_snapshot, "meta.json"))
+    else:
+        # Names are resolved with ete3's NCBITaxa, which reads its local database
+        select_inputs.append(DEFAULT_TAXDB)
+
+    stages = []
+    if args.taxonomy_snapshot:
+        snapshot_meta = os.path.join(args.taxonomy_snapshot, "meta.json")
+        stages.append(Stage("name_index", "name_matcher.py",
+                            lambda follow: [python, script("name_matcher.py"), "build", "--snapshot", args.taxonomy_snapshot],
+                            [snapshot_meta], [os.path.join(args.taxonomy_snapshot, "fuzzy_meta.json")]))
+    stages += [
+        Stage("risk_table", "generate_risk_table.py",
+              lambda follow: [python, script("generate_risk_table.py"), "-i", args.risk_register, "-o", os.path.join(out, "risk_table.csv")],
+              [args.risk_register], [os.path.join(out, "risk_table.csv")]),
+        Stage("select", "Make_Pathogen_Database.py",
+              lambda follow: [python, script("Make_Pathogen_Database.py"), "--phibase", args.phibase,
+                              "--risk_register", args.risk_register, "--output", prefix] + select_extra + mirrors,
+              select_inputs, [prefix + "download_input.json", prefix + "unique_species_python.csv"],
+              needs=["name_index"] if args.taxonomy_snapshot else []),
+        # download.py works in download/ so its paths are from the directory above
+        Stage("download", "download.py",
+              lambda follow: [python, script("download.py"), "-i", prefix + "download_input", "-d", args.date, "-o", out]
+                             + mirrors + download_extra + (["--follow"] if follow else []),
+              [prefix + "download_input.json"] + ([args.previous] if args.previous else []),
+              download_outputs, needs=["select"], follows="select",
+              stale=[prefix + "download_input.jsonl"]),
+        Stage("genome_lengths", "genome_lengths_from_fasta.py",
+              lambda follow: [python, script("genome_lengths_from_fasta.py"), database, os.path.join(out, args.date)],
+              [database], [os.path.join(out, f"{args.date}_genome_lengths.tsv")], needs=["download"]),
+    ]
+    return {stage.name: stage for stage in stages}
+
+def start(stage, logs_dir, follow=False):
+    command = stage.command(follow)
+    if stage.resumed:
+        command.append("--resume")
+    print(f"[{time.strftime('%H:%M:%S')}] Starting {stage.name}{' (following ' + stage.follows + ')' if follow else ''}", flush=True)
+    log = open(os.path.join(logs_dir, f"stage_{stage.name}.log"), 'w')
+    stage.log = log
+    stage.process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+    stage.status = "running"
+    stage.start = time.perf_counter()
+
+def run(stages, state, state_path, logs_dir, force, dry_run=False):
+    hash_cache = state["hashes"]
+    followers = {stage.follows: stage for stage in stages.values() if stage.follows}
+    keys = {}
+
+    def ready(stage):
+        return all(stages[need].status in ("done", "skipped") for need in stage.needs)
+
+    while True:
+        for stage in stages.values():
+            if stage.status != "waiting" or not ready(stage):
+                continue
+            keys[stage.name] = stage_key(stage, hash_cache)
+            # In a dry run the outputs of a stage that would run are not made, so whatever needs them would run too
+            would_rerun = dry_run and any(stages[need].status == "done" for need in stage.needs)
+            if stage.name not in force and not would_rerun and up_to_date(stage, state, keys[stage.name]):
+                stage.status = "skipped"
+                print(f"[{time.strftime('%H:%M:%S')}] {stage.name} is up to date, skipped", flush=True)
+                continue
+            if dry_run:
+                stage.status = "done"
+                print(f"{stage.name} would run")
+                continue
+            # Make_Pathogen_Database.py carries on from its checkpoint when it failed last time with the same inputs
+            failed_key = state["stages"].get(stage.name, {}).get("failed_key")
+            stage.resumed = stage.name == "select" and keys[stage.name] is not None and failed_key == keys[stage.name]
+            follower = followers.get(stage.name)
+            if follower is not None and follower.status == "waiting" and \
+                    all(stages[need].status in ("done", "skipped") for need in follower.needs if need != stage.name):
+                # The follower must not read what an earlier run left before this stage replaces it
+                for path in follower.stale:
+                    if os.path.exists(path):
+                        os.remove(path)
+                start(stage, logs_dir)
+                start(follower, logs_dir, follow=True)
+            else:
+                start(stage, logs_dir)
+
+        running = [stage for stage in stages.values() if stage.status == "running"]
+        if not running:
+            break
+        time.sleep(POLL_INTERVAL)
+        for stage in running:
+            returncode = stage.process.poll()
+            if returncode is None:
+                continue
+            stage.end = time.perf_counter()
+            stage.log.close()
+            recorded = state["stages"].setdefault(stage.name, {})
+            if returncode == 0:
+                stage.status = "done"
+                # A follower's inputs were only complete once the stage it followed finished
+                key = stage_key(stage, hash_cache) if stage.follows else keys[stage.name]
+                recorded.update(key=key, outputs=output_signature(stage), wall_s=round(stage.end - stage.start, 1),
+                                finished=time.strftime("%Y-%m-%d %H:%M:%S"))
+                recorded.pop("failed_key", None)
+            else:
+                stage.status = "failed"
+                recorded.pop("key", None)
+                recorded["failed_key"] = keys.get(stage.name)
+                print(f"[{time.strftime('%H:%M:%S')}] {stage.name} failed with exit code {returncode}, "
+                      f"see {os.path.join(logs_dir, 'stage_' + stage.name + '.log')}", flush=True)
+                # A follower would otherwise wait for input that is never coming
+                follower = followers.get(stage.name)
+                if follower is not None and follower.status == "running":
+                    follower.process.terminate()
+            print(f"[{time.strftime('%H:%M:%S')}] Finished {stage.name} in {stage.end - stage.start:.1f}s", flush=True)
+            if not dry_run:
+                save_state(state_path, state)
+
+        # Nothing after a failed stage can run
+        for stage in stages.values():
+            if stage.status == "waiting" and any(stages[need].status in ("failed", "blocked") for need in stage.needs):
+                stage.status = "blocked"
+                print(f"{stage.name} not run, {', '.join(stage.needs)} failed", flush=True)
+
+    if not dry_run:
+        save_state(state_path, state)
+
+def summary(stages, run_start):
+    print(f"\n{'stage':<16}{'status':<10}{'started s':>10}{'wall s':>10}")
+    for stage in stages.values():
+        started = f"{stage.start - run_start:.1f}" if stage.start else "-"
+        wall = f"{stage.end - stage.start:.1f}" if stage.start and stage.end else "-"
+        status = "ran" if stage.status == "done" else stage.status
+        print(f"{stage.name:<16}{status:<10}{started:>10}{wall:>10}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the reference database, skipping stages whose outputs are up to date.")
+    parser.add_argument("-p", "--phibase", required=True, help="PHI-base CSV")
+    parser.add_argument("-r", "--risk_register", required=True, help="DEFRA risk register CSV")
+    parser.add_argument("-d", "--date", required=True, help="Date in MMYYYY format")
+    parser.add_argument("-o", "--output", required=True, help="Output directory (Pathogen_Database_MMYYYY)")
+    parser.add_argument("-t", "--taxonomy_snapshot", help="Taxonomy snapshot directory from taxonomy.py export, passed to Make_Pathogen_Database.py")
+    parser.add_argument("-m", "--mirror", action="append", default=[], help="Local NCBI mirror, passed to Make_Pathogen_Database.py and download.py (can be repeated)")
+    parser.add_argument("--previous", help="Previous release database for a delta build, passed to download.py")
+    parser.add_argument("--packed", action="store_true", help="Also write the 2-bit packed store of the database, passed to download.py")
+    parser.add_argument("--force", nargs="+", default=[], metavar="STAGE", help="Run these stages even if they are up to date")
+    parser.add_argument("-n", "--dry_run", action="store_true", help="Only show which stages would run")
+    args = parser.parse_args()
+
+    for path in (args.phibase, args.risk_register):
+        if not os.path.isfile(path):
+            parser.error(f"Input file not found: {path}")
+    stages = build_stages(args)
+    unknown = set(args.force) - set(stages)
+    if unknown:
+        parser.error(f"Unknown stages for --force: {', '.join(sorted(unknown))} (stages: {', '.join(stages)})")
+    # A forced stage makes everything after it out of date too
+    force = set(args.force)
+    for stage in stages.values():
+        if force.intersection(stage.needs):
+            force.add(stage.name)
+
+    logs_dir = os.path.join(args.output, "logs")
+    os.makedirs(logs_dir, exist_ok=True)
+    state_path = os.path.join(logs_dir, "stage_state.json")
+    state = load_state(state_path)
+
+    print(f"PHI-base CSV:       {args.phibase}")
+    print(f"Risk Register CSV:  {args.risk_register}")
+    print(f"Date Tag:           {args.date}")
+    print(f"Output directory:   {args.output}", flush=True)
+
+    run_start = time.perf_counter()
+    try:
+        run(stages, state, state_path, logs_dir, force, args.dry_run)
+    except KeyboardInterrupt:
+        for stage in stages.values():
+            if stage.status == "running":
+                stage.process.terminate()
+        raise
+    if not args.dry_run:
+        summary(stages, run_start)
+    if any(stage.status in ("failed", "blocked") for stage in stages.values()):
+        sys.exit(1)
+    if not args.dry_run:
+        print(f"Database: {os.path.join(args.output, f'pathogen_database_{args.date}.fa')}")
+
+if __name__ == "__main__":
+    main()
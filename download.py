@@ -4,25 +4,44 @@
 # Uses the output from Make_Pathogen_Database.py
 # This script downloads FASTA files from NCBI, checks their checksums, modifies headers, and concatenates them into a single database.
 # python scripts/download.py --i Download_MMYY_ --d MMYYYY --o Pathogen_Database_MMYYYY
+# A manifest of where each genome sits in the database is written next to it (pathogen_database_MMYYYY_manifest.json)
+# Delta build: give the previous release and genomes that have not changed are copied across from it, not downloaded again
+# python scripts/download.py --i Download_MMYY_ --d MMYYYY --o Pathogen_Database_MMYYYY --previous Pathogen_Database_MMYYYY/pathogen_database_MMYYYY.fa
+# With --follow genomes are downloaded while Make_Pathogen_Database.py is still selecting them, from the <input>.jsonl it streams
+# (start it after Make_Pathogen_Database.py, which removes the last run's stream as it starts; a stream replaced while it is read is an error)
+# With --group_by_taxid genomes are written in taxid order, the manifest's per-taxid ranges are then one range each (see extract_subset.py)
+# With --packed a 2-bit packed store is written next to the database as well (see packed_store.py)
 
 
 import os
+import sys
+import errno
 import hashlib
 import logging
-import requests
 from urllib.parse import urlparse
 import gzip
 import argparse
 import json
-from tqdm import tqdm
 import shutil
+import time
+from contextlib import nullcontext
+
+from mirror import Mirror, http_get, is_url
+
+MANIFEST_VERSION = 1
+COPY_BUFFER = 1 << 20   #1MB buffer when decompressing genomes into the database
+COPY_CHUNK = 1 << 30    #largest single kernel copy from the previous database
+POLL_INTERVAL = 5       #seconds between checks for new lines when following the selection stream
+
+# Local copies of NCBI files tried before NCBI itself (see mirror.py), set in main from --mirror
+mirror = Mirror()
 
 def download_file(fasta_url, filename):
     logging.info("Downloading %s...", filename)
-    response = requests.get(fasta_url, stream=True)
-    with open(filename, 'wb') as file:
-        for chunk in response.iter_content(chunk_size=8192): #8 bytes
-            file.write(chunk)
+    # From a local mirror if one has it (hard linked if it can be), otherwise NCBI
+    source = mirror.fetch(fasta_url, filename)
+    if source != fasta_url:
+        logging.info("%s taken from mirror %s", filename, source)
 
 # Function to calculate checksum for the newly downloaded file
 def calculate_checksum(file_path):
@@ -34,8 +53,7 @@ def calculate_checksum(file_path):
 
 # Function to extract checksum for a specific file from MD5 URL content
 def extract_checksum(md5_url, filename):
-    response = requests.get(md5_url)
-    for line in response.text.splitlines():
+    for line in mirror.read_text(md5_url).splitlines():
         if filename in line:
             return line.split()[0]
     return None
@@ -46,8 +64,9 @@ def check_and_log_checksum(error_log, filename, md5_url, organism_id, taxid,fast
     if expected_checksum:
         calculated_checksum = calculate_checksum(filename)
         if expected_checksum != calculated_checksum:
-            logging.error(f"Checksum mismatch for {filename}. Redownloading...")
-            download_file(fasta_url, filename)
+            logging.error(f"Checksum mismatch for {filename}. Redownloading from NCBI...")
+            # Straight from NCBI, the mirror copy may be the bad one
+            http_get(fasta_url, filename)
             new_calculated_checksum = calculate_checksum(filename)
             if expected_checksum != new_calculated_checksum:
                 logging.error(f"Failed to download {filename} correctly, after 2 attempts.")
@@ -57,23 +76,17 @@ def check_and_log_checksum(error_log, filename, md5_url, organism_id, taxid,fast
             logging.info(f"Checksum for {filename} matches.")
 
 # Function to modify fasta headers
+# Written to a new file which replaces the old one, so a genome hard linked from a mirror is never changed in place
 def modify_fasta_headers(filename, taxid, organism_name):
-    # Read the content of the file
-    with gzip.open(filename, 'rt') as f:
-        lines = f.readlines()
     logging.info(f"Modifying headers for {filename}...")
-
-    # Modify the headers
-    modified_lines = []
-    for line in lines:
-        if line.startswith(">"):
-            modified_lines.append(f">taxid|{taxid}|{organism_name}|{line[1:]}")
-        else:
-            modified_lines.append(line)
-
-    # Write the modified content back to the file
-    with gzip.open(filename, 'wt') as f:
-        f.writelines(modified_lines)
+    temp_filename = filename + ".tmp"
+    with gzip.open(filename, 'rt') as f, gzip.open(temp_filename, 'wt') as out:
+        for line in f:
+            if line.startswith(">"):
+                out.write(f">taxid|{taxid}|{organism_name}|{line[1:]}")
+            else:
+                out.write(line)
+    os.replace(temp_filename, filename)
 
 # Function to unzip a file
 def unzip_file(input_filename, output_filename):
@@ -81,30 +94,238 @@ def unzip_file(input_filename, output_filename):
         with open(output_filename, 'wb') as outfile:
             shutil.copyfileobj(infile, outfile)
 
+# Entries to download, from <input>.json or, with follow, from <input>.jsonl as Make_Pathogen_Database.py writes it
+# The stream ends with an {"end": true} line, an error is raised if it is incomplete or stops growing for follow_timeout seconds
+def read_download_input(input_prefix, follow=False, follow_timeout=3600):
+    if not follow:
+        with open(input_prefix + '.json', 'r') as f:
+            yield from json.load(f)
+        return
+    stream_path = input_prefix + '.jsonl'
+    last_change = time.monotonic()
+    yielded = 0
+    while True:
+        while not os.path.exists(stream_path):
+            if time.monotonic() - last_change > follow_timeout:
+                raise TimeoutError(f"{stream_path} was not created within {follow_timeout} seconds")
+            time.sleep(POLL_INTERVAL)
+        with open(stream_path, 'r') as f:
+            partial = ""
+            while True:
+                line = f.readline()
+                if line.endswith("\n"):
+                    record = json.loads(partial + line)
+                    partial = ""
+                    last_change = time.monotonic()
+                    if record.get("end"):
+                        if not record.get("complete"):
+                            raise RuntimeError(f"Species selection stopped before finishing, {stream_path} is incomplete")
+                        return
+                    yielded += 1
+                    yield record
+                    continue
+                # nothing new yet, or half a line still being written
+                partial += line
+                if stream_replaced(f, stream_path):
+                    break
+                if time.monotonic() - last_change > follow_timeout:
+                    raise TimeoutError(f"No new entries in {stream_path} for {follow_timeout} seconds")
+                time.sleep(POLL_INTERVAL)
+        # A new run of Make_Pathogen_Database.py removed or truncated the stream being read
+        if yielded:
+            raise RuntimeError(f"{stream_path} was replaced by a new species selection after {yielded} entries of the "
+                               f"previous one had been read, start download.py again")
+        print(f"{stream_path} was replaced by a new species selection, reading it again")
+
+def stream_replaced(f, stream_path):
+    # Removed (a different file or none at that path now) or truncated below what has been read
+    try:
+        st = os.stat(stream_path)
+    except FileNotFoundError:
+        return True
+    return st.st_ino != os.fstat(f.fileno()).st_ino or st.st_size < f.tell()
+
+# Manifest and change list sit next to the database: pathogen_database_MMYYYY_manifest.json / _changes.tsv
+def manifest_path(database_filename):
+    return os.path.splitext(database_filename)[0] + "_manifest.json"
+
+def changes_path(database_filename):
+    return os.path.splitext(database_filename)[0] + "_changes.tsv"
+
+def load_manifest(manifest_filename, database_filename):
+    with open(manifest_filename, 'r') as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise ValueError(f"{manifest_filename} is manifest version {manifest.get('version')}, expected {MANIFEST_VERSION}")
+    # The byte offsets are only any use for the exact file they were written with
+    if os.path.getsize(database_filename) != manifest["size"]:
+        raise ValueError(f"{database_filename} is not the size recorded in {manifest_filename}, was it modified?")
+    return manifest
+
+def write_manifest(manifest_filename, database_filename, entries):
+    # entries hold the byte range of each assembly accession, taxa the ranges of each taxid (a single range when grouped)
+    manifest = {"version": MANIFEST_VERSION, "database": os.path.basename(database_filename),
+                "size": os.path.getsize(database_filename), "taxa": taxid_ranges(entries), "entries": entries}
+    with open(manifest_filename + ".tmp", 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_filename + ".tmp", manifest_filename)
+
+# taxid -> [[offset, length], ...] in database order, neighbouring genomes of a taxid merged into one range
+def taxid_ranges(entries):
+    taxa = {}
+    for entry in entries:
+        ranges = taxa.setdefault(str(entry['taxid']), [])
+        if ranges and ranges[-1][0] + ranges[-1][1] == entry['offset']:
+            ranges[-1][1] += entry['length']
+        else:
+            ranges.append([entry['offset'], entry['length']])
+    return taxa
+
+# Database order with --group_by_taxid: by taxid, then the order the genomes were selected in
+def group_by_taxid(entries):
+    return sorted(entries, key=lambda entry: int(entry['taxid']))
+
+# A genome can be copied from the previous database if it is the same assembly version with the same header prefix
+def genome_key(entry):
+    return (entry['filename'], str(entry['taxid']), entry['organism_name'])
+
+def copy_range(src_fd, dst_fd, offset, length):
+    #Copy length bytes at offset in src_fd to the current position of dst_fd
+    #copy_file_range and sendfile copy in the kernel (copy_file_range can share blocks on reflink filesystems),
+    #each is only tried while the one before is unsupported, the last resort is pread/write
+    remaining = length
+    for method in ("copy_file_range", "sendfile"):
+        if not hasattr(os, method):
+            continue
+        try:
+            while remaining:
+                if method == "copy_file_range":
+                    copied = os.copy_file_range(src_fd, dst_fd, min(remaining, COPY_CHUNK), offset)
+                else:
+                    copied = os.sendfile(dst_fd, src_fd, offset, min(remaining, COPY_CHUNK))
+                if copied == 0:
+                    raise ValueError("Previous database ended before the end of a genome in its manifest")
+                offset += copied
+                remaining -= copied
+            return
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP):
+                raise
+    while remaining:
+        block = os.pread(src_fd, min(remaining, COPY_BUFFER), offset)
+        if not block:
+            raise ValueError("Previous database ended before the end of a genome in its manifest")
+        view = memoryview(block)
+        while view:
+            view = view[os.write(dst_fd, view):]
+        offset += len(block)
+        remaining -= len(block)
+
 # Function to concatenate files into one large database
-def concatenate_files(file_list, output_filename):
-    with open(output_filename, 'wb') as outfile:
-        for filename in file_list:
-            temp_unzipped_filename = filename.replace('.gz', '')
-            unzip_file(filename, temp_unzipped_filename)
-            with open(temp_unzipped_filename, 'rb') as infile:
-                shutil.copyfileobj(infile, outfile)
-            os.remove(temp_unzipped_filename)  # Remove the temporary unzipped file
+# entries are dicts with filename, assembly_accession, taxid and organism_name, in database order
+# reused maps genome_key to the entry for that genome in the previous manifest, those are copied from previous_filename
+# Returns the manifest entries (byte offset and length of each genome in the new database)
+def concatenate_files(entries, output_filename, previous_filename=None, reused=None):
+    reused = reused or {}
+    manifest_entries = []
+    position = 0
+    with open(output_filename, 'wb') as outfile, \
+            (open(previous_filename, 'rb') if previous_filename else nullcontext()) as previous:
+        run_offset, run_length = 0, 0   #neighbouring reused genomes are copied as one range
 
+        def copy_run():
+            if run_length:
+                outfile.flush()
+                copy_range(previous.fileno(), outfile.fileno(), run_offset, run_length)
+                outfile.seek(0, os.SEEK_END)
+
+        for entry in entries:
+            previous_entry = reused.get(genome_key(entry))
+            if previous_entry is not None:
+                if run_length and run_offset + run_length == previous_entry['offset']:
+                    run_length += previous_entry['length']
+                else:
+                    copy_run()
+                    run_offset, run_length = previous_entry['offset'], previous_entry['length']
+                length = previous_entry['length']
+            else:
+                copy_run()
+                run_length = 0
+                # Decompress straight into the database, no temporary unzipped file
+                with gzip.open(entry['filename'], 'rb') as infile:
+                    shutil.copyfileobj(infile, outfile, COPY_BUFFER)
+                length = outfile.tell() - position
+            manifest_entries.append(dict(entry, offset=position, length=length))
+            position += length
+        copy_run()
+    return manifest_entries
+
+# Human readable list of what changed since the previous release
+def write_changes(changes_filename, previous_entries, entries, reused):
+    previous_files = {e['filename']: e for e in previous_entries}
+    current_files = {e['filename'] for e in entries}
+    previous_taxids = {}
+    for e in previous_entries:
+        if e['filename'] not in current_files:
+            previous_taxids.setdefault(str(e['taxid']), []).append(e['filename'])
+
+    rows = []
+    for entry in entries:
+        taxid = str(entry['taxid'])
+        if genome_key(entry) in reused:
+            rows.append(("unchanged", taxid, entry['organism_name'], entry['filename'], entry['filename']))
+        elif entry['filename'] in previous_files:
+            # same assembly but the header prefix (taxid or organism name) changed
+            rows.append(("relabelled", taxid, entry['organism_name'], entry['filename'], entry['filename']))
+        elif previous_taxids.get(taxid):
+            rows.append(("replaced", taxid, entry['organism_name'], entry['filename'], previous_taxids[taxid].pop(0)))
+        else:
+            rows.append(("added", taxid, entry['organism_name'], entry['filename'], ""))
+    for taxid, filenames in previous_taxids.items():
+        for filename in filenames:
+            rows.append(("removed", taxid, previous_files[filename]['organism_name'], "", filename))
+
+    counts = {}
+    for row in rows:
+        counts[row[0]] = counts.get(row[0], 0) + 1
+    with open(changes_filename, 'w') as f:
+        f.write("# " + ", ".join(f"{count} {status}" for status, count in counts.items()) + "\n")
+        f.write("status\ttaxid\torganism_name\tfile\tprevious_file\n")
+        for row in rows:
+            f.write("\t".join(row) + "\n")
+    return counts
 
-def main():
-    # Ensure the download directory exists
-    os.makedirs("download", exist_ok=True)
-    os.chdir("download")
 
+def main():
     # Add command line arguments
     parser = argparse.ArgumentParser(description="Provide Date as a prefix and input file")
     parser.add_argument("-i", "--input", required=True, help="Input file with list of URLs")
     parser.add_argument("-d", "--date", required=True, help="Date in MMYYYY format")
     parser.add_argument("-o", "--output", required=True, help="Output Directory (Pathogen_Database_MMYYYY)")
+    parser.add_argument("-p", "--previous", help="Previous release database (pathogen_database_MMYYYY.fa) to copy unchanged genomes from")
+    parser.add_argument("--previous_manifest", help="Manifest of the previous database (default: next to it, <database>_manifest.json)")
+    parser.add_argument("-m", "--mirror", action="append", default=[],
+                        help="Local directory or HTTP base URL laid out like the NCBI FTP site, tried before NCBI (can be repeated)")
+    parser.add_argument("-f", "--follow", action="store_true",
+                        help="Read <input>.jsonl as Make_Pathogen_Database.py writes it, downloading while species are still being selected")
+    parser.add_argument("--follow_timeout", type=int, default=3600,
+                        help="With --follow, give up if no new entry arrives for this many seconds (default: 3600)")
+    parser.add_argument("-g", "--group_by_taxid", action="store_true",
+                        help="Write the genomes of each taxid next to each other, so extract_subset.py copies one range per taxid")
+    parser.add_argument("--packed", action="store_true",
+                        help="Also write a 2-bit packed store of the database for random access (<database>_packed, see packed_store.py)")
 
     # Parse the command line arguments
     args = parser.parse_args()
+    from tqdm import tqdm  # not needed for --help or argument errors
+
+    # Ensure the download directory exists
+    os.makedirs("download", exist_ok=True)
+    os.chdir("download")
+
+    # Relative mirror directories are from where the script was started, not download/
+    global mirror
+    mirror = Mirror([m if is_url(m) else os.path.join("..", m) for m in args.mirror])
 
     # Check log directory exists, if not make it
     if not os.path.exists("../" + args.output + '/logs/'):
@@ -126,12 +347,29 @@ def main():
     error_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
     logging.getLogger().addHandler(error_handler)
 
-    all_files = []
+    output_filename = "../" + args.output + '/pathogen_database_' + args.date + ".fa"
+
+    # Genomes in the previous release, by filename/taxid/organism name
+    previous_filename = None
+    previous_entries = []
+    if args.previous:
+        previous_filename = os.path.join("..", args.previous)
+        previous_manifest = os.path.join("..", args.previous_manifest) if args.previous_manifest else manifest_path(previous_filename)
+        if os.path.exists(output_filename) and os.path.samefile(previous_filename, output_filename):
+            parser.error("--previous can not be the database being written, use a different date or output directory")
+        try:
+            previous_entries = load_manifest(previous_manifest, previous_filename)["entries"]
+        except (OSError, ValueError, KeyError) as e:
+            parser.error(f"Can not use the previous database for a delta build: {e}")
+        logging.info(f"Delta build against {previous_filename} ({len(previous_entries)} genomes)")
+    previous_genomes = {genome_key(e): e for e in previous_entries}
 
-    # Open the JSON file and process it
-    with open("../" + args.input + '.json', 'r') as f:
-        data = json.load(f)
-        for entry in tqdm(data, desc="Processing entries"):
+    entries = []
+    reused = {}
+
+    # Open the JSON file (or follow the JSON Lines stream) and process it, entries are handled in the order they were selected
+    try:
+        for entry in tqdm(read_download_input("../" + args.input, args.follow, args.follow_timeout), desc="Processing entries"):
             taxid = entry['selected_taxid']
             organism_name = entry['organism_name']
             assembly_accession = entry['assembly_accession']
@@ -139,21 +377,55 @@ def main():
             md5_url = entry['dlLinkMD5']
             filename = fasta_url.strip('/').split('/')[-2] + "_genomic.fna.gz"
 
-            all_files.append(filename)
+            genome = {"filename": filename, "assembly_accession": assembly_accession,
+                      "taxid": str(taxid), "organism_name": organism_name}
 
+            # Unchanged since the previous release, copied from there so no download needed
+            if genome_key(genome) in previous_genomes:
+                reused[genome_key(genome)] = previous_genomes[genome_key(genome)]
+                logging.info(f"{filename} unchanged since the previous release, copying it from there.")
             # Check if the file already exists in the download directory
-            if not os.path.isfile(filename):
-                download_file(fasta_url, filename)
-                check_and_log_checksum(error_log, filename, md5_url, taxid, organism_name, fasta_url)
+            elif not os.path.isfile(filename):
+                try:
+                    download_file(fasta_url, filename)
+                    check_and_log_checksum(error_log, filename, md5_url, taxid, organism_name, fasta_url)
+                except Exception as e:
+                    logging.error(f"Failed to download {filename}: {e}")
+                    if os.path.exists(filename):
+                        os.remove(filename)
+                    with open(error_log, 'a') as err_log:
+                        err_log.write(f"Organism: {organism_name}, TaxID: {taxid}, MD5 URL: {md5_url}, FASTA URL: {fasta_url}\n")
+                    continue
                 modify_fasta_headers(filename, taxid, organism_name)
             else:
                 logging.info(f"{filename} already exists, skipping download.")
-        
+            entries.append(genome)
+    except (TimeoutError, RuntimeError) as e:
+        logging.error(str(e))
+        sys.exit(str(e))
+
+    if mirror.summary():
+        logging.info(mirror.summary())
+        print(mirror.summary())
+
+    if args.group_by_taxid:
+        entries = group_by_taxid(entries)
+
     # Concatenate the downloaded files into one large database - save in the output directory
-    output_filename = "../" + args.output + '/pathogen_database_' + args.date + ".fa"
-    # Ensure the output file exists before concatenation
-    concatenate_files(all_files, output_filename)
+    manifest_entries = concatenate_files(entries, output_filename, previous_filename, reused)
     logging.info(f"Concatenated files into {output_filename}")
+    write_manifest(manifest_path(output_filename), output_filename, manifest_entries)
+    logging.info(f"Wrote genome offsets to {manifest_path(output_filename)}")
+
+    if args.packed:
+        from packed_store import pack_fasta
+        packed_dir = os.path.splitext(output_filename)[0] + "_packed"
+        meta = pack_fasta(output_filename, packed_dir)
+        logging.info(f"Wrote 2-bit packed store {packed_dir}: {meta['n_sequences']} sequences in {meta['packed_bytes']} bytes")
+
+    if args.previous:
+        counts = write_changes(changes_path(output_filename), previous_entries, entries, reused)
+        logging.info(f"Changes since the previous release written to {changes_path(output_filename)}: {counts}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
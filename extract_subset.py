@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# Builds a reduced reference from the pathogen database for a targeted run, e.g. only the regulated species or one genus
+# Uses the manifest download.py writes next to the database (pathogen_database_MMYYYY_manifest.json): the byte range of
+# every genome is known, so the chosen genomes are copied straight across (in the kernel where it can) with no FASTA parsing
+# Build the database with --group_by_taxid and each taxid is a single range
+# Taxa are given as taxids or scientific names, everything below them is included (subspecies, formae speciales, strains)
+# python scripts/extract_subset.py -d Pathogen_Database_MMYYYY/pathogen_database_MMYYYY.fa -t 5506 "Phytophthora" -o fusarium_phytophthora.fa
+# python scripts/extract_subset.py -d Pathogen_Database_MMYYYY/pathogen_database_MMYYYY.fa -l regulated_taxids.txt -s taxonomy_snapshot -o regulated.fa
+# python scripts/extract_subset.py -d Pathogen_Database_MMYYYY/pathogen_database_MMYYYY.fa -a GCF_000149955.1 -o one_genome.fa
+
+import os
+import sys
+import argparse
+
+from download import load_manifest, manifest_path, write_manifest, copy_range
+
+def load_taxonomy_handle(taxonomy_snapshot=None):
+    #Snapshot from taxonomy.py if given, otherwise ete3's NCBITaxa (same calls)
+    if taxonomy_snapshot:
+        from taxonomy import TaxonomySnapshot
+        return TaxonomySnapshot(taxonomy_snapshot)
+    from ete3 import NCBITaxa
+    return NCBITaxa()
+
+def read_list(path):
+    #One taxid, name or accession per line, blank lines and # comments skipped
+    with open(path, 'r') as f:
+        return [line.split('#')[0].strip() for line in f if line.split('#')[0].strip()]
+
+def resolve_taxa(ncbi, taxa):
+    #taxids as ints, names through the taxonomy, unknown names reported and left out
+    names = [t for t in taxa if not t.isdigit()]
+    translated = ncbi.get_name_translator(names) if names else {}
+    taxids = set()
+    for taxon in taxa:
+        if taxon.isdigit():
+            taxids.add(int(taxon))
+        elif translated.get(taxon):
+            taxids.update(int(t) for t in translated[taxon])
+        else:
+            print(f"No taxid for {taxon}, skipped", file=sys.stderr)
+    return taxids
+
+def select_taxids(ncbi, database_taxids, wanted):
+    #Database taxids that are one of wanted or below one, checked up each lineage rather than listing every
+    #descendant of a genus, the database only has a few thousand taxids
+    #A taxid the taxonomy does not know (ete3 raises ValueError for it) is only kept if it was asked for itself
+    selected = set()
+    for taxid in database_taxids:
+        if ncbi is None:
+            lineage = [int(taxid)]
+        else:
+            try:
+                lineage = ncbi.get_lineage(int(taxid)) or [int(taxid)]
+            except ValueError as e:
+                print(f"Warning: no lineage for taxid {taxid} ({e}), only matched exactly")
+                lineage = [int(taxid)]
+        if wanted.intersection(lineage):
+            selected.add(taxid)
+    return selected
+
+def merge_ranges(ranges):
+    #Sorted by offset, touching ranges joined so each is one copy
+    merged = []
+    for offset, length in sorted(ranges):
+        if merged and merged[-1][0] + merged[-1][1] == offset:
+            merged[-1][1] += length
+        else:
+            merged.append([offset, length])
+    return merged
+
+def extract(database_filename, entries, output_filename):
+    #Copies entries (in database order) into output_filename, returns their manifest entries in the new file
+    entries = sorted(entries, key=lambda entry: entry['offset'])
+    position = 0
+    subset_entries = []
+    for entry in entries:
+        subset_entries.append(dict(entry, offset=position))
+        position += entry['length']
+    with open(database_filename, 'rb') as database, open(output_filename, 'wb') as out:
+        for offset, length in merge_ranges([(e['offset'], e['length']) for e in entries]):
+            copy_range(database.fileno(), out.fileno(), offset, length)
+    return subset_entries
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract the genomes of some taxa from the pathogen database using its manifest.")
+    parser.add_argument("-d", "--database", required=True, help="Pathogen database (pathogen_database_MMYYYY.fa)")
+    parser.add_argument("-m", "--manifest", help="Manifest of the database (default: next to it, <database>_manifest.json)")
+    parser.add_argument("-t", "--taxa", nargs="+", default=[], help="Taxids or scientific names, descendants included")
+    parser.add_argument("-l", "--taxa_list", help="File with one taxid or name per line")
+    parser.add_argument("-a", "--accessions", nargs="+", default=[], help="Assembly accessions to include as well")
+    parser.add_argument("-s", "--taxonomy_snapshot", help="Taxonomy snapshot directory from taxonomy.py export, used instead of ete3's NCBITaxa")
+    parser.add_argument("--exact", action="store_true", help="Only the taxids given, not their descendants (no taxonomy needed)")
+    parser.add_argument("-o", "--output", required=True, help="Output FASTA, its manifest is written next to it")
+    args = parser.parse_args()
+
+    taxa = args.taxa + (read_list(args.taxa_list) if args.taxa_list else [])
+    if not taxa and not args.accessions:
+        parser.error("Give taxa with --taxa/--taxa_list or accessions with --accessions")
+    if args.exact and not all(t.isdigit() for t in taxa):
+        parser.error("--exact takes taxids only, names need the taxonomy")
+    if os.path.exists(args.output) and os.path.samefile(args.output, args.database):
+        parser.error("--output can not be the database itself")
+
+    try:
+        manifest = load_manifest(args.manifest or manifest_path(args.database), args.database)
+    except (OSError, ValueError, KeyError) as e:
+        parser.error(f"Can not read the database manifest: {e}")
+    entries = manifest["entries"]
+
+    ncbi = None if args.exact or not taxa else load_taxonomy_handle(args.taxonomy_snapshot)
+    wanted = resolve_taxa(ncbi, taxa) if ncbi else {int(t) for t in taxa}
+    selected = select_taxids(ncbi, {str(entry['taxid']) for entry in entries}, wanted)
+    accessions = set(args.accessions)
+    chosen = [entry for entry in entries if str(entry['taxid']) in selected or entry['assembly_accession'] in accessions]
+    missing = accessions - {entry['assembly_accession'] for entry in chosen}
+    if missing:
+        print(f"Accessions not in the database: {', '.join(sorted(missing))}", file=sys.stderr)
+
+    subset_entries = extract(args.database, chosen, args.output)
+    write_manifest(manifest_path(args.output), args.output, subset_entries)
+    print(f"Wrote {len(subset_entries)} genomes from {len(selected)} taxids "
+          f"({sum(e['length'] for e in subset_entries) / 1e6:.1f} MB, "
+          f"{len(merge_ranges([(e['offset'], e['length']) for e in chosen]))} ranges) to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,8 @@
 #this script doesn't work on the hpc without a singualrity container for BIO
-import sys
-from Bio import SeqIO  # Biopython library for parsing FASTA files
-
-if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python genome_lengths_from_fasta.py <input_fasta_file> <output_prefix>")
-        sys.exit(1)
-
-    input_file = sys.argv[1]
-    output_prefix = sys.argv[2]
+import argparse
 
 def generate_genome_length_table(fasta_file, output_prefix):
+    from Bio import SeqIO  # Biopython library for parsing FASTA files, only loaded once there is a file to parse
     genome_lengths = {}
     output_file = f"{output_prefix}_genome_lengths.tsv"
     
@@ -33,6 +25,13 @@ def generate_genome_length_table(fasta_file, output_prefix):
         for taxa_id, total_length in genome_lengths.items():
             out_f.write(f"{taxa_id}\t{total_length}\n")
 
+def main():
+    parser = argparse.ArgumentParser(description="Total genome length per taxaID of a database FASTA with taxid|<taxaID>|... headers.")
+    parser.add_argument("input_fasta_file", help="Database FASTA file")
+    parser.add_argument("output_prefix", help="Output prefix, writes <output_prefix>_genome_lengths.tsv")
+    args = parser.parse_args()
 
+    generate_genome_length_table(args.input_fasta_file, args.output_prefix)
 
-generate_genome_length_table(input_file, output_prefix)
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 #!/bin/bash
+#Replaced by lineage_table.py, which needs no taxonkit and gives one row per taxaID:
+#python scripts/lineage_table.py ${sample}_all_taxaID_count.tsv ${sample}_taxaID_lineage_sep_head.csv --taxonomy taxonomy_snapshot
 #A script to run on the all_taxaID_count.tsv file, but need to run off HPC to download taxonkit
 #conda install -c bioconda taxonkit 
 #https://bioinf.shenwei.me/taxonkit/usage/
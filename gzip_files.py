@@ -1,36 +1,118 @@
 import os
-import gzip
-import shutil
+import zlib
+import struct
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # This script gzips uncompressed FASTA files in the specified directory, need them to be zipped for download.py to work.
-
-# Set the directory where files are stored
-download_dir = "download"
+# Output is BGZF (the blocked gzip used by samtools/htslib): a series of independent gzip members of at most 64 KB,
+# so blocks are compressed in parallel and the file can later be indexed for random access (--index writes a .gzi).
+# It is still an ordinary multi-member gzip file, gzip.open in download.py reads it unchanged.
+# python scripts/gzip_files.py                        (everything in download/, all cores)
+# python scripts/gzip_files.py -d download -t 8 -j 2  (8 compression threads shared by 2 files at a time)
 
 # File extensions to target
 uncompressed_exts = [".fna", ".fa", ".fasta"]
 
-# Loop through the download directory
-for filename in os.listdir(download_dir):
-    filepath = os.path.join(download_dir, filename)
+# Uncompressed bytes per block, as htslib uses, so even incompressible data fits a block's 16 bit size field
+BLOCK_SIZE = 0xff00
+# The empty block htslib writes last, marking the file as complete
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
 
-    # Check if it's an uncompressed FASTA file
-    if any(filename.endswith(ext) for ext in uncompressed_exts):
-        gzipped_path = filepath + ".gz"
 
-        # Skip if gzipped version already exists
-        if os.path.exists(gzipped_path):
-            print(f"Skipping {filename} (gzipped version already exists)")
-            # delete the unzipped version 
-            os.remove(filepath)
-            print(f"Removed unzipped version: {filename}")
-            continue
+def compress_block(data, level):
+    # One BGZF block: gzip header with the BC extra field holding the block size, raw deflate, CRC32 and length
+    # zlib releases the GIL while compressing, so blocks on different threads run on different cores
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    header = struct.pack("<4BI2BH2BHH", 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord('B'), ord('C'), 2,
+                         18 + len(deflated) + 8 - 1)
+    return header + deflated + struct.pack("<II", zlib.crc32(data), len(data))
 
-        # Gzip the file
-        print(f"Gzipping {filename}...")
-        with open(filepath, 'rb') as f_in, gzip.open(gzipped_path, 'wb') as f_out:
-            shutil.copyfileobj(f_in, f_out)
 
-        # Optionally delete original
+def bgzip_file(filepath, gzipped_path, pool, threads, level=6, index=False):
+    # Reads ahead at most 2 blocks per thread so memory stays small however big the genome is
+    temp_path = gzipped_path + ".tmp"
+    offsets = []
+    compressed_offset = uncompressed_offset = 0
+    pending = deque()
+    with open(filepath, 'rb') as f_in, open(temp_path, 'wb') as f_out:
+        def write_next():
+            nonlocal compressed_offset, uncompressed_offset
+            block, length = pending.popleft()
+            block = block.result()
+            f_out.write(block)
+            compressed_offset += len(block)
+            uncompressed_offset += length
+            offsets.append((compressed_offset, uncompressed_offset))
+
+        while True:
+            data = f_in.read(BLOCK_SIZE)
+            if not data:
+                break
+            pending.append((pool.submit(compress_block, data, level), len(data)))
+            if len(pending) >= 2 * threads:
+                write_next()
+        while pending:
+            write_next()
+        f_out.write(EOF_BLOCK)
+    # Written under a temporary name, a .gz left by an interrupted run would be taken as finished next time
+    os.replace(temp_path, gzipped_path)
+    if index:
+        write_gzi(gzipped_path + ".gzi", offsets[:-1])
+    return compressed_offset
+
+
+def write_gzi(path, offsets):
+    # htslib .gzi: number of entries then (compressed, uncompressed) offset of every block start after the first
+    with open(path, 'wb') as gzi:
+        gzi.write(struct.pack("<Q", len(offsets)))
+        for compressed_offset, uncompressed_offset in offsets:
+            gzi.write(struct.pack("<QQ", compressed_offset, uncompressed_offset))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="BGZF compress uncompressed FASTA files for download.py.")
+    parser.add_argument("-d", "--download_dir", default="download", help="Directory of FASTA files (default: download)")
+    parser.add_argument("-t", "--threads", type=int, default=os.cpu_count() or 1,
+                        help="Compression threads shared by all files (default: all cores)")
+    parser.add_argument("-j", "--files", type=int, default=2, help="Files compressed at the same time (default: 2)")
+    parser.add_argument("-l", "--level", type=int, default=6, choices=range(1, 10), metavar="1-9",
+                        help="Compression level (default: 6)")
+    parser.add_argument("--index", action="store_true", help="Also write a .gzi index of each file for random access")
+    args = parser.parse_args()
+
+    to_compress = []
+    # Loop through the download directory
+    for filename in sorted(os.listdir(args.download_dir)):
+        filepath = os.path.join(args.download_dir, filename)
+
+        # Check if it's an uncompressed FASTA file
+        if any(filename.endswith(ext) for ext in uncompressed_exts):
+            gzipped_path = filepath + ".gz"
+
+            # Skip if gzipped version already exists
+            if os.path.exists(gzipped_path):
+                print(f"Skipping {filename} (gzipped version already exists)")
+                # delete the unzipped version
+                os.remove(filepath)
+                print(f"Removed unzipped version: {filename}")
+                continue
+            to_compress.append((filename, filepath, gzipped_path))
+
+    def compress(filename, filepath, gzipped_path):
+        print(f"Gzipping {filename}...")
+        bgzip_file(filepath, gzipped_path, block_pool, args.threads, args.level, args.index)
         os.remove(filepath)
         print(f"Compressed and removed: {filename}")
+
+    # Blocks from every file share one pool, so the CPU budget holds however many files are in flight
+    with ThreadPoolExecutor(max_workers=args.threads) as block_pool, \
+            ThreadPoolExecutor(max_workers=max(1, args.files)) as file_pool:
+        for future in [file_pool.submit(compress, *entry) for entry in to_compress]:
+            future.result()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@
 # python scripts/identify_missing_species.py Pathogen_Database_042025_v2/phibase_042025.csv Pathogen_species Pathogen_Database_042025_v2/042025_download_input.json Pathogen_Database_042025_v2/missing_species.csv
 
 import csv
-import sys
+import argparse
 
 def read_species_csv(csv_path, species_col):
 	species = set()
@@ -36,16 +36,17 @@ def read_species_json(json_path):
 
 def main():
 
-	# Hardcoded column name and index
-
-	if len(sys.argv) != 5:
-		print("Usage: python identify_missing_species.py <csv_file> <species_col> <json_file> <output_file>")
-		sys.exit(1)
-
-	csv_file = sys.argv[1]
-	csv_species_col = sys.argv[2]
-	json_file = sys.argv[3]
-	output_file = sys.argv[4]
+	parser = argparse.ArgumentParser(description="Write the rows of a CSV whose species are not in a download list JSON.")
+	parser.add_argument("csv_file", help="CSV with a species column, e.g. phibase_MMYYYY.csv")
+	parser.add_argument("species_col", help="Name of the species column in csv_file, e.g. Pathogen_species")
+	parser.add_argument("json_file", help="Download list from Make_Pathogen_Database.py (<prefix>download_input.json)")
+	parser.add_argument("output_file", help="Output CSV of the missing species, with all the columns of csv_file")
+	args = parser.parse_args()
+
+	csv_file = args.csv_file
+	csv_species_col = args.species_col
+	json_file = args.json_file
+	output_file = args.output_file
 
 	csv_species = read_species_csv(csv_file, csv_species_col)
 	json_species = read_species_json(json_file)
@@ -0,0 +1,57 @@
+#!/usr/bin/python
+
+#A script to turn the all_taxaID_count.tsv file into a lineage table, replaces get_taxaID_lineage.sh (no taxonkit needed)
+#One row per taxaID (first column of the input) in the order they first appear, ranks with no name are "Unassigned"
+#Uses a taxonomy snapshot made with: python taxonomy.py export -o taxonomy_snapshot (or the ete3 sqlite database)
+#python lineage_table.py PHIbase_24hr_all_taxaID_count.tsv PHIbase_24hr_taxaID_lineage_sep_head.csv --taxonomy taxonomy_snapshot
+#Can now use this file in RStudio or pandas to plot
+
+import csv, argparse
+
+from taxonomy import load_taxonomy, Taxonomy, DEFAULT_TAXDB
+
+#Same columns as taxonkit reformat's default "{k};{p};{c};{o};{f};{g};{s}", where k is the superkingdom (now domain)
+HEADER = ["taxid", "kindom", "phylum", "class", "order", "family", "genus", "species"]
+RANKS = [("superkingdom", "domain"), ("phylum",), ("class",), ("order",), ("family",), ("genus",), ("species",)]
+UNASSIGNED = "Unassigned"
+
+def read_taxaIDs(counts_file):
+    taxaIDs = {}
+    with open(counts_file, 'r') as counts_f:
+        for line in counts_f:
+            taxaID = line.split('\t', 1)[0].strip()
+            if taxaID:
+                taxaIDs.setdefault(taxaID, None)
+    return list(taxaIDs)
+
+def lineage_row(taxonomy, taxaID):
+    taxid = taxonomy.resolve(taxaID) if taxaID.isdigit() else None
+    if taxid is None:
+        print(f"Warning: taxaID {taxaID} not found in the taxonomy")
+        return [taxaID] + [UNASSIGNED] * len(RANKS)
+    by_rank = {}
+    for node, (name, rank) in taxonomy.names_and_ranks(taxonomy.lineage(taxid)).items():
+        by_rank.setdefault(rank, name)
+    return [taxaID] + [next((by_rank[r] for r in ranks if r in by_rank), UNASSIGNED) for ranks in RANKS]
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a kingdom to species lineage CSV from an all_taxaID_count.tsv file.")
+    parser.add_argument("input", help="Tab separated file with taxaIDs in the first column (e.g. all_taxaID_count.tsv)")
+    parser.add_argument("output", help="Output CSV")
+    parser.add_argument("--taxonomy", default=DEFAULT_TAXDB, help=f"Taxonomy snapshot directory or ete3 sqlite database (default: {DEFAULT_TAXDB})")
+    args = parser.parse_args()
+
+    taxonomy = load_taxonomy(args.taxonomy)
+    if type(taxonomy) is Taxonomy:
+        print("Tip: export a snapshot with taxonomy.py export, name lookups are much faster than from sqlite")
+
+    taxaIDs = read_taxaIDs(args.input)
+    with open(args.output, 'w', newline='') as out:
+        writer = csv.writer(out)
+        writer.writerow(HEADER)
+        for taxaID in taxaIDs:
+            writer.writerow(lineage_row(taxonomy, taxaID))
+    print(f"Wrote lineages for {len(taxaIDs)} taxaIDs to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+
+#Local copies of NCBI files, tried before going to NCBI over the network
+#A mirror is either a directory laid out like the NCBI FTP site (e.g. /shared/ncbi/genomes/all/GCF/000/...) or the base URL
+#of an internal HTTP mirror with the same layout. URLs in download_input.json stay the NCBI ones, only the fetch is redirected:
+#https://ftp.ncbi.nlm.nih.gov/genomes/all/GCF/... -> <mirror>/genomes/all/GCF/...
+#Files found in a directory mirror are hard linked when it is on the same filesystem (no copy), otherwise copied
+#Mirrors are tried in the order given, NCBI is only used when none of them have the file
+#Used by Make_Pathogen_Database.py (assembly stats) and download.py (genomes and md5checksums.txt) with --mirror
+
+import os, errno, shutil
+from urllib.parse import urlsplit
+
+REQUEST_TIMEOUT = 30  # seconds
+CHUNK_SIZE = 1 << 20
+
+def is_url(source):
+    return source.startswith(("http://", "https://"))
+
+def link_or_copy(source_path, filename):
+    #Hard link when possible, True if linked
+    if os.path.lexists(filename):
+        os.remove(filename)
+    try:
+        os.link(source_path, filename)
+        return True
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EACCES, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP):
+            raise
+    #Different filesystem, copyfile uses the kernel's sendfile/copy_file_range where it can
+    shutil.copyfile(source_path, filename)
+    return False
+
+def http_get(url, filename=None, missing_ok=False):
+    #Streams url into filename (or returns the text if no filename), None if missing_ok and the server has no such file
+    import requests  # only needed once something is fetched over HTTP
+    response = requests.get(url, stream=True, timeout=REQUEST_TIMEOUT)
+    if missing_ok and response.status_code == 404:
+        response.close()
+        return None
+    response.raise_for_status()
+    if filename is None:
+        return response.text
+    # A new file rather than truncating, filename may be a hard link into a mirror
+    if os.path.lexists(filename):
+        os.remove(filename)
+    with open(filename, 'wb') as file:
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            file.write(chunk)
+    return filename
+
+class Mirror:
+    def __init__(self, sources=()):
+        self.sources = [source.rstrip("/") for source in sources]
+        self.hits = {source: 0 for source in self.sources}
+        self.misses = 0
+        self.linked = 0
+        self.copied = 0
+
+    def _mirror_location(self, source, url):
+        path = urlsplit(url).path
+        if is_url(source):
+            return source + path
+        return os.path.join(source, path.lstrip("/"))
+
+    def fetch(self, url, filename):
+        #Writes the file at url to filename, from the first mirror that has it, otherwise from url itself
+        #Returns where it came from
+        for source in self.sources:
+            location = self._mirror_location(source, url)
+            if is_url(source):
+                try:
+                    if http_get(location, filename, missing_ok=True) is None:
+                        continue
+                except Exception as e:
+                    print(f"Mirror {source} failed for {url}: {e}")
+                    continue
+            elif os.path.isfile(location):
+                if link_or_copy(location, filename):
+                    self.linked += 1
+                else:
+                    self.copied += 1
+            else:
+                continue
+            self.hits[source] += 1
+            return source
+        self.misses += 1
+        http_get(url, filename)
+        return url
+
+    def read_text(self, url):
+        #Text of a small file (assembly stats, md5checksums.txt), mirrors first
+        for source in self.sources:
+            location = self._mirror_location(source, url)
+            if is_url(source):
+                try:
+                    text = http_get(location, missing_ok=True)
+                except Exception as e:
+                    print(f"Mirror {source} failed for {url}: {e}")
+                    continue
+                if text is None:
+                    continue
+            elif os.path.isfile(location):
+                with open(location, 'r') as f:
+                    text = f.read()
+            else:
+                continue
+            self.hits[source] += 1
+            return text
+        self.misses += 1
+        return http_get(url)
+
+    def summary(self):
+        total = sum(self.hits.values()) + self.misses
+        if not self.sources or not total:
+            return None
+        hits = sum(self.hits.values())
+        per_source = ", ".join(f"{source} {count}" for source, count in self.hits.items())
+        return (f"Mirror hits {hits}/{total} ({hits / total * 100:.1f}%): {per_source}; {self.misses} from NCBI; "
+                f"{self.linked} files linked, {self.copied} copied")
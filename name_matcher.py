@@ -0,0 +1,164 @@
+#!/usr/bin/python
+
+#Approximate matching of species names against every NCBI scientific name and synonym
+#Used to suggest the closest taxa for names get_taxid can not resolve (spelling variants, authority suffixes, old synonyms)
+#A trigram index is built once into a taxonomy snapshot directory (see taxonomy.py) and memory-mapped on load:
+#python name_matcher.py build --snapshot taxonomy_snapshot
+#python name_matcher.py query --snapshot taxonomy_snapshot "Fusarium oxysporium" "Puccinia graminis Pers."
+#Candidates are the names sharing the most of the query's rarer trigrams, then rescored with difflib
+#The index records which export of the snapshot it was built from; it is built on first use if missing and rebuilt
+#when the snapshot has been exported again
+
+import os, re, json, zlib, hashlib, argparse
+from array import array
+from bisect import bisect_left
+from difflib import SequenceMatcher
+
+from taxonomy import TaxonomySnapshot, map_array
+
+INDEX_FILES = {"fuzzy_keys": 'I', "fuzzy_offsets": 'q', "fuzzy_postings": 'i'}
+INDEX_META = "fuzzy_meta.json"
+RARE_TRIGRAMS = 12     #only the rarest trigrams of a query are used to find candidates
+MAX_CANDIDATES = 200   #candidates rescored per query
+MIN_SCORE = 0.75
+
+#Infraspecific markers that make a name longer than a binomial
+INFRA_MARKERS = {"f.", "f.sp.", "sp.", "pv.", "subsp.", "var.", "race", "forma", "pathovar"}
+
+def normalise(name):
+    #lower case, no punctuation apart from full stops, single spaces
+    name = re.sub(r"[^\w. ]+", " ", str(name).lower())
+    return " ".join(name.split())
+
+def trigram_keys(name):
+    padded = f"  {normalise(name)} "
+    return {zlib.crc32(padded[i:i + 3].encode()) for i in range(len(padded) - 2)}
+
+def query_variants(name):
+    #(variant, weight) pairs: the name as given without anything in brackets, and cut back to a binomial or
+    #trinomial so authorities drop off. A bare binomial is weighted down when the name had a forma specialis,
+    #pathovar etc., so the infraspecific taxon wins over its species
+    name = normalise(re.sub(r"\(.*?\)", " ", str(name)))
+    words = name.split()
+    variants = {name: 1.0}
+    if len(words) > 2:
+        if words[2] in INFRA_MARKERS and len(words) > 3:
+            #keep e.g. "fusarium oxysporum f. sp. lycopersici"
+            marker_end = 5 if words[2:4] == ["f.", "sp."] and len(words) > 4 else 4
+            variants.setdefault(" ".join(words[:marker_end]), 1.0)
+            variants.setdefault(" ".join(words[:2]), 0.9)
+        else:
+            variants.setdefault(" ".join(words[:2]), 1.0)
+    return [(v, weight) for v, weight in variants.items() if v]
+
+def snapshot_id(snapshot_dir):
+    #Hash of the snapshot's meta.json, which taxonomy.py rewrites on every export
+    with open(os.path.join(snapshot_dir, "meta.json"), 'rb') as meta_file:
+        return hashlib.sha1(meta_file.read()).hexdigest()
+
+def index_is_current(snapshot_dir):
+    try:
+        with open(os.path.join(snapshot_dir, INDEX_META), 'r') as meta_file:
+            meta = json.load(meta_file)
+    except (FileNotFoundError, ValueError):
+        return False
+    return meta.get("snapshot") == snapshot_id(snapshot_dir) and all(
+        os.path.exists(os.path.join(snapshot_dir, name + ".bin")) for name in INDEX_FILES)
+
+def build_index(snapshot_dir):
+    snapshot = TaxonomySnapshot(snapshot_dir)
+    #The old index stops being valid as soon as any of its files is rewritten
+    index_meta = os.path.join(snapshot_dir, INDEX_META)
+    if os.path.exists(index_meta):
+        os.remove(index_meta)
+    n_names = len(snapshot.name_offsets) - 1
+    postings_by_key = {}
+    for entry in range(n_names):
+        for key in trigram_keys(snapshot.name_bytes(entry).decode()):
+            postings = postings_by_key.get(key)
+            if postings is None:
+                postings = postings_by_key[key] = array('i')
+            postings.append(entry)
+
+    keys = array('I', sorted(postings_by_key))
+    offsets = array('q', [0])
+    with open(os.path.join(snapshot_dir, "fuzzy_postings.bin"), 'wb') as postings_file:
+        for key in keys:
+            postings = postings_by_key.pop(key)
+            postings.tofile(postings_file)
+            offsets.append(offsets[-1] + len(postings))
+    with open(os.path.join(snapshot_dir, "fuzzy_keys.bin"), 'wb') as keys_file:
+        keys.tofile(keys_file)
+    with open(os.path.join(snapshot_dir, "fuzzy_offsets.bin"), 'wb') as offsets_file:
+        offsets.tofile(offsets_file)
+    #Written last, its presence marks a complete index
+    with open(index_meta, 'w') as meta_file:
+        json.dump({"snapshot": snapshot_id(snapshot_dir), "n_names": n_names}, meta_file, indent=4)
+    return n_names, len(keys)
+
+class NameMatcher:
+    def __init__(self, snapshot_dir, snapshot=None):
+        self.snapshot = snapshot or TaxonomySnapshot(snapshot_dir)
+        if not os.path.exists(os.path.join(snapshot_dir, INDEX_META)):
+            print(f"No name index in {snapshot_dir}, building it")
+            build_index(snapshot_dir)
+        elif not index_is_current(snapshot_dir):
+            #Built from an earlier export, its postings point at the old name entries
+            print(f"Name index in {snapshot_dir} is out of date with the snapshot, rebuilding it")
+            build_index(snapshot_dir)
+        for name, typecode in INDEX_FILES.items():
+            setattr(self, name, map_array(os.path.join(snapshot_dir, name + ".bin"), typecode))
+
+    def _postings(self, key):
+        i = bisect_left(self.fuzzy_keys, key)
+        if i == len(self.fuzzy_keys) or self.fuzzy_keys[i] != key:
+            return None
+        return self.fuzzy_postings[self.fuzzy_offsets[i]:self.fuzzy_offsets[i + 1]]
+
+    def _candidates(self, query):
+        postings = [p for p in (self._postings(key) for key in trigram_keys(query)) if p is not None]
+        postings.sort(key=len)
+        shared = {}
+        for entries in postings[:RARE_TRIGRAMS]:
+            for entry in entries:
+                shared[entry] = shared.get(entry, 0) + 1
+        return sorted(shared, key=shared.get, reverse=True)[:MAX_CANDIDATES]
+
+    def suggest(self, name, limit=5, min_score=MIN_SCORE):
+        #Closest taxa to name as [{"taxid", "name", "score"}], best first, one entry per taxid
+        best = {}
+        for query, weight in query_variants(name):
+            for entry in self._candidates(query):
+                candidate = self.snapshot.name_bytes(entry).decode()
+                score = SequenceMatcher(None, query, normalise(candidate)).ratio() * weight
+                taxid = self.snapshot.name_taxid[entry]
+                if score >= min_score and score > best.get(taxid, (0, None))[0]:
+                    best[taxid] = (score, candidate)
+        ranked = sorted(best.items(), key=lambda item: (-item[1][0], item[0]))[:limit]
+        #report the scientific name, the matched name may be a synonym
+        return [{"taxid": taxid, "name": self.snapshot.name(taxid), "matched": matched, "score": round(score, 3)}
+                for taxid, (score, matched) in ranked]
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the approximate species name index of a taxonomy snapshot.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Build the name index into a snapshot directory")
+    build_parser.add_argument("-s", "--snapshot", required=True, help="Taxonomy snapshot directory from taxonomy.py export")
+    query_parser = subparsers.add_parser("query", help="Suggest taxa for one or more names")
+    query_parser.add_argument("-s", "--snapshot", required=True, help="Taxonomy snapshot directory with a name index")
+    query_parser.add_argument("-n", "--limit", type=int, default=5, help="Suggestions per name (default: 5)")
+    query_parser.add_argument("names", nargs="+", help="Names to look up")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        n_names, n_keys = build_index(args.snapshot)
+        print(f"Indexed {n_names} names under {n_keys} trigrams in {args.snapshot}")
+    else:
+        matcher = NameMatcher(args.snapshot)
+        for name in args.names:
+            print(name)
+            for s in matcher.suggest(name, args.limit):
+                print(f"    {s['taxid']}\t{s['name']}\t(matched {s['matched']}, score {s['score']})")
+
+if __name__ == "__main__":
+    main()
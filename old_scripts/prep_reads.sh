@@ -4,6 +4,7 @@
 #Also calculates contig stats for the barcode - output into different folder
 #Filters the pass reads based on their length
 #Run it within results directory -> ./prep_reads.sh barcode raw_read_location
+#Replaced by prep_reads.py, which reads every file once and also writes read stats (read count, N50, length histogram)
 
 # Check for the correct number of arguments
 if [ "$#" -ne 4 ]; then
@@ -0,0 +1,266 @@
+#!/usr/bin/python
+
+#A 2-bit packed copy of the pathogen database for tools that only need lengths, spot-check subsequences or some taxa
+#Four bases per byte, about a quarter of the size of the FASTA, memory-mapped on load so any sequence's length is an array
+#lookup and any subsequence is read straight from its bytes without touching the rest of the file
+#Anything that is not A, C, G or T (N runs, other IUPAC codes) is kept in a table of runs and lowercase (soft-masked)
+#stretches in a table of mask runs, so exporting gives back the same FASTA (wrapped at each sequence's original line width)
+#The store is a directory of raw arrays like the taxonomy snapshot, meta.json is written last and marks it complete
+#download.py --packed writes one next to the database (pathogen_database_MMYYYY_packed)
+#python packed_store.py pack Pathogen_Database_MMYYYY/pathogen_database_MMYYYY.fa -o Pathogen_Database_MMYYYY/pathogen_database_MMYYYY_packed
+#python packed_store.py lengths Pathogen_Database_MMYYYY/pathogen_database_MMYYYY_packed > lengths.tsv
+#python packed_store.py get Pathogen_Database_MMYYYY/pathogen_database_MMYYYY_packed NC_003070.9:1000-1100
+#python packed_store.py export Pathogen_Database_MMYYYY/pathogen_database_MMYYYY_packed -t 5507 -s taxonomy_snapshot -o fusarium.fa
+
+import os, re, sys, json, argparse
+from array import array
+from bisect import bisect_right
+
+from taxonomy import map_array
+
+STORE_VERSION = 1
+READ_BUFFER = 1 << 20
+EXPORT_CHUNK = 1 << 22  #bases unpacked at a time when exporting, rounded to whole lines
+
+#Per sequence arrays are indexed by sequence number, *_index arrays give each sequence's slice of the run tables
+ARRAYS = {
+    "seq_offsets": 'q', "lengths": 'q', "line_widths": 'i', "taxids": 'i', "header_offsets": 'q',
+    "run_index": 'q', "run_starts": 'q', "run_lengths": 'q', "run_codes": 'B',
+    "mask_index": 'q', "mask_starts": 'q', "mask_lengths": 'q',
+}
+
+#Base k of each group of 4 goes in bits (3 - k) * 2 of the byte, other characters pack as A and are restored from the runs
+def _pack_table(shift):
+    table = bytearray(256)
+    for code, bases in enumerate((b"Aa", b"Cc", b"Gg", b"Tt")):
+        for base in bases:
+            table[base] = code << shift
+    return bytes(table)
+
+PACK_TABLES = [_pack_table(shift) for shift in (6, 4, 2, 0)]
+UNPACK_TABLES = [bytes(b"ACGT"[(byte >> shift) & 3] for byte in range(256)) for shift in (6, 4, 2, 0)]
+RUN_PATTERN = re.compile(rb"([^ACGT])\1*")
+MASK_PATTERN = re.compile(rb"[a-z]+")
+
+def pack(seq):
+    #2-bit pack with whole-sequence integer operations rather than a Python loop per base
+    padded = seq + b"A" * (-len(seq) % 4)
+    packed = 0
+    for k, table in enumerate(PACK_TABLES):
+        packed |= int.from_bytes(padded[k::4].translate(table), 'big')
+    return packed.to_bytes(len(padded) // 4, 'big')
+
+def unpack(packed_bytes):
+    out = bytearray(len(packed_bytes) * 4)
+    for k, table in enumerate(UNPACK_TABLES):
+        out[k::4] = packed_bytes.translate(table)
+    return out
+
+def sequence_id(header):
+    #Database headers are taxid|<taxid>|<organism name>|<original header>, the original ID is the useful name
+    parts = header.split("|", 3)
+    if len(parts) == 4 and parts[0] == "taxid":
+        return parts[3].split()[0] if parts[3].split() else header
+    return header.split()[0] if header.split() else ""
+
+def header_taxid(header):
+    parts = header.split("|", 2)
+    return int(parts[1]) if len(parts) >= 2 and parts[0] == "taxid" and parts[1].isdigit() else -1
+
+def iter_fasta(fasta_file):
+    #(header, sequence bytes, width of its first line) for each record of a binary FASTA stream
+    header, lines = None, []
+    for line in fasta_file:
+        line = line.rstrip(b"\r\n")
+        if line.startswith(b">"):
+            if header is not None:
+                yield header, b"".join(lines), len(lines[0]) if lines else 0
+            header, lines = line[1:].decode(), []
+        elif line:
+            lines.append(line)
+    if header is not None:
+        yield header, b"".join(lines), len(lines[0]) if lines else 0
+
+def pack_fasta(fasta_filename, store_dir):
+    #Writes the store for a FASTA file, returns its meta
+    arrays = {name: array(typecode) for name, typecode in ARRAYS.items()}
+    for name in ("run_index", "mask_index", "header_offsets"):
+        arrays[name].append(0)
+    headers = []
+    header_size = 0
+    position = 0
+    os.makedirs(store_dir, exist_ok=True)
+    # meta.json goes last, remove any old one so a half-written store is never taken as complete
+    if os.path.exists(os.path.join(store_dir, "meta.json")):
+        os.remove(os.path.join(store_dir, "meta.json"))
+    with open(fasta_filename, 'rb', buffering=READ_BUFFER) as fasta_file, \
+            open(os.path.join(store_dir, "packed.bin"), 'wb') as packed_file:
+        for header, seq, width in iter_fasta(fasta_file):
+            arrays["seq_offsets"].append(position)
+            arrays["lengths"].append(len(seq))
+            arrays["line_widths"].append(width)
+            arrays["taxids"].append(header_taxid(header))
+            encoded = header.encode()
+            headers.append(encoded)
+            header_size += len(encoded)
+            arrays["header_offsets"].append(header_size)
+
+            for match in RUN_PATTERN.finditer(seq.upper()):
+                arrays["run_starts"].append(match.start())
+                arrays["run_lengths"].append(match.end() - match.start())
+                arrays["run_codes"].append(match.group()[0])
+            arrays["run_index"].append(len(arrays["run_starts"]))
+            for match in MASK_PATTERN.finditer(seq):
+                arrays["mask_starts"].append(match.start())
+                arrays["mask_lengths"].append(match.end() - match.start())
+            arrays["mask_index"].append(len(arrays["mask_starts"]))
+
+            packed = pack(seq)
+            packed_file.write(packed)
+            position += len(packed)
+
+    for name, values in arrays.items():
+        with open(os.path.join(store_dir, name + ".bin"), 'wb') as array_file:
+            values.tofile(array_file)
+    with open(os.path.join(store_dir, "headers.bin"), 'wb') as headers_file:
+        headers_file.write(b"".join(headers))
+    meta = {"version": STORE_VERSION, "byteorder": sys.byteorder, "source": os.path.abspath(fasta_filename),
+            "source_size": os.path.getsize(fasta_filename), "n_sequences": len(headers),
+            "total_bases": sum(arrays["lengths"]), "packed_bytes": position}
+    with open(os.path.join(store_dir, "meta.json"), 'w') as meta_file:
+        json.dump(meta, meta_file, indent=4)
+    return meta
+
+class PackedStore:
+    #Memory-mapped store written by pack_fasta, sequences are numbered in database order
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, "meta.json"), 'r') as meta_file:
+            meta = json.load(meta_file)
+        if meta.get("version") != STORE_VERSION or meta.get("byteorder") != sys.byteorder:
+            raise ValueError(f"{store_dir} was written by a different version or on a different platform, pack it again")
+        self.meta = meta
+        for name, typecode in ARRAYS.items():
+            setattr(self, name, map_array(os.path.join(store_dir, name + ".bin"), typecode))
+        self.packed = map_array(os.path.join(store_dir, "packed.bin"), 'B')
+        self.headers_bin = map_array(os.path.join(store_dir, "headers.bin"), 'B')
+        self._ids = None
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def header(self, i):
+        return bytes(self.headers_bin[self.header_offsets[i]:self.header_offsets[i + 1]]).decode()
+
+    def find(self, name):
+        #Sequence number of an ID (see sequence_id), the lookup table is built on first use
+        if self._ids is None:
+            self._ids = {}
+            for i in range(len(self)):
+                self._ids.setdefault(sequence_id(self.header(i)), i)
+        return self._ids.get(name)
+
+    def sequence(self, i, start=0, end=None):
+        #Bases start..end (0-based, end exclusive) of sequence i, as in the FASTA
+        length = self.lengths[i]
+        end = length if end is None else min(end, length)
+        start = max(0, start)
+        if start >= end:
+            return b""
+        first_byte = self.seq_offsets[i] + start // 4
+        out = unpack(bytes(self.packed[first_byte:self.seq_offsets[i] + (end + 3) // 4]))
+        skip = start % 4
+        out = out[skip:skip + end - start]
+        self._overlay(out, start, end, self.run_index, self.run_starts, self.run_lengths, i)
+        self._overlay(out, start, end, self.mask_index, self.mask_starts, self.mask_lengths, i, mask=True)
+        return bytes(out)
+
+    def _overlay(self, out, start, end, index, starts, lengths, i, mask=False):
+        #Apply the runs of sequence i that overlap start..end, found by binary search
+        first, last = index[i], index[i + 1]
+        run = max(first, bisect_right(starts, start, first, last) - 1)
+        while run < last and starts[run] < end:
+            run_start = max(starts[run], start)
+            run_end = min(starts[run] + lengths[run], end)
+            if run_start < run_end:
+                if mask:
+                    out[run_start - start:run_end - start] = out[run_start - start:run_end - start].lower()
+                else:
+                    out[run_start - start:run_end - start] = bytes([self.run_codes[run]]) * (run_end - run_start)
+            run += 1
+
+    def write_fasta(self, out, sequences=None, width=None):
+        #FASTA of the given sequence numbers (all by default), wrapped at each sequence's own line width unless width is given
+        for i in range(len(self)) if sequences is None else sequences:
+            out.write(b">" + self.header(i).encode() + b"\n")
+            line = width or self.line_widths[i] or 80
+            chunk = max(line, EXPORT_CHUNK // line * line)
+            for chunk_start in range(0, self.lengths[i], chunk):
+                seq = self.sequence(i, chunk_start, chunk_start + chunk)
+                out.write(b"\n".join(seq[p:p + line] for p in range(0, len(seq), line)) + b"\n")
+
+def parse_region(region):
+    #samtools style name[:start-end], 1-based and inclusive
+    match = re.fullmatch(r"(.+?)(?::([\d,]+)(?:-([\d,]+))?)?", region)
+    name, start, end = match.groups()
+    start = int(start.replace(",", "")) - 1 if start else 0
+    end = int(end.replace(",", "")) if end else None
+    return name, start, end
+
+def main():
+    parser = argparse.ArgumentParser(description="2-bit packed store of the pathogen database with random access.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    pack_parser = subparsers.add_parser("pack", help="Pack a FASTA file into a store directory")
+    pack_parser.add_argument("fasta", help="FASTA file (pathogen_database_MMYYYY.fa)")
+    pack_parser.add_argument("-o", "--output", required=True, help="Store directory to write")
+    lengths_parser = subparsers.add_parser("lengths", help="ID, taxid and length of every sequence as a TSV")
+    lengths_parser.add_argument("store", help="Store directory")
+    get_parser = subparsers.add_parser("get", help="Print subsequences as FASTA")
+    get_parser.add_argument("store", help="Store directory")
+    get_parser.add_argument("regions", nargs="+", help="ID[:start-end], 1-based inclusive like samtools faidx")
+    export_parser = subparsers.add_parser("export", help="Write the store, or some taxa of it, back out as FASTA")
+    export_parser.add_argument("store", help="Store directory")
+    export_parser.add_argument("-o", "--output", required=True, help="FASTA file to write, - for stdout")
+    export_parser.add_argument("-t", "--taxa", nargs="+", default=[], help="Only these taxids or scientific names, descendants included")
+    export_parser.add_argument("-s", "--taxonomy_snapshot", help="Taxonomy snapshot directory from taxonomy.py export, used instead of ete3's NCBITaxa")
+    export_parser.add_argument("--exact", action="store_true", help="Only the taxids given, not their descendants (no taxonomy needed)")
+    export_parser.add_argument("-w", "--width", type=int, help="Line width (default: each sequence's original width)")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        meta = pack_fasta(args.fasta, args.output)
+        print(f"Packed {meta['n_sequences']} sequences, {meta['total_bases'] / 1e6:.1f} Mb "
+              f"({meta['source_size'] / 1e6:.1f} MB FASTA to {meta['packed_bytes'] / 1e6:.1f} MB) into {args.output}")
+        return
+
+    store = PackedStore(args.store)
+    if args.command == "lengths":
+        sys.stdout.write("id\ttaxid\tlength\n")
+        for i in range(len(store)):
+            sys.stdout.write(f"{sequence_id(store.header(i))}\t{store.taxids[i]}\t{store.lengths[i]}\n")
+    elif args.command == "get":
+        for region in args.regions:
+            name, start, end = parse_region(region)
+            i = store.find(name)
+            if i is None:
+                sys.exit(f"{name} is not in {args.store}")
+            sys.stdout.buffer.write(f">{region}\n".encode() + store.sequence(i, start, end) + b"\n")
+    elif args.command == "export":
+        sequences = None
+        if args.taxa:
+            if args.exact and not all(t.isdigit() for t in args.taxa):
+                parser.error("--exact takes taxids only, names need the taxonomy")
+            # Same taxon selection as extract_subset.py
+            from extract_subset import load_taxonomy_handle, resolve_taxa, select_taxids
+            ncbi = None if args.exact else load_taxonomy_handle(args.taxonomy_snapshot)
+            wanted = resolve_taxa(ncbi, args.taxa) if ncbi else {int(t) for t in args.taxa}
+            selected = select_taxids(ncbi, {str(t) for t in set(store.taxids)}, wanted)
+            sequences = [i for i in range(len(store)) if str(store.taxids[i]) in selected]
+        out = sys.stdout.buffer if args.output == "-" else open(args.output, 'wb')
+        try:
+            store.write_fasta(out, sequences, args.width)
+        finally:
+            if out is not sys.stdout.buffer:
+                out.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/python
+
+#A compact columnar cache of a PAF file so different thresholds can be tried without re-parsing the text PAF
+#The cache is a directory next to the PAF (e.g. barcode01/01_mapped.paf.cache, the PAF may be compressed) with one raw binary file per column,
+#the read IDs and taxaIDs as plain text tables, and a meta.json recording the size and mtime of the source PAF
+#If the PAF changes the cache is rebuilt automatically, columns are memory-mapped when loaded
+#Build on its own with: python paf_cache.py barcode01/01_mapped.paf
+
+import sys, os, json, mmap, argparse
+from array import array
+
+from paf_io import read_paf_records
+
+CACHE_VERSION = 1
+
+#Column name and array typecode, in the order they appear in a record from paf_io
+COLUMNS = [
+    ("read_index", "I"),  #index into read_ids.txt
+    ("q_length", "I"),
+    ("q_start", "I"),
+    ("q_end", "I"),
+    ("taxa_index", "I"),  #index into taxaIDs.txt
+    ("t_start", "I"),
+    ("t_end", "I"),
+    ("matching_bases", "I"),
+    ("a_length", "I"),
+    ("MQ", "B"),
+]
+
+def cache_dir_for(pafFilename):
+    return pafFilename + ".cache"
+
+def source_signature(pafFilename):
+    st = os.stat(pafFilename)
+    return {"source_size": st.st_size, "source_mtime_ns": st.st_mtime_ns}
+
+def cache_is_fresh(pafFilename, cache_dir):
+    meta_path = os.path.join(cache_dir, "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, 'r') as meta_file:
+        meta = json.load(meta_file)
+    expected = dict(source_signature(pafFilename), version=CACHE_VERSION, byteorder=sys.byteorder)
+    return all(meta.get(key) == value for key, value in expected.items())
+
+def build_cache(pafFilename, cache_dir):
+    columns = {name: array(typecode) for name, typecode in COLUMNS}
+    read_ids = {} #read ID -> index, insertion order is the order reads appear in the PAF
+    taxaIDs = {}
+    signature = source_signature(pafFilename)
+
+    for read_id, q_length, q_start, q_end, taxaID, t_start, t_end, matching_bases, a_length, MQ in read_paf_records(pafFilename):
+        columns["read_index"].append(read_ids.setdefault(read_id, len(read_ids)))
+        columns["q_length"].append(q_length)
+        columns["q_start"].append(q_start)
+        columns["q_end"].append(q_end)
+        columns["taxa_index"].append(taxaIDs.setdefault(taxaID, len(taxaIDs)))
+        columns["t_start"].append(t_start)
+        columns["t_end"].append(t_end)
+        columns["matching_bases"].append(matching_bases)
+        columns["a_length"].append(a_length)
+        columns["MQ"].append(MQ)
+
+    #Write into a temporary directory then rename, so a half-written cache is never picked up
+    tmp_dir = cache_dir + ".tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    for name, _ in COLUMNS:
+        with open(os.path.join(tmp_dir, name + ".bin"), 'wb') as column_file:
+            columns[name].tofile(column_file)
+    with open(os.path.join(tmp_dir, "read_ids.txt"), 'w') as read_file:
+        read_file.writelines(read_id + "\n" for read_id in read_ids)
+    with open(os.path.join(tmp_dir, "taxaIDs.txt"), 'w') as taxa_file:
+        taxa_file.writelines(taxaID + "\n" for taxaID in taxaIDs)
+
+    meta = dict(signature, version=CACHE_VERSION, byteorder=sys.byteorder, rows=len(columns["MQ"]),
+                columns={name: typecode for name, typecode in COLUMNS})
+    with open(os.path.join(tmp_dir, "meta.json"), 'w') as meta_file:
+        json.dump(meta, meta_file, indent=4)
+
+    if os.path.exists(cache_dir):
+        for filename in os.listdir(cache_dir):
+            os.remove(os.path.join(cache_dir, filename))
+        os.rmdir(cache_dir)
+    os.rename(tmp_dir, cache_dir)
+
+def _map_column(path, typecode):
+    #mmap can not map an empty file, an empty array behaves the same for iteration
+    if os.path.getsize(path) == 0:
+        return array(typecode)
+    with open(path, 'rb') as column_file:
+        mm = mmap.mmap(column_file.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mm).cast(typecode)
+
+class PafCache:
+    #Memory-mapped view of a cache directory, columns are exposed as attributes (cache.MQ, cache.q_length...)
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        for name, typecode in COLUMNS:
+            setattr(self, name, _map_column(os.path.join(cache_dir, name + ".bin"), typecode))
+        with open(os.path.join(cache_dir, "read_ids.txt"), 'r') as read_file:
+            self.read_ids = read_file.read().splitlines()
+        with open(os.path.join(cache_dir, "taxaIDs.txt"), 'r') as taxa_file:
+            self.taxaIDs = taxa_file.read().splitlines()
+
+    def __len__(self):
+        return len(self.MQ)
+
+    def records(self):
+        #Same tuples as paf_io.read_paf_records so the analysis code does not care where they came from
+        read_ids = self.read_ids
+        taxaIDs = self.taxaIDs
+        for row in zip(self.read_index, self.q_length, self.q_start, self.q_end, self.taxa_index,
+                       self.t_start, self.t_end, self.matching_bases, self.a_length, self.MQ):
+            yield (read_ids[row[0]], row[1], row[2], row[3], taxaIDs[row[4]]) + row[5:]
+
+def load_or_build(pafFilename):
+    cache_dir = cache_dir_for(pafFilename)
+    if not cache_is_fresh(pafFilename, cache_dir):
+        print(f"Building PAF cache {cache_dir}")
+        build_cache(pafFilename, cache_dir)
+    return PafCache(cache_dir)
+
+def read_records(pafFilename, use_cache=False):
+    #Records from the cache when asked for, otherwise straight from the text PAF
+    if use_cache:
+        if pafFilename == "-":
+            raise ValueError("A PAF read from stdin can not be cached")
+        return load_or_build(pafFilename).records()
+    return read_paf_records(pafFilename)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the columnar cache for one or more PAF files.")
+    parser.add_argument("paf", nargs="+", help="PAF file(s) to cache")
+    parser.add_argument("-f", "--force", action="store_true", help="Rebuild even if the cache is up to date")
+    args = parser.parse_args()
+
+    for pafFilename in args.paf:
+        cache_dir = cache_dir_for(pafFilename)
+        if args.force or not cache_is_fresh(pafFilename, cache_dir):
+            build_cache(pafFilename, cache_dir)
+            print(f"Cached {len(PafCache(cache_dir))} alignments from {pafFilename} in {cache_dir}")
+        else:
+            print(f"Cache for {pafFilename} is up to date")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+
+#Live taxaID counts and genome coverage for a barcode while its PAF is still being written during a sequencing run
+#Tails the growing PAF and updates the counts (as paf_parse.py) and mapped bases/coverage (as pathogen_genome_coverage_from_paf.py)
+#one read at a time, only the alignments of the read being written are held, so memory does not grow with the run
+#Every --interval seconds a snapshot is written to the barcode directory, each file written under a temporary name
+#and renamed into place so a dashboard polling them never sees a half-written file:
+#  <NN>_live_taxaID_counts.tsv   taxaID, read_count
+#  <NN>_live_coverage.tsv        taxaID, mapped_bases, genome_length, coverage_percentage, num_reads
+#  <NN>_live_status.json         bytes of the PAF read, reads counted, when it was written and whether the PAF is finished
+#Stops when --stop_file appears, when nothing has been added to the PAF for --idle_timeout seconds, or on Ctrl-C
+#and writes a final snapshot; the finished PAF should still be run through paf_parse.py and pathogen_genome_coverage_from_paf.py
+#Should be run from directory which contains barcode directories
+#python paf_follow.py -b 01 -g Pathogen_Database_MMYYYY/MMYYYY_genome_lengths.tsv --stop_file barcode01/mapping_done
+#minimap2 -c -x map-ont db.fa reads.fastq | python paf_follow.py -b 01 -g genome_lengths.tsv --paf -
+
+import os, sys, json, time, argparse
+from itertools import groupby
+from operator import itemgetter
+
+from paf_io import find_paf, follow_paf_records
+from paf_parse import parse_paf_file, retain, lazy_output_file
+from pathogen_genome_coverage_from_paf import load_genome_lengths, process_paf_records
+
+class LiveTotals:
+    #Running totals over every read finished so far
+    def __init__(self, min_mapq=5, keep_mapq0=True, min_coverage=80, min_identity=80, ignored_file=None):
+        self.min_mapq = min_mapq
+        self.keep_mapq0 = keep_mapq0
+        self.min_coverage = min_coverage
+        self.min_identity = min_identity
+        self.ignored_file = ignored_file
+        self.taxa_count = {}
+        self.ignored_reads = 0
+        self.taxa_mapped_bases = {}
+        self.taxa_num_reads = {}
+        self.reads = 0
+        self.alignments = 0
+
+    def add_read(self, read_records):
+        #All the alignments of one read, counted the same way as paf_parse.py and pathogen_genome_coverage_from_paf.py
+        self.reads += 1
+        self.alignments += len(read_records)
+        queries = parse_paf_file(read_records, self.taxa_count, self.min_mapq, self.keep_mapq0)
+        self.ignored_reads += retain(queries, self.taxa_count, self.ignored_file)
+        #A read's (read, taxaID) pairs can only repeat within the read, so its own set is all that is needed
+        mapped_bases, _, _, read_ids = process_paf_records(read_records, self.min_coverage, self.min_identity)
+        for taxaID, bases in mapped_bases.items():
+            self.taxa_mapped_bases[taxaID] = self.taxa_mapped_bases.get(taxaID, 0) + bases
+            self.taxa_num_reads[taxaID] = self.taxa_num_reads.get(taxaID, 0) + len(read_ids[taxaID])
+
+def write_atomic(path, text):
+    #Readers see the old file or the new one, never part of one
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+def write_snapshot(prefix, totals, genome_lengths, bytes_read, complete=False):
+    counts = "".join(f"{taxaID}\t{count}\n" for taxaID, count in totals.taxa_count.items())
+    write_atomic(prefix + "_live_taxaID_counts.tsv", "taxaID\tread_count\n" + counts)
+
+    rows = ["taxaID\tmapped_bases\tgenome_length\tcoverage_percentage\tnum_reads\n"]
+    for taxaID, bases in totals.taxa_mapped_bases.items():
+        genome_length = genome_lengths.get(taxaID, 0)
+        coverage_percentage = f"{bases / genome_length * 100:.4f}" if genome_length > 0 else "N/A"
+        rows.append(f"{taxaID}\t{bases}\t{genome_length}\t{coverage_percentage}\t{totals.taxa_num_reads[taxaID]}\n")
+    write_atomic(prefix + "_live_coverage.tsv", "".join(rows))
+
+    # Status last, once it changes the other two files are at least as new
+    status = {"bytes_read": bytes_read, "reads": totals.reads, "alignments": totals.alignments,
+              "ignored_reads": totals.ignored_reads, "updated": time.strftime("%Y-%m-%d %H:%M:%S"), "complete": complete}
+    write_atomic(prefix + "_live_status.json", json.dumps(status, indent=1) + "\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Follow a barcode's growing PAF and keep live taxaID counts and coverage.")
+    parser.add_argument("-b", "--barcode", required=True, help="Barcode number, reads ./barcode<NN>/<NN>_mapped.paf")
+    parser.add_argument("-g", "--genome_lengths", help="Genome lengths table from genome_lengths_from_fasta.py, for coverage percentages")
+    parser.add_argument("--paf", help="PAF file to follow instead of the barcode default (uncompressed), or - for stdin")
+    parser.add_argument("-i", "--interval", type=float, default=30, help="Seconds between snapshots (default: 30)")
+    parser.add_argument("--poll", type=float, default=1, help="Seconds between checks for new alignments (default: 1)")
+    parser.add_argument("--idle_timeout", type=float, help="Stop once the PAF has not grown for this many seconds (default: never)")
+    parser.add_argument("--stop_file", help="Stop once this file exists, e.g. touched when mapping finishes")
+    parser.add_argument("-q", "--min_mapq", type=int, default=5, help="Minimum mapping quality to count an alignment (default: 5)")
+    parser.add_argument("--exclude_mapq0", action="store_true", help="Also drop MQ 0 alignments, which are kept by default")
+    parser.add_argument("--min_coverage", type=float, default=80, help="Minimum %% of the read covered by the alignment (default: 80)")
+    parser.add_argument("--min_identity", type=float, default=80, help="Minimum %% identity of the alignment (default: 80)")
+    args = parser.parse_args()
+
+    barcode_number = args.barcode
+    barcode_dir = "./barcode{}".format(barcode_number)
+    pafFilename = args.paf or find_paf(barcode_dir, barcode_number)
+    prefix = os.path.join(barcode_dir, barcode_number)
+    genome_lengths = load_genome_lengths(args.genome_lengths) if args.genome_lengths else {}
+
+    # Minimap2 may not have written anything yet
+    while pafFilename != "-" and not os.path.exists(pafFilename):
+        if args.stop_file and os.path.exists(args.stop_file):
+            sys.exit(f"{args.stop_file} exists but {pafFilename} was never written")
+        time.sleep(args.poll)
+
+    ignored_file = lazy_output_file(prefix + "_live_ignored_reads_query_ID.tsv", 'w')
+    totals = LiveTotals(args.min_mapq, not args.exclude_mapq0, args.min_coverage, args.min_identity, ignored_file)
+    next_snapshot = time.monotonic() + args.interval
+    bytes_read = 0
+
+    def on_progress(position):
+        nonlocal next_snapshot, bytes_read
+        bytes_read = position
+        if time.monotonic() >= next_snapshot:
+            write_snapshot(prefix, totals, genome_lengths, bytes_read)
+            next_snapshot = time.monotonic() + args.interval
+
+    records = follow_paf_records(pafFilename, args.poll, args.idle_timeout, args.stop_file, on_progress)
+    complete = False
+    try:
+        # minimap2 writes all of a read's alignments together, a read is finished once the next one starts
+        for _, read_records in groupby(records, key=itemgetter(0)):
+            totals.add_read(list(read_records))
+        complete = True
+    except KeyboardInterrupt:
+        print("Stopped, writing the last snapshot")
+    finally:
+        ignored_file.close()
+        write_snapshot(prefix, totals, genome_lengths, bytes_read, complete)
+    print(f"Barcode {barcode_number}: {totals.reads} reads, {len(totals.taxa_mapped_bases)} taxa with coverage"
+          f"{'' if complete else ' (PAF not finished)'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/python
+
+#Shared helpers for reading minimap2 PAF files
+#Used by paf_parse.py, pathogen_genome_coverage_from_paf.py and paf_cache.py
+#Each alignment is returned as a plain tuple in PAF column order so the scripts can unpack only what they need:
+#(read_id, q_length, q_start, q_end, taxaID, t_start, t_end, matching_bases, a_length, MQ)
+#PAF files can be plain text, gzip or zstd compressed (detected from the first bytes, not the extension),
+#or "-" to read from stdin so minimap2 can be piped straight in:
+#minimap2 -c -x map-ont db.fa reads.fastq | python paf_parse.py -b 01 --paf -
+#Uncompressed PAF files on disk can also be split into byte ranges that never cut through a read's alignments,
+#so each range can be parsed in its own process (see map_paf_chunks)
+#A PAF still being written (minimap2 mapping reads as a run produces them) can be tailed with follow_paf_records
+
+import os, sys, gzip, time, shutil, subprocess, threading, multiprocessing
+from contextlib import contextmanager
+
+BLOCK_SIZE = 1 << 20 #decode 1MB at a time rather than line by line
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+def taxaID_from_target(target):
+    #only want to get the numbers not the whole section
+    return target.split("|")[1] #for PHIbase
+    #return target #for other fasta references
+
+def parse_paf_line(line):
+    #Only split off the 12 mandatory columns, the SAM-like tags (cg:Z etc.) are not needed
+    fields = line.split('\t', 12)
+    return (
+        fields[0].strip(),
+        int(fields[1]),
+        int(fields[2]),
+        int(fields[3]),
+        taxaID_from_target(fields[5]),
+        int(fields[7]),
+        int(fields[8]),
+        int(fields[9]),
+        int(fields[10]),
+        int(fields[11]),
+    )
+
+def find_paf(barcode_dir, barcode_number):
+    #Default PAF for a barcode, preferring whichever of the plain or compressed files exists
+    pafFilename = os.path.join(barcode_dir, "{}_mapped.paf".format(barcode_number))
+    for candidate in (pafFilename, pafFilename + ".gz", pafFilename + ".zst"):
+        if os.path.exists(candidate):
+            return candidate
+    return pafFilename
+
+def _zstd_reader(raw):
+    #Use the zstandard module if it is installed, otherwise fall back to the zstd command line tool
+    try:
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True)
+    except ImportError:
+        pass
+    if shutil.which("zstd") is None:
+        raise OSError("PAF is zstd compressed but neither the zstandard module nor the zstd tool is available")
+    process = subprocess.Popen(["zstd", "-dc"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def feed():
+        #Feed from a thread so bytes already peeked into raw's buffer are not lost
+        try:
+            shutil.copyfileobj(raw, process.stdin, BLOCK_SIZE)
+        except BrokenPipeError:
+            pass
+        finally:
+            process.stdin.close()
+
+    threading.Thread(target=feed, daemon=True).start()
+    return process.stdout
+
+@contextmanager
+def open_paf_binary(pafFilename):
+    #Binary stream of the decompressed PAF, stdin is never closed
+    if pafFilename == "-":
+        raw = sys.stdin.buffer
+        close_raw = False
+    else:
+        raw = open(pafFilename, 'rb', buffering=BLOCK_SIZE)
+        close_raw = True
+    try:
+        magic = raw.peek(4)[:4]
+        if magic.startswith(GZIP_MAGIC):
+            stream = gzip.GzipFile(fileobj=raw, mode='rb')
+        elif magic.startswith(ZSTD_MAGIC):
+            stream = _zstd_reader(raw)
+        else:
+            stream = raw
+        yield stream
+    finally:
+        if close_raw:
+            raw.close()
+
+def _iter_lines(stream, limit=None):
+    #Decode the stream a block at a time and split into lines, skipping blank lines
+    #limit stops after that many bytes, for reading one chunk of a file
+    remainder = b""
+    while limit is None or limit > 0:
+        block = stream.read(BLOCK_SIZE if limit is None else min(BLOCK_SIZE, limit))
+        if not block:
+            break
+        if limit is not None:
+            limit -= len(block)
+        block = remainder + block
+        cut = block.rfind(b"\n") + 1
+        remainder = block[cut:]
+        for line in block[:cut].decode().split("\n"):
+            if line:
+                yield line
+    if remainder.strip():
+        yield remainder.decode()
+
+def iter_paf_lines(pafFilename):
+    with open_paf_binary(pafFilename) as stream:
+        yield from _iter_lines(stream)
+
+def read_paf_records(pafFilename):
+    #Generator so the whole PAF file is never held in memory
+    for line in iter_paf_lines(pafFilename):
+        if line.strip():
+            yield parse_paf_line(line)
+
+def read_paf_range_records(pafFilename, start, end):
+    #Records from the bytes [start, end) of an uncompressed PAF, start and end must be line boundaries
+    with open(pafFilename, 'rb') as paf_file:
+        paf_file.seek(start)
+        for line in _iter_lines(paf_file, end - start):
+            if line.strip():
+                yield parse_paf_line(line)
+
+def can_split(pafFilename):
+    #Only uncompressed files on disk can be split into byte ranges
+    if pafFilename == "-" or not os.path.isfile(pafFilename):
+        return False
+    with open(pafFilename, 'rb') as paf_file:
+        magic = paf_file.read(4)
+    return not (magic.startswith(GZIP_MAGIC) or magic.startswith(ZSTD_MAGIC))
+
+def _query_before(paf_file, pos):
+    #Query name of the line that ends just before pos, reading backwards in growing windows
+    window = 4096
+    while True:
+        start = max(0, pos - window)
+        paf_file.seek(start)
+        buf = paf_file.read(pos - start)
+        line_start = buf.rfind(b"\n", 0, len(buf) - 1) + 1
+        if line_start > 0 or start == 0:
+            return buf[line_start:].split(b"\t", 1)[0]
+        window *= 2
+
+def _next_query_boundary(paf_file, offset, size):
+    #Offset of the first line at or after offset whose query differs from the line before it
+    if offset <= 0:
+        return 0
+    if offset >= size:
+        return size
+    #finish the line that offset falls in, so pos is the start of a line
+    paf_file.seek(offset - 1)
+    paf_file.readline()
+    pos = paf_file.tell()
+    if pos >= size:
+        return size
+    previous_query = _query_before(paf_file, pos)
+    paf_file.seek(pos)
+    while pos < size:
+        line = paf_file.readline()
+        if line.split(b"\t", 1)[0] != previous_query:
+            return pos
+        pos += len(line)
+    return size
+
+def split_by_query(pafFilename, n_chunks):
+    #Split an uncompressed PAF into up to n_chunks (start, end) byte ranges of roughly equal size,
+    #moving each cut forward so all alignments for a read stay in one range
+    size = os.path.getsize(pafFilename)
+    with open(pafFilename, 'rb') as paf_file:
+        cuts = sorted({_next_query_boundary(paf_file, size * i // n_chunks, size) for i in range(n_chunks)} | {size})
+    return [(start, end) for start, end in zip(cuts, cuts[1:]) if start < end]
+
+def map_paf_chunks(pafFilename, threads, worker, *worker_args):
+    #Run worker(pafFilename, start, end, *worker_args) over query-aligned chunks in a pool of processes
+    #More chunks than processes so a slow chunk does not hold the others up, results come back in file order
+    chunks = split_by_query(pafFilename, threads * 4)
+    tasks = [(pafFilename, start, end) + worker_args for start, end in chunks]
+    if not tasks:
+        return []
+    with multiprocessing.Pool(min(threads, len(tasks))) as pool:
+        return pool.starmap(worker, tasks)
+
+def follow_paf_records(pafFilename, poll_interval=1, idle_timeout=None, stop_file=None, on_progress=None):
+    #Records from an uncompressed PAF that is still growing, only ever from complete lines
+    #Waits for more at the end of the file until nothing has been added for idle_timeout seconds (None waits forever)
+    #or stop_file exists; with "-" it ends when the pipe closes
+    #on_progress(bytes_read) is called after each block and while waiting, bytes_read is up to the last complete line
+    if pafFilename != "-" and not can_split(pafFilename):
+        raise OSError(f"{pafFilename} is compressed, only a plain PAF can be followed as it grows")
+    raw = sys.stdin.buffer if pafFilename == "-" else open(pafFilename, 'rb')
+    remainder = b""
+    bytes_read = 0
+    last_growth = time.monotonic()
+    try:
+        while True:
+            block = raw.read1(BLOCK_SIZE) if pafFilename == "-" else raw.read(BLOCK_SIZE)
+            if block:
+                last_growth = time.monotonic()
+                block = remainder + block
+                cut = block.rfind(b"\n") + 1
+                remainder = block[cut:]
+                bytes_read += cut
+                for line in block[:cut].decode().split("\n"):
+                    if line.strip():
+                        yield parse_paf_line(line)
+                if on_progress:
+                    on_progress(bytes_read)
+                continue
+            if pafFilename == "-":
+                break
+            # At the current end of the file, a rewritten (smaller) PAF can not be followed
+            if os.path.getsize(pafFilename) < bytes_read + len(remainder):
+                raise OSError(f"{pafFilename} was truncated while being followed")
+            if on_progress:
+                on_progress(bytes_read)
+            if (stop_file and os.path.exists(stop_file)) or \
+                    (idle_timeout is not None and time.monotonic() - last_growth > idle_timeout):
+                # a stop file may appear just after the last write, read to the end once more
+                block = raw.read(BLOCK_SIZE)
+                if block:
+                    raw.seek(-len(block), os.SEEK_CUR)
+                    continue
+                break
+            time.sleep(poll_interval)
+        # The writer has finished, a last line without a newline is complete
+        if remainder.strip():
+            bytes_read += len(remainder)
+            yield parse_paf_line(remainder.decode())
+            if on_progress:
+                on_progress(bytes_read)
+    finally:
+        if raw is not sys.stdin.buffer:
+            raw.close()
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+
+#A script to assign each read in a minimap2 PAF file to the lowest common ancestor (LCA) of the taxa it hits
+#Replaces the external MARTi lcaparse step (old_scripts/run_lcaparse.sh), defaults match -minidentity 85 -minlength 150
+#Only alignments with identity >= --min_identity and alignment length >= --min_length are used
+#A read whose passing alignments all hit one taxaID is assigned to it, otherwise to the LCA of those taxaIDs
+#Should be run from directory which contains barcode directories, needs the local ete3 taxonomy database or a snapshot of it (taxonomy.py)
+#python paf_lca.py -b 01
+#Writes <NN>_lcaparse_perread.txt and <NN>_lcaparse_summary.txt into the barcode directory, with lcaparse's columns:
+#  perread  Read_ID, Taxon_ID, Taxon_Name, Taxon_Rank, Mean_Identity, MaxMeanIdentity
+#  summary  Read_Count, Percentage_of_Reads, Taxon_ID, Taxon_Path, Taxon_Rank
+#Mean_Identity is the mean % identity of a read's passing alignments, MaxMeanIdentity the highest mean over the taxa it hits
+
+import sys, os, argparse
+from itertools import groupby
+from operator import itemgetter
+
+from paf_io import find_paf
+from paf_cache import read_records
+from taxonomy import load_taxonomy, DEFAULT_TAXDB
+
+OUTPUT_BUFFER = 1 << 20
+UNASSIGNED = 0
+
+def assign_reads(records, taxonomy, min_identity=85, min_length=150):
+    #Yields (read_id, assigned taxid, mean identity, max mean identity) for each read, taxid 0 if no alignment passes
+    #Reads are handled one at a time as the query name changes
+    unknown_taxa = set()
+    for read_id, query_records in groupby(records, key=itemgetter(0)):
+        #taxid -> [summed identity, number of alignments]
+        hit_taxa = {}
+        for _, q_length, q_start, q_end, taxaID, t_start, t_end, matching_bases, a_length, MQ in query_records:
+            identity = (matching_bases / a_length) * 100 if a_length else 0
+            if a_length < min_length or identity < min_identity:
+                continue
+            taxid = taxonomy.resolve(taxaID)
+            if taxid is None:
+                if taxaID not in unknown_taxa:
+                    print(f"Warning: taxaID {taxaID} not found in the taxonomy, alignments to it are skipped")
+                    unknown_taxa.add(taxaID)
+                continue
+            hit = hit_taxa.get(taxid)
+            if hit is None:
+                hit_taxa[taxid] = [identity, 1]
+            else:
+                hit[0] += identity
+                hit[1] += 1
+        if hit_taxa:
+            total_identity = sum(identity for identity, _ in hit_taxa.values())
+            num_hits = sum(n for _, n in hit_taxa.values())
+            max_mean = max(identity / n for identity, n in hit_taxa.values())
+            yield read_id, taxonomy.lca_of(hit_taxa), total_identity / num_hits, max_mean
+        else:
+            yield read_id, UNASSIGNED, 0, 0
+
+def cached_names_and_ranks(taxonomy):
+    #taxid -> (name, rank) looked up the first time each taxid is seen, reads keep landing on the same few taxa
+    info = {}
+    def lookup(taxid):
+        if taxid not in info:
+            info[taxid] = taxonomy.names_and_ranks([taxid]).get(taxid, ("NA", "NA"))
+        return info[taxid]
+    return lookup
+
+def write_perread_and_count(perread_file, assignments, taxonomy):
+    #Writes one line per assigned read and returns read counts per taxid (unassigned reads under 0)
+    taxa_count = {}
+    name_and_rank = cached_names_and_ranks(taxonomy)
+    with open(perread_file, 'w', buffering=OUTPUT_BUFFER) as out:
+        out.write("Read_ID\tTaxon_ID\tTaxon_Name\tTaxon_Rank\tMean_Identity\tMaxMeanIdentity\n")
+        for read_id, taxid, mean_identity, max_mean_identity in assignments:
+            taxa_count[taxid] = taxa_count.get(taxid, 0) + 1
+            if taxid != UNASSIGNED:
+                name, rank = name_and_rank(taxid)
+                out.write(f"{read_id}\t{taxid}\t{name}\t{rank}\t{mean_identity:.2f}\t{max_mean_identity:.2f}\n")
+    return taxa_count
+
+def write_summary(summary_file, taxa_count, taxonomy):
+    #One line per taxid reads were assigned to, with its lineage from the root as names
+    assigned = [taxid for taxid in taxa_count if taxid != UNASSIGNED]
+    lineages = {taxid: taxonomy.lineage(taxid)[::-1] for taxid in assigned}
+    info = taxonomy.names_and_ranks({node for lineage in lineages.values() for node in lineage})
+    total_reads = sum(taxa_count.values())
+    with open(summary_file, 'w') as out:
+        out.write("Read_Count\tPercentage_of_Reads\tTaxon_ID\tTaxon_Path\tTaxon_Rank\n")
+        if UNASSIGNED in taxa_count:
+            count = taxa_count[UNASSIGNED]
+            out.write(f"{count}\t{count / total_reads * 100:.4f}\t{UNASSIGNED}\tunassigned\tno rank\n")
+        #Most reads first, ties broken on taxid so the output is stable
+        for taxid in sorted(assigned, key=lambda t: (-taxa_count[t], t)):
+            path = ",".join(info.get(node, ("NA", "NA"))[0] for node in lineages[taxid])
+            rank = info.get(taxid, ("NA", "NA"))[1]
+            count = taxa_count[taxid]
+            out.write(f"{count}\t{count / total_reads * 100:.4f}\t{taxid}\t{path}\t{rank}\n")
+
+def main():
+    parser = argparse.ArgumentParser(description="Assign reads in a barcode's minimap2 PAF file to the LCA of the taxa they hit.")
+    parser.add_argument("-b", "--barcode", required=True, help="Barcode number, reads ./barcode<NN>/<NN>_mapped.paf[.gz|.zst]")
+    parser.add_argument("--paf", help="PAF file to read instead of the barcode default, gzip/zstd compressed or - for stdin")
+    parser.add_argument("--cache", action="store_true", help="Read alignments from the columnar PAF cache, building it if needed (see paf_cache.py)")
+    parser.add_argument("--taxdb", default=DEFAULT_TAXDB, help=f"Taxonomy snapshot directory or ete3 sqlite database (default: {DEFAULT_TAXDB})")
+    parser.add_argument("--min_identity", type=float, default=85, help="Minimum %% identity of an alignment (default: 85)")
+    parser.add_argument("--min_length", type=int, default=150, help="Minimum alignment length (default: 150)")
+    parser.add_argument("-o", "--output", help="Output prefix (default: ./barcode<NN>/<NN>_lcaparse)")
+    args = parser.parse_args()
+    if args.cache and args.paf == "-":
+        parser.error("--cache can not be used when reading the PAF from stdin")
+
+    barcode_number = args.barcode
+    barcode_dir = f"./barcode{barcode_number}"
+    pafFilename = args.paf or find_paf(barcode_dir, barcode_number)
+    output_prefix = args.output or os.path.join(barcode_dir, f"{barcode_number}_lcaparse")
+
+    print(f"Loading taxonomy from {args.taxdb}")
+    taxonomy = load_taxonomy(args.taxdb)
+
+    try:
+        assignments = assign_reads(read_records(pafFilename, args.cache), taxonomy, args.min_identity, args.min_length)
+        taxa_count = write_perread_and_count(output_prefix + "_perread.txt", assignments, taxonomy)
+    except FileNotFoundError:
+        print(f"Could not find file {pafFilename}")
+        sys.exit(2)
+
+    write_summary(output_prefix + "_summary.txt", taxa_count, taxonomy)
+    assigned = sum(count for taxid, count in taxa_count.items() if taxid != UNASSIGNED)
+    print(f"Assigned {assigned} of {sum(taxa_count.values())} reads for barcode{barcode_number}")
+
+if __name__ == "__main__":
+    main()
@@ -2,119 +2,139 @@
 
 #Now use lca parse instead of this script as it provides a better output
 #A script to parse paf files from minimap output
-#Filters for mapping quality 
+#Filters for mapping quality (MQ >= 5 or MQ == 0 by default, change with -q and --exclude_mapq0)
 #attempts to choose best mapping for reads which map to multiple taxa
 #Should be run from directory which contains barcode directories
+#The PAF can be gzip/zstd compressed or piped in: minimap2 -c -x map-ont db.fa reads.fastq | python paf_parse.py -b 01 --paf -
+#Streams the PAF one query at a time, so memory does not grow with the size of the PAF
+#This relies on all alignments for a read being next to each other, which is how minimap2 writes them
+#With -t an uncompressed PAF is split into chunks on read boundaries and parsed in parallel, the output is the same
 
-import sys, getopt, errno, os
+import sys, errno, os, shutil, argparse
+from itertools import groupby
+from operator import itemgetter
 
-#A class which contains all the info for each alignment 
+from paf_io import find_paf, can_split, map_paf_chunks, read_paf_range_records
+from paf_cache import read_records
+
+OUTPUT_BUFFER = 1 << 20
+
+#A class which contains all the info for each alignment
+#__slots__ stops every alignment carrying its own instance dict
 class alignment_info:
+    __slots__ = ("q_name", "taxaID", "match_bases", "map_length", "MQ")
+
     def __init__(self, q_name, taxaID, match_bases, map_length, MQ):
         self.q_name = q_name
         self.taxaID = taxaID
         self.match_bases = match_bases
         self.map_length = map_length
         self.MQ = MQ
-    #Function within class that will print query name & MQ 
+    #Function within class that will print query name & MQ
     def print_alignment(self):
         print(self.q_name, self.MQ)
 
-#This block of code means it can take any paf file 
-# When using the -b flag in the terminal will take barcodes
-try:
-    opts, args = getopt.getopt(sys.argv[1:],"b:")
-except getopt.GetoptError:
-    print("Option not recognised.")
-    print("python my_script.py -b <barcode_number>")
-    sys.exit(2)
-for opt, arg in opts:
-    if opt == "-b":
-        input_arg = arg
-    else:
-        print("python my_script.py -i <barcode_number>")
-        sys.exit(2)
-barcode_number = input_arg
+#A file that is only created once something is written to it, then kept open until close
+class lazy_output_file:
+    def __init__(self, path, mode='a'):
+        self.path = path
+        self.mode = mode
+        self.handle = None
+
+    def write(self, text):
+        if self.handle is None:
+            self.handle = open(self.path, self.mode, buffering=OUTPUT_BUFFER)
+        self.handle.write(text)
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+def main():
+    parser = argparse.ArgumentParser(description="Parse a barcode's minimap2 PAF file into taxaID counts.")
+    parser.add_argument("-b", "--barcode", required=True, help="Barcode number, reads ./barcode<NN>/<NN>_mapped.paf[.gz|.zst]")
+    parser.add_argument("--paf", help="PAF file to read instead of the barcode default, gzip/zstd compressed or - for stdin")
+    parser.add_argument("-q", "--min_mapq", type=int, default=5, help="Minimum mapping quality to keep an alignment (default: 5)")
+    parser.add_argument("--exclude_mapq0", action="store_true", help="Also drop MQ 0 alignments, which are kept by default")
+    parser.add_argument("--cache", action="store_true", help="Read alignments from the columnar PAF cache, building it if needed (see paf_cache.py)")
+    parser.add_argument("-t", "--threads", type=int, default=1, help="Number of processes to parse an uncompressed PAF with (default: 1)")
+    args = parser.parse_args()
+    if args.cache and args.paf == "-":
+        parser.error("--cache can not be used when reading the PAF from stdin")
+    if args.threads < 1:
+        parser.error("--threads must be at least 1")
+    barcode_number = args.barcode
 
-def main(barcode_number):
     pafFilename = None  # Define pafFilename with a default value
-    barcode_dir = None 
+    barcode_dir = None
 
     # Set the directory where output files should be saved
     barcode_dir = "./barcode{}".format(barcode_number)
 
 
     # Combine the barcode directory and the PAF file name to create the full path
-    pafFilename = os.path.join(barcode_dir, "{}_mapped.paf".format(barcode_number))
+    pafFilename = args.paf or find_paf(barcode_dir, barcode_number)
 
     # Check if pafFilename is an empty string before attempting to open the file
     if not pafFilename:
         print("pafFilename is not valid. Exiting.")
         sys.exit(2)
-    
-    # Call parse_paf_file function to populate queries and taxa_count dictionaries
-    queries, taxa_count = parse_paf_file(pafFilename)
-
-    # Call the retain function with necessary arguments using queries & taxa_count from parse_paf_file function
-    retain(pafFilename, barcode_number, barcode_dir, queries, taxa_count)
 
-def parse_paf_file(pafFilename):
+    taxa_count = dict() #dictionary which wil have taxaID for keys and counts as values
+    # Create the path to the ignored_reads.txt file within the barcode_dir, only created if a read is ignored
+    ignored_file_path = os.path.join(barcode_dir, "{}_ignored_reads_query_ID.tsv".format(barcode_number))
+    ignored_file = lazy_output_file(ignored_file_path)
 
-    queries = dict() #dictionary with queries as keys 
-    taxa_count = dict() #dictionary which wil have taxaID for keys and counts as values 
+    parallel = args.threads > 1 and not args.cache and can_split(pafFilename)
+    if args.threads > 1 and not parallel:
+        print("Only an uncompressed PAF file read without --cache can be split, parsing with 1 process")
 
     try:
-        with open(pafFilename, 'r') as pafFile: 
-            for line in pafFile:
-                line = line.strip()
-                fields = line.split('\t')
-                q_name = fields[0].strip()
-                #only want to get the numbers not the whole section
-                taxaID =  fields[5].split("|")[1] #for PHIbase 
-                #taxaID =  fields[5] #for other fasta references
-                match_bases = int(fields[9].strip())
-                map_length = int(fields[10].strip())
-                MQ = int(fields[11].strip())
-                #starting the dictionary to populate with taxaIDs
-                taxa_count[taxaID] = 0
-                #only want to include MQ which are 0 or >=5 so filter on this line before creating the dictionary 
-                if MQ >= 5 or MQ == 0:
-                    #Now calling the class alignment_info and inputting this info
-                    ai = alignment_info(q_name, taxaID, match_bases, map_length, MQ)
-                    #whilst looping through each line in the paf file
-                    if q_name not in queries.keys():
-                        #adding a new key for new queries
-                        queries[q_name] = list()
-                    #then appending the class to the dictionary based on queryName
-                    queries[q_name].append(ai)
-    
-    except (OSError, IOError) as e: 
+        if parallel:
+            ignored_reads = parse_in_parallel(pafFilename, args.threads, taxa_count, ignored_file, ignored_file_path,
+                                              args.min_mapq, not args.exclude_mapq0)
+        else:
+            # parse_paf_file yields each query's alignments as soon as the query name changes
+            queries = parse_paf_file(read_records(pafFilename, args.cache), taxa_count, args.min_mapq, not args.exclude_mapq0)
+            # retain counts each query as it arrives, nothing is kept once a query is done
+            ignored_reads = retain(queries, taxa_count, ignored_file)
+    except (OSError, IOError) as e:
         if getattr(e, 'errno', 0) == errno.ENOENT:
             print ("Could not find file " + pafFilename)
             sys.exit(2)
         else:
             print("An error occurred while parsing the PAF file.")
             sys.exit(2)
-    
-    # Return the updated queries and taxa_count dictionaries
-    return queries, taxa_count
-    
-
+    finally:
+        ignored_file.close()
+
+    write_counts(barcode_number, barcode_dir, taxa_count, ignored_reads)
+
+def parse_paf_file(records, taxa_count, min_mapq=5, keep_mapq0=True):
+    #Group consecutive records by query name and yield (q_name, list of alignment_info) for each query
+    for q_name, query_records in groupby(records, key=itemgetter(0)):
+        ai_list = []
+        for _, q_length, q_start, q_end, taxaID, t_start, t_end, match_bases, map_length, MQ in query_records:
+            #starting the dictionary to populate with taxaIDs
+            taxa_count.setdefault(taxaID, 0)
+            #only want to include MQ which are 0 or >= min_mapq so filter on this line before creating the list
+            if MQ >= min_mapq or (keep_mapq0 and MQ == 0):
+                #Now calling the class alignment_info and inputting this info
+                ai_list.append(alignment_info(q_name, taxaID, match_bases, map_length, MQ))
+        #queries with no alignments passing the filter are skipped
+        if ai_list:
+            yield q_name, ai_list
 
 #Function to select which alignments are retained
-def retain(pafFilename, barcode_number, barcode_dir, queries, taxa_count):
-    single_query = []
-    multiple_query = []
+#Updates taxa_count in place and returns the number of ignored reads
+def retain(queries, taxa_count, ignored_file):
     #counting how many reads are ignored
     ignored_reads = 0
-    #looping through the queries dictionary 
-    for q_name in queries.keys():
-        #creating a list that contains the info from the dictionary 
-        ai_list = queries[q_name]
-        #If there is only one input for a query name then the read is unique 
+    #looping through the queries as they are parsed
+    for q_name, ai_list in queries:
+        #If there is only one input for a query name then the read is unique
         if len(ai_list) == 1:
-            #so it can be added to the unique list 
-            single_query.append(q_name)
             #this ai list only contains one thing so we can get it with [0]
             ai = ai_list[0]
             #getting the taxaID out of the class we set up using the ai_list query name
@@ -124,8 +144,7 @@ def retain(pafFilename, barcode_number, barcode_dir, queries, taxa_count):
             taxa_count[taxa_id] += 1
         else:
             #If there is more than one entry then there must be multiple reads
-            multiple_query.append(q_name)
-            #making a set as this can only contain unique values 
+            #making a set as this can only contain unique values
             mapping_qualities = set()
             multiple_taxa_ID = set()
             #looping through list of dict info
@@ -139,17 +158,12 @@ def retain(pafFilename, barcode_number, barcode_dir, queries, taxa_count):
                 #extracting from the set to use it in dict
                 taxa_id = list(multiple_taxa_ID)[0]
                 taxa_count[taxa_id] +=1
-            
+
             #1xMQ multi x taxa
-            #currenlty going to ignore these reads but want to print them to see how big of a problem this is 
-            #In the future could look at LCA 
+            #currenlty going to ignore these reads but want to print them to see how big of a problem this is
+            #In the future could look at LCA
             if len(mapping_qualities) == 1 and len(multiple_taxa_ID) > 1:
-                # Create the path to the ignored_reads.txt file within the barcode_dir
-                ignored_file_path = os.path.join(barcode_dir, "{}_ignored_reads_query_ID.tsv".format(barcode_number))
-                
-                # Open the file in 'a' (append) mode
-                with open(ignored_file_path, 'a') as ignored_file:
-                    ignored_file.write("This query: {} has the same MQ {} but maps to different taxaIDs: {} so has been ignored.\n".format(q_name, mapping_qualities, multiple_taxa_ID))
+                ignored_file.write("This query: {} has the same MQ {} but maps to different taxaIDs: {} so has been ignored.\n".format(q_name, mapping_qualities, multiple_taxa_ID))
             ignored_reads += 1
 
             #multi x MQ and multi x taxaID, just want to take taxaID from highest MQ
@@ -164,9 +178,36 @@ def retain(pafFilename, barcode_number, barcode_dir, queries, taxa_count):
                         maxMQ = ai.MQ
                         taxaIDForMaxMQ = ai.taxaID
                         taxa_count[taxaIDForMaxMQ] +=1
-   
+
+    return ignored_reads
+
+def parse_chunk(pafFilename, start, end, min_mapq, keep_mapq0, ignored_part_prefix):
+    #Worker for one chunk of the PAF, ignored reads go to a part file named after the chunk start
+    taxa_count = dict()
+    ignored_part = lazy_output_file("{}.{}.part".format(ignored_part_prefix, start), 'w')
+    try:
+        queries = parse_paf_file(read_paf_range_records(pafFilename, start, end), taxa_count, min_mapq, keep_mapq0)
+        ignored_reads = retain(queries, taxa_count, ignored_part)
+    finally:
+        ignored_part.close()
+    return start, taxa_count, ignored_reads, ignored_part.path
+
+def parse_in_parallel(pafFilename, threads, taxa_count, ignored_file, ignored_file_path, min_mapq=5, keep_mapq0=True):
+    #Parse chunks in worker processes then merge them in file order, so counts and files match a single process run
+    ignored_reads = 0
+    results = map_paf_chunks(pafFilename, threads, parse_chunk, min_mapq, keep_mapq0, ignored_file_path)
+    for start, chunk_taxa_count, chunk_ignored_reads, ignored_part_path in results:
+        for taxa_id, count in chunk_taxa_count.items():
+            taxa_count[taxa_id] = taxa_count.get(taxa_id, 0) + count
+        ignored_reads += chunk_ignored_reads
+        if os.path.exists(ignored_part_path):
+            with open(ignored_part_path, 'r') as ignored_part:
+                shutil.copyfileobj(ignored_part, ignored_file)
+            os.remove(ignored_part_path)
+    return ignored_reads
+
+def write_counts(barcode_number, barcode_dir, taxa_count, ignored_reads):
     # Print the dictionary as a list of taxaIDs & counts to a separate file
-    # Create the path to the ignored_reads.txt file within the barcode_dir
     taxa_file_path = os.path.join(barcode_dir, "{}_taxaID_counts.tsv".format(barcode_number))
     # Open the file in 'a' (append) mode
     with open(taxa_file_path, 'a') as taxa_file:
@@ -180,4 +221,4 @@ def retain(pafFilename, barcode_number, barcode_dir, queries, taxa_count):
 
 
 if __name__ == "__main__":
-    main(barcode_number)
+    main()
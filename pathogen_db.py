@@ -0,0 +1,63 @@
+#!/usr/bin/python
+
+#One entry point for all the scripts: python pathogen_db.py <command> [arguments of that script]
+#Each command is the main() of one of the scripts next to this file, which still run on their own as before
+#Only the chosen script is imported, and the scripts import pandas, requests, Biopython and the taxonomy
+#inside the functions that use them, so listing commands, --help and argument errors return without loading any of them
+#python pathogen_db.py --help
+#python pathogen_db.py select -p phibase.csv -r risk_register.csv -o Download_MMYY_
+#python pathogen_db.py paf-parse -b 01
+
+import os, sys, importlib
+
+#command -> (module, one line summary), in pipeline order
+COMMANDS = {
+    "build": ("build_reference_database", "Run every stage of the database build, skipping those that are up to date"),
+    "risk-table": ("generate_risk_table", "Simplified risk table from the DEFRA risk register"),
+    "select": ("Make_Pathogen_Database", "Pick one assembly per species, writes the download list"),
+    "download": ("download", "Download, check and concatenate the selected genomes into the database"),
+    "gzip": ("gzip_files", "BGZF compress manually added FASTA files for download"),
+    "genome-lengths": ("genome_lengths_from_fasta", "Genome length per taxaID of the database"),
+    "extract": ("extract_subset", "Cut the genomes of some taxa out of the database"),
+    "packed": ("packed_store", "2-bit packed store of the database: pack, lengths, get subsequences, export FASTA"),
+    "taxonomy": ("taxonomy", "Export the local NCBI taxonomy into a memory-mapped snapshot"),
+    "names": ("name_matcher", "Build or query the approximate species name index"),
+    "table-from-json": ("table_from_json", "Table of the selected assemblies from the download list"),
+    "missing-species": ("identify_missing_species", "Species of a CSV that are not in the download list"),
+    "prep-reads": ("prep_reads", "Length filter a barcode's pass reads and count read stats"),
+    "paf-cache": ("paf_cache", "Build the columnar cache of a PAF file"),
+    "paf-parse": ("paf_parse", "taxaID counts from a barcode's PAF"),
+    "coverage": ("pathogen_genome_coverage_from_paf", "Genome coverage per taxaID from a barcode's PAF"),
+    "lca": ("paf_lca", "Assign reads to the LCA of the taxa they hit"),
+    "follow": ("paf_follow", "Live counts and coverage while a barcode's PAF is still growing"),
+    "run-table": ("run_table", "Collect every barcode's outputs into the run table, or export it"),
+    "lineage": ("lineage_table", "Kingdom to species lineage CSV from all_taxaID_count.tsv"),
+    "risk-report": ("risk_report", "Annotate a run's detections with the risk table"),
+}
+
+def usage():
+    width = max(len(command) for command in COMMANDS)
+    lines = ["usage: pathogen_db.py <command> [arguments]", "", "commands:"]
+    lines += [f"  {command:<{width}}  {summary}" for command, (_, summary) in COMMANDS.items()]
+    lines += ["", "pathogen_db.py <command> --help shows the arguments of a command"]
+    return "\n".join(lines)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        print(usage())
+        return
+    command = argv[0]
+    if command not in COMMANDS:
+        print(usage(), file=sys.stderr)
+        sys.exit(f"\npathogen_db.py: unknown command {command}")
+    module_name, _ = COMMANDS[command]
+    # The scripts import each other by name, so this directory has to be importable wherever this is run from
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    module = importlib.import_module(module_name)
+    # Each script parses sys.argv itself, the program name shows up in its usage and errors
+    sys.argv = [f"pathogen_db.py {command}"] + argv[1:]
+    module.main()
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,15 @@
 #!/usr/bin/python
 
 #A script to calculate genome coverage for specific genera from minimap output
-#Filters on identity and coverage
+#Filters on identity and coverage (80% by default, change with --min_identity and --min_coverage)
 #Should be run from directory which contains barcode directories
+#The PAF can be gzip/zstd compressed or piped in with --paf -, an uncompressed PAF can be processed in parallel with -t
 #Uses a genome_lengths_file generated with genome_lengths_from_fasta.py script using the reference database used for mapping
 
-import sys, os, csv
+import sys, os, csv, argparse
+
+from paf_io import find_paf, can_split, map_paf_chunks, read_paf_range_records
+from paf_cache import read_records
 
 #Opening a tab delimited file with taxaID and reference genome length
 def load_genome_lengths(genome_lengths_file):
@@ -19,45 +23,66 @@ def load_genome_lengths(genome_lengths_file):
             genome_lengths[taxaID] = length #populate dictionary 
     return genome_lengths
 
-def process_paf_file(pafFilename, genome_lengths): #Function to process paf file one row at a time
+def process_paf_file(pafFilename, genome_lengths, min_coverage=80, min_identity=80, use_cache=False, threads=1):
+    if threads > 1 and not use_cache and can_split(pafFilename):
+        return process_in_parallel(pafFilename, threads, min_coverage, min_identity)
+    if threads > 1:
+        print("Only an uncompressed PAF file read without --cache can be split, processing with 1 process")
+    return process_paf_records(read_records(pafFilename, use_cache), min_coverage, min_identity)
+
+def process_paf_records(records, min_coverage=80, min_identity=80): #Function to process paf file one row at a time
     taxa_mapped_bases = {}
     filtered_reads = []
     multi_taxa_reads = {}
     processed_reads = set()
     taxa_read_ids = {}
 
-    with open(pafFilename, 'r') as paf_file:
-        reader = csv.reader(paf_file, delimiter='\t')
-        for row in reader:
-            read_id = row[0]
-            q_length = int(row[1])
-            a_start = int(row[2])
-            a_end = int(row[3])
-            taxaID = row[5].split("|")[1]
-            matching_bases = int(row[9])
-            a_length = int(row[10])
-            identity = (matching_bases / a_length) * 100
-            coverage = ((a_length) / q_length) * 100
-
-            # See how many alignments have coverage > 110
-            # if coverage > 110:
-            #     print (f"Warning: coverage for read {read_id} is greater than 110% ({coverage:.2f}%)")
-
-            if coverage >= 80 and identity >= 80: #change as needed
-                if (read_id, taxaID) not in processed_reads: #only count each read aligning to same taxa once
-                    if taxaID not in taxa_mapped_bases:
-                        taxa_mapped_bases[taxaID] = 0 #initialize taxaID in dictionary
-                        taxa_read_ids[taxaID] = set() 
-                    taxa_mapped_bases[taxaID] += q_length
-                    taxa_read_ids[taxaID].add(read_id)
-                    processed_reads.add((read_id, taxaID))
-
-                    if read_id not in multi_taxa_reads:
-                        multi_taxa_reads[read_id] = []
-                    multi_taxa_reads[read_id].append((taxaID, identity, coverage))
-            else:
-                filtered_reads.append((read_id, taxaID, q_length, a_length, matching_bases, identity, coverage))
+    for read_id, q_length, a_start, a_end, taxaID, t_start, t_end, matching_bases, a_length, MQ in records:
+        identity = (matching_bases / a_length) * 100
+        coverage = ((a_length) / q_length) * 100
+
+        # See how many alignments have coverage > 110
+        # if coverage > 110:
+        #     print (f"Warning: coverage for read {read_id} is greater than 110% ({coverage:.2f}%)")
+
+        if coverage >= min_coverage and identity >= min_identity:
+            if (read_id, taxaID) not in processed_reads: #only count each read aligning to same taxa once
+                if taxaID not in taxa_mapped_bases:
+                    taxa_mapped_bases[taxaID] = 0 #initialize taxaID in dictionary
+                    taxa_read_ids[taxaID] = [] #first-seen order, processed_reads already keeps them unique
+                taxa_mapped_bases[taxaID] += q_length
+                taxa_read_ids[taxaID].append(read_id)
+                processed_reads.add((read_id, taxaID))
+
+                if read_id not in multi_taxa_reads:
+                    multi_taxa_reads[read_id] = []
+                multi_taxa_reads[read_id].append((taxaID, identity, coverage))
+        else:
+            filtered_reads.append((read_id, taxaID, q_length, a_length, matching_bases, identity, coverage))
+
+    return taxa_mapped_bases, filtered_reads, multi_taxa_reads, taxa_read_ids
 
+def process_chunk(pafFilename, start, end, min_coverage, min_identity):
+    #Worker for one chunk of the PAF, chunks never split a read so (read, taxaID) pairs can not repeat across chunks
+    return process_paf_records(read_paf_range_records(pafFilename, start, end), min_coverage, min_identity)
+
+def process_in_parallel(pafFilename, threads, min_coverage=80, min_identity=80):
+    #Process chunks in worker processes then merge them in file order, so the output matches a single process run
+    #All alignments for a read must be next to each other in the PAF, which is how minimap2 writes them
+    taxa_mapped_bases = {}
+    filtered_reads = []
+    multi_taxa_reads = {}
+    taxa_read_ids = {}
+    for chunk_mapped_bases, chunk_filtered_reads, chunk_multi_taxa_reads, chunk_read_ids in map_paf_chunks(
+            pafFilename, threads, process_chunk, min_coverage, min_identity):
+        for taxaID, bases in chunk_mapped_bases.items():
+            if taxaID not in taxa_mapped_bases:
+                taxa_mapped_bases[taxaID] = 0
+                taxa_read_ids[taxaID] = []
+            taxa_mapped_bases[taxaID] += bases
+            taxa_read_ids[taxaID].extend(chunk_read_ids[taxaID])
+        filtered_reads.extend(chunk_filtered_reads)
+        multi_taxa_reads.update(chunk_multi_taxa_reads)
     return taxa_mapped_bases, filtered_reads, multi_taxa_reads, taxa_read_ids
 
 def write_genome_coverage(genome_coverage_file, taxa_mapped_bases, genome_lengths, taxa_read_ids):
@@ -89,15 +114,25 @@ def write_multi_taxa_reads(multi_taxa_reads_file, multi_taxa_reads):
                     multi_taxa_file.write(f"{read_id}\t{taxaID}\t{identity:.2f}\t{coverage:.2f}\n")
 
 def main():
-    if len(sys.argv) != 3:
-        print("Usage: python pathogen_genome_coverage_from_paf.py <barcode_number> <genome_lengths_file>")
-        sys.exit(1)
-
-    barcode_number = sys.argv[1]
-    genome_lengths_file = sys.argv[2]
+    parser = argparse.ArgumentParser(description="Calculate genome coverage per taxaID from a barcode's minimap2 PAF file.")
+    parser.add_argument("barcode_number", help="Barcode number, reads ./barcode<NN>/<NN>_mapped.paf[.gz|.zst]")
+    parser.add_argument("genome_lengths_file", help="Genome lengths table from genome_lengths_from_fasta.py")
+    parser.add_argument("--min_coverage", type=float, default=80, help="Minimum %% of the read covered by the alignment (default: 80)")
+    parser.add_argument("--min_identity", type=float, default=80, help="Minimum %% identity of the alignment (default: 80)")
+    parser.add_argument("--paf", help="PAF file to read instead of the barcode default, gzip/zstd compressed or - for stdin")
+    parser.add_argument("--cache", action="store_true", help="Read alignments from the columnar PAF cache, building it if needed (see paf_cache.py)")
+    parser.add_argument("-t", "--threads", type=int, default=1, help="Number of processes to process an uncompressed PAF with (default: 1)")
+    args = parser.parse_args()
+    if args.cache and args.paf == "-":
+        parser.error("--cache can not be used when reading the PAF from stdin")
+    if args.threads < 1:
+        parser.error("--threads must be at least 1")
+
+    barcode_number = args.barcode_number
+    genome_lengths_file = args.genome_lengths_file
 
     barcode_dir = f"./barcode{barcode_number}"
-    pafFilename = os.path.join(barcode_dir, f"{barcode_number}_mapped.paf")
+    pafFilename = args.paf or find_paf(barcode_dir, barcode_number)
 
     if not pafFilename:
         print("pafFilename is not valid. Exiting.")
@@ -108,7 +143,8 @@ def main():
     multi_taxa_reads_file = os.path.join(barcode_dir, f"{barcode_number}_coverage_multi_taxa_reads.txt")
 
     genome_lengths = load_genome_lengths(genome_lengths_file)
-    taxa_mapped_bases, filtered_reads, multi_taxa_reads, taxa_read_ids = process_paf_file(pafFilename, genome_lengths)
+    taxa_mapped_bases, filtered_reads, multi_taxa_reads, taxa_read_ids = process_paf_file(
+        pafFilename, genome_lengths, args.min_coverage, args.min_identity, args.cache, args.threads)
 
     write_genome_coverage(genome_coverage_file, taxa_mapped_bases, genome_lengths, taxa_read_ids)
     write_filtered_reads(filtered_reads_file, filtered_reads)
@@ -0,0 +1,179 @@
+#!/usr/bin/python
+
+#Read preparation for one barcode, replaces old_scripts/prep_reads.sh
+#Every pass FASTQ(.gz) file is read once: reads shorter than the filter length are dropped and the rest written to
+#<scratch_dir>/<NN>_barcode_<filter_length>bp.fastq while the read stats are counted in the same pass
+#Files are decompressed in parallel (one file per process), the filtered FASTQ keeps the order of the files and reads
+#Should be run from directory which contains barcode directories
+#python prep_reads.py -b 01 -l /path/to/run -f 1000 -s /scratch/run -t 4
+#Writes into barcode<NN>:
+#  <NN>_barcode_percent_retained.txt  percentage of reads kept by the length filter
+#  <NN>_num_fail.txt                  number of reads in fastq_fail (not written if there are none)
+#  <NN>_read_stats.tsv                read count, bases, N50 etc. before and after the length filter
+#  <NN>_read_length_histogram.tsv     read counts in --bin_size length bins
+
+import os, sys, gzip, shutil, argparse
+from multiprocessing import Pool
+
+OUTPUT_BUFFER = 1 << 20
+FASTQ_SUFFIXES = (".fastq", ".fq")
+
+def fastq_files(directory):
+    #FASTQ files in the same order as the shell glob, gzipped or not
+    files = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith(FASTQ_SUFFIXES) or name.endswith(".gz"):
+            files.append(path)
+        else:
+            print(f"Warning: Skipping unrecognized file format '{path}'.")
+    return files
+
+def open_fastq(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb', buffering=OUTPUT_BUFFER)
+
+def prep_file(path, filter_length, part_path):
+    #Worker for one pass file: writes reads >= filter_length to part_path
+    #Returns a {read length: count} dict for all reads and the number of reads kept
+    lengths = {}
+    kept_reads = 0
+    with open_fastq(path) as fastq, open(part_path, 'wb', buffering=OUTPUT_BUFFER) as part:
+        for header, seq, plus, qual in zip(fastq, fastq, fastq, fastq):
+            length = len(seq.rstrip(b"\r\n"))
+            lengths[length] = lengths.get(length, 0) + 1
+            if length >= filter_length:
+                part.write(header + seq + plus + qual)
+                kept_reads += 1
+    return lengths, kept_reads
+
+def count_reads(path):
+    #Worker for one fail file, only the number of reads is needed
+    with open_fastq(path) as fastq:
+        return sum(1 for _ in fastq) // 4
+
+def n50(lengths):
+    #lengths is {read length: count}
+    total = sum(length * count for length, count in lengths.items())
+    running = 0
+    for length in sorted(lengths, reverse=True):
+        running += length * lengths[length]
+        if running * 2 >= total:
+            return length
+    return 0
+
+def length_stats(lengths):
+    reads = sum(lengths.values())
+    bases = sum(length * count for length, count in lengths.items())
+    return {
+        "reads": reads,
+        "bases": bases,
+        "mean_length": round(bases / reads, 2) if reads else 0,
+        "min_length": min(lengths) if lengths else 0,
+        "max_length": max(lengths) if lengths else 0,
+        "N50": n50(lengths),
+    }
+
+def percent_retained(kept_reads, total_reads):
+    #Truncated to 2 decimal places like the old `bc` calculation
+    if not total_reads:
+        return "0.00"
+    hundredths = 10000 * kept_reads // total_reads
+    return f"{hundredths // 100}.{hundredths % 100:02d}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Length filter a barcode's pass reads and count read stats in one pass.")
+    parser.add_argument("-b", "--barcode", required=True, help="Barcode number")
+    parser.add_argument("-l", "--location", required=True, help="Run directory containing fastq_pass (or fastq) and fastq_fail")
+    parser.add_argument("-f", "--filter_length", type=int, required=True, help="Minimum read length to keep")
+    parser.add_argument("-s", "--scratch_dir", required=True, help="Directory for the filtered FASTQ")
+    parser.add_argument("-t", "--threads", type=int, default=1, help="Number of files to decompress at once (default: 1)")
+    parser.add_argument("--bin_size", type=int, default=1000, help="Read length histogram bin size (default: 1000)")
+    args = parser.parse_args()
+    if args.threads < 1:
+        parser.error("--threads must be at least 1")
+
+    barcode_number = args.barcode
+    location = args.location
+    if not os.path.isdir(location):
+        print(f"Error: Location '{location}' does not exist.")
+        sys.exit(1)
+
+    barcode_dir = "./barcode{}".format(barcode_number)
+    os.makedirs(barcode_dir, exist_ok=True)
+    os.makedirs(args.scratch_dir, exist_ok=True)
+
+    pass_dir = None
+    for name in ("fastq_pass", "fastq"):
+        if os.path.isdir(os.path.join(location, name, "barcode" + barcode_number)):
+            pass_dir = os.path.join(location, name, "barcode" + barcode_number)
+            break
+    if pass_dir is None:
+        print(f"Error: Neither fastq or fastq_pass directory exists for location {location} and barcode {barcode_number}.")
+        sys.exit(1)
+    fail_dir = os.path.join(location, "fastq_fail", "barcode" + barcode_number)
+
+    pass_files = fastq_files(pass_dir)
+    fail_files = fastq_files(fail_dir) if os.path.isdir(fail_dir) else []
+    if not os.path.isdir(fail_dir):
+        print(f"Warning: fastq_fail directory for barcode {barcode_number} does not exist. Skipping fail barcode processing.")
+
+    filtered_fastq = os.path.join(args.scratch_dir, "{}_barcode_{}bp.fastq".format(barcode_number, args.filter_length))
+    part_paths = ["{}.{}.part".format(filtered_fastq, i) for i in range(len(pass_files))]
+
+    # Each file is one task, results come back in file order so the parts are joined in that order
+    with Pool(args.threads) as pool:
+        fail_counts = pool.map_async(count_reads, fail_files)
+        results = pool.starmap(prep_file, [(path, args.filter_length, part) for path, part in zip(pass_files, part_paths)])
+        num_fail = sum(fail_counts.get())
+
+    lengths = {}
+    kept_reads = 0
+    with open(filtered_fastq, 'wb') as out:
+        for part_path, (file_lengths, file_kept_reads) in zip(part_paths, results):
+            with open(part_path, 'rb') as part:
+                shutil.copyfileobj(part, out, OUTPUT_BUFFER)
+            os.remove(part_path)
+            for length, count in file_lengths.items():
+                lengths[length] = lengths.get(length, 0) + count
+            kept_reads += file_kept_reads
+
+    kept_lengths = {length: count for length, count in lengths.items() if length >= args.filter_length}
+    all_stats = length_stats(lengths)
+    kept_stats = length_stats(kept_lengths)
+    percent = percent_retained(kept_reads, all_stats["reads"])
+
+    prefix = os.path.join(barcode_dir, barcode_number)
+    with open(prefix + "_barcode_percent_retained.txt", 'w') as f:
+        f.write(percent + "\n")
+    if num_fail:
+        with open(prefix + "_num_fail.txt", 'w') as f:
+            f.write(f"{num_fail}\n")
+    elif fail_files:
+        print(f"Warning: No fail barcodes found for barcode {barcode_number}.")
+
+    with open(prefix + "_read_stats.tsv", 'w') as f:
+        f.write("statistic\tall_reads\tfiltered_reads\n")
+        for key in all_stats:
+            f.write(f"{key}\t{all_stats[key]}\t{kept_stats[key]}\n")
+        f.write(f"percent_retained\t100.00\t{percent}\n")
+        f.write(f"fail_reads\t{num_fail}\tNA\n")
+        f.write(f"files\t{len(pass_files)}\tNA\n")
+
+    with open(prefix + "_read_length_histogram.tsv", 'w') as f:
+        f.write("bin_start\tbin_end\treads\tfiltered_reads\n")
+        bins = {}
+        for length, count in lengths.items():
+            counts = bins.setdefault(length // args.bin_size, [0, 0])
+            counts[0] += count
+            if length >= args.filter_length:
+                counts[1] += count
+        for b in sorted(bins):
+            f.write(f"{b * args.bin_size}\t{(b + 1) * args.bin_size - 1}\t{bins[b][0]}\t{bins[b][1]}\n")
+
+    print(f"Barcode {barcode_number}: {all_stats['reads']} pass reads in {len(pass_files)} files (N50 {all_stats['N50']}), "
+          f"{kept_reads} >= {args.filter_length}bp ({percent}%) written to {filtered_fastq}, {num_fail} fail reads")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/python
+
+#A script to annotate a whole run's detections with the DEFRA risk table (from generate_risk_table.py)
+#Detections are often at strain or forma specialis level, so each one is rolled up to the risk table entry
+#for its nearest ancestor (or itself) rather than matched on the two-word Species string
+#Risk table names are resolved to taxids once, then every descendant taxid of each entry is put in one lookup,
+#so all barcodes are joined in a single vectorised map
+#Should be run from directory which contains barcode directories
+#python risk_report.py --risk_table Pathogen_Database_MMYYYY/risk_table.csv --taxonomy taxonomy_snapshot -o run_risk
+
+import os, glob, argparse
+
+#pandas is imported inside the functions that use it, so --help does not wait for it
+
+def load_taxonomy_handle(taxonomy_snapshot=None):
+    #Snapshot from taxonomy.py if given, otherwise ete3's NCBITaxa (same calls)
+    if taxonomy_snapshot:
+        from taxonomy import TaxonomySnapshot
+        return TaxonomySnapshot(taxonomy_snapshot)
+    from ete3 import NCBITaxa
+    return NCBITaxa()
+
+def resolve_risk_taxids(risk, ncbi):
+    #Try the full pest name first (keeps formae speciales and pathovars), then the two-word species
+    import pandas as pd
+    names = pd.concat([risk['Pest_Name'], risk['Species']]).dropna().astype(str).str.strip().unique().tolist()
+    translated = ncbi.get_name_translator(names)
+    def first_taxid(name):
+        taxids = translated.get(str(name).strip()) if isinstance(name, str) else None
+        return int(taxids[0]) if taxids else None
+    return [first_taxid(pest) or first_taxid(species) for pest, species in zip(risk['Pest_Name'], risk['Species'])]
+
+def build_risk_lookup(ncbi, risk_taxids):
+    #descendant taxid -> row of the risk table, filled from the least to the most specific entry
+    #so a taxid below two entries (e.g. a species and its forma specialis) goes to the nearest one
+    entries = [(len(ncbi.get_lineage(taxid) or []), row, taxid) for row, taxid in enumerate(risk_taxids) if taxid is not None]
+    lookup = {}
+    for _, row, taxid in sorted(entries):
+        descendants = ncbi.get_descendant_taxa(taxid, intermediate_nodes=True) or []
+        for t in [taxid] + [int(d) for d in descendants]:
+            lookup[t] = row
+    return lookup
+
+def read_detections(run_dir):
+    #taxaID counts from paf_parse.py and genome coverage from pathogen_genome_coverage_from_paf.py for every barcode
+    import pandas as pd
+    counts = []
+    for path in sorted(glob.glob(os.path.join(run_dir, "barcode*", "*_taxaID_counts.tsv"))):
+        df = pd.read_csv(path, sep='\t', header=None, names=['taxaID', 'read_count', 'barcode'], dtype={'taxaID': str, 'barcode': str})
+        counts.append(df)
+    coverage = []
+    for path in sorted(glob.glob(os.path.join(run_dir, "barcode*", "*_genome_coverage.txt"))):
+        df = pd.read_csv(path, sep='\t', dtype={'taxaID': str}, usecols=['taxaID', 'mapped_bases', 'genome_length', 'coverage_percentage', 'num_reads'])
+        df['barcode'] = os.path.basename(path).split('_')[0]
+        coverage.append(df)
+
+    columns = ['barcode', 'taxaID']
+    counts = pd.concat(counts) if counts else pd.DataFrame(columns=columns + ['read_count'])
+    # the counts files are appended to, so a rerun leaves duplicate lines
+    counts = counts.drop_duplicates(subset=columns, keep='last')
+    coverage = pd.concat(coverage) if coverage else pd.DataFrame(columns=columns + ['mapped_bases', 'genome_length', 'coverage_percentage', 'num_reads'])
+    detections = counts.merge(coverage, on=columns, how='outer')
+    detections['taxid'] = pd.to_numeric(detections['taxaID'], errors='coerce').astype('Int64')
+    return detections
+
+def main():
+    parser = argparse.ArgumentParser(description="Annotate every barcode's detections with the DEFRA risk table, rolled up by lineage.")
+    parser.add_argument("-r", "--risk_table", required=True, help="risk_table.csv from generate_risk_table.py")
+    parser.add_argument("-t", "--taxonomy", help="Taxonomy snapshot directory from taxonomy.py export (default: ete3's NCBITaxa)")
+    parser.add_argument("-d", "--run_dir", default=".", help="Directory containing the barcode directories (default: .)")
+    parser.add_argument("-o", "--output", default="run_risk", help="Output prefix (default: run_risk)")
+    args = parser.parse_args()
+    import pandas as pd
+
+    ncbi = load_taxonomy_handle(args.taxonomy)
+
+    print("Reading in", args.risk_table)
+    risk = pd.read_csv(args.risk_table)
+    risk['risk_taxid'] = pd.array(resolve_risk_taxids(risk, ncbi), dtype='Int64')
+    unresolved = risk.loc[risk['risk_taxid'].isna(), 'Pest_Name'].tolist()
+    if unresolved:
+        print(f"Risk table names with no TaxID ({len(unresolved)}):", unresolved)
+    lookup = build_risk_lookup(ncbi, [None if pd.isna(t) else int(t) for t in risk['risk_taxid']])
+    print(f"Built lookup of {len(lookup)} taxids under {risk['risk_taxid'].notna().sum()} risk table entries")
+
+    detections = read_detections(args.run_dir)
+    print(f"Read {len(detections)} detections from {detections['barcode'].nunique()} barcodes")
+
+    # One join for the whole run: taxid -> risk table row -> risk columns
+    detections['risk_row'] = detections['taxid'].map(lookup).astype('Int64')
+    annotated = detections.merge(risk, left_on='risk_row', right_index=True, how='left')
+    annotated['On_Risk_Register'] = annotated['risk_row'].notna().map({True: 'Yes', False: 'No'})
+    annotated = annotated.drop(columns=['risk_row', 'taxid'])
+    annotated.to_csv(args.output + "_detections.csv", index=False)
+    print(f"Risk annotated detections saved to {args.output}_detections.csv")
+
+    # Detections summed up to their risk table entry per barcode
+    on_register = annotated[annotated['On_Risk_Register'] == 'Yes']
+    summary = (on_register
+               .groupby(['barcode', 'risk_taxid', 'Pest_Name'], dropna=False)
+               .agg(read_count=('read_count', 'sum'), mapped_bases=('mapped_bases', 'sum'),
+                    num_detected_taxa=('taxaID', 'nunique'), detected_taxaIDs=('taxaID', lambda t: ",".join(sorted(set(t)))))
+               .reset_index()
+               .merge(risk.drop(columns=['Pest_Name']), on='risk_taxid', how='left')
+               .drop_duplicates(subset=['barcode', 'risk_taxid']))
+    summary.to_csv(args.output + "_summary.csv", index=False)
+    print(f"{len(summary)} risk register hits across the run saved to {args.output}_summary.csv")
+
+if __name__ == "__main__":
+    main()
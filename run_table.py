@@ -0,0 +1,198 @@
+#!/usr/bin/python
+
+#Collects every barcode's outputs into one run table, replaces the >> appends in write_files.sh
+#The run table is a single SQLite file (run_summary.sqlite) in the run directory with one table per kind of output:
+#  barcodes      one row per barcode (percent retained after the length filter, fail reads, ignored reads,
+#                pass read count and N50 from prep_reads.py)
+#  taxa_counts   the <NN>_taxaID_counts.tsv of each barcode
+#  lca_summary   the <NN>_lcaparse_summary.txt of each barcode
+#  lca_perread   the <NN>_lcaparse_perread.txt of each barcode
+#Adding a barcode replaces everything held for it in one transaction, so reruns never duplicate rows
+#and barcodes finishing at the same time on the cluster wait for each other instead of interleaving lines
+#Should be run from directory which contains barcode directories
+#python run_table.py add -b 01 02
+#python run_table.py export -o run_summary   (TSVs with headers, plus the run level text files write_files.sh used to append to)
+
+import os, csv, sqlite3, argparse, time
+from contextlib import contextmanager
+
+DEFAULT_DB = "run_summary.sqlite"
+BUSY_TIMEOUT = 600  #seconds a writer waits for another barcode's transaction
+
+#Table name -> columns after the barcode, (name, SQL type)
+TABLES = {
+    "barcodes": [("percent_retained", "REAL"), ("num_fail", "INTEGER"), ("ignored_reads", "INTEGER"), ("updated", "TEXT"),
+                 ("total_reads", "INTEGER"), ("N50", "INTEGER")],
+    "taxa_counts": [("taxaID", "TEXT"), ("read_count", "INTEGER")],
+    "lca_summary": [("read_count", "INTEGER"), ("percent_reads", "REAL"), ("taxid", "INTEGER"), ("taxon_path", "TEXT"),
+                    ("rank", "TEXT")],
+    "lca_perread": [("read_id", "TEXT"), ("taxid", "INTEGER"), ("name", "TEXT"), ("rank", "TEXT"), ("mean_identity", "REAL"),
+                    ("max_mean_identity", "REAL")],
+}
+#Uniqueness within a barcode, the barcodes table has one row per barcode
+KEYS = {"barcodes": (), "taxa_counts": ("taxaID",), "lca_summary": ("taxid",), "lca_perread": ("read_id",)}
+
+def connect(db_path=DEFAULT_DB):
+    #Rollback journal rather than WAL, WAL needs shared memory which network filesystems do not provide
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    #Every barcode's job may be the first, so the tables are created under the write lock
+    with transaction(conn):
+        for table, columns in TABLES.items():
+            column_defs = ", ".join(f"{name} {sql_type}" for name, sql_type in columns)
+            key = ", ".join(("barcode",) + KEYS[table])
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (barcode TEXT NOT NULL, {column_defs}, PRIMARY KEY ({key}))")
+            #Tables made by an older version get any new columns added
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for name, sql_type in columns:
+                if name not in existing:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {sql_type}")
+    return conn
+
+@contextmanager
+def transaction(conn):
+    #BEGIN IMMEDIATE takes the write lock up front so concurrent writers queue (up to BUSY_TIMEOUT) rather than fail mid-way
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def read_value(path):
+    #First whitespace separated field of a one line file, None if the file is missing or empty
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        fields = f.read().split()
+    return fields[0] if fields else None
+
+def read_rows(path, n_columns, header_first_field=None):
+    #Tab separated rows padded/truncated to n_columns, skipping a header line
+    rows = []
+    if not os.path.exists(path):
+        return rows
+    with open(path, 'r', newline='') as f:
+        for fields in csv.reader(f, delimiter='\t'):
+            if not fields or (header_first_field and fields[0] == header_first_field):
+                continue
+            rows.append((fields + [None] * n_columns)[:n_columns])
+    return rows
+
+def collect_barcode(barcode_number, run_dir="."):
+    #Reads all of a barcode's outputs into rows for each table, missing outputs give no rows (or NULL values)
+    barcode_dir = os.path.join(run_dir, "barcode{}".format(barcode_number))
+    prefix = os.path.join(barcode_dir, barcode_number)
+
+    percent_retained = read_value(prefix + "_barcode_percent_retained.txt")
+    num_fail = read_value(prefix + "_num_fail.txt")  #empty when fail reads were not analysed
+    ignored_reads = read_value(prefix + "_number_ignored_reads.tsv")
+    #All pass reads (before the length filter) from prep_reads.py's stats table
+    read_stats = {statistic: all_reads for statistic, all_reads, _ in read_rows(prefix + "_read_stats.tsv", 3, "statistic")}
+    total_reads, N50 = read_stats.get("reads"), read_stats.get("N50")
+    rows = {"barcodes": [(percent_retained and float(percent_retained), num_fail and int(float(num_fail)),
+                          ignored_reads and int(ignored_reads), time.strftime("%Y-%m-%d %H:%M:%S"),
+                          total_reads and int(total_reads), N50 and int(N50))]}
+
+    #paf_parse.py appends to the counts file, so a rerun repeats taxaIDs, the last count for each wins
+    taxa_counts = {}
+    for taxaID, count in read_rows(prefix + "_taxaID_counts.tsv", 2):
+        taxa_counts[taxaID] = int(count)
+    rows["taxa_counts"] = list(taxa_counts.items())
+    rows["lca_summary"] = read_rows(prefix + "_lcaparse_summary.txt", len(TABLES["lca_summary"]), "Read_Count")
+    rows["lca_perread"] = read_rows(prefix + "_lcaparse_perread.txt", len(TABLES["lca_perread"]), "Read_ID")
+    return rows
+
+def upsert_barcode(conn, barcode_number, rows):
+    #Replace everything held for the barcode in one transaction
+    with transaction(conn):
+        for table, table_rows in rows.items():
+            columns = ["barcode"] + [name for name, _ in TABLES[table]]
+            conn.execute(f"DELETE FROM {table} WHERE barcode = ?", (barcode_number,))
+            conn.executemany(f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                             ((barcode_number, *row) for row in table_rows))
+
+@contextmanager
+def replace_file(path):
+    #Written to a temporary file and renamed, so a barcode exporting at the same time never leaves a half written file
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    try:
+        with open(tmp_path, 'w', newline='') as out:
+            yield out
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def text(value, spec=""):
+    #NULL (an output the barcode did not have) is written as an empty field, as cat of a missing/empty file gave
+    return "" if value is None else format(value, spec)
+
+def legacy_lines(conn):
+    #The run level files write_files.sh used to append to, file name -> lines in their old layout
+    #(lineage_table.py reads all_taxaID_count.tsv, old_scripts/create_risk_plots.R the lcaparse files)
+    barcodes = conn.execute("SELECT barcode, percent_retained, num_fail, ignored_reads FROM barcodes ORDER BY barcode").fetchall()
+    files = {
+        "percent_reads_retained_length_filter.txt": [f"Barcode_{barcode}: {text(percent, '.2f')}" for barcode, percent, _, _ in barcodes],
+        "no_fail_reads.txt": [f"Barcode_{barcode}: Fail reads not analysed" if num_fail is None else f"Barcode_{barcode}: {num_fail}"
+                              for barcode, _, num_fail, _ in barcodes],
+        #paf_parse.py writes "<count>\t<barcode>" into <NN>_number_ignored_reads.tsv, which was appended as is
+        "no_reads_ignored_parse_filter.txt": [f"Barcode_{barcode}: " + ("" if ignored is None else f"{ignored}\t{barcode}")
+                                              for barcode, _, _, ignored in barcodes],
+        "all_taxaID_count.tsv": [f"{taxaID}\t{count}\t{barcode}" for taxaID, count, barcode in
+                                 conn.execute("SELECT taxaID, read_count, barcode FROM taxa_counts ORDER BY barcode, rowid")],
+    }
+    files["lcaparse_summary.txt"] = ["Barcode\tRead_Count\tPercentage_of_Reads\tTaxon_ID\tTaxon_Path\tTaxon_Rank"] + [
+        f"{barcode}\t{count}\t{text(percent, '.4f')}\t{taxid}\t{path}\t{rank}" for barcode, count, percent, taxid, path, rank in
+        conn.execute("SELECT barcode, read_count, percent_reads, taxid, taxon_path, rank FROM lca_summary ORDER BY barcode, rowid")]
+    files["lcaparse_perread.txt"] = ["Barcode\tRead_ID\tTaxon_ID\tTaxon_Name\tTaxon_Rank\tMean_Identity\tMaxMeanIdentity"] + [
+        f"{barcode}\t{read_id}\t{taxid}\t{name}\t{rank}\t{text(mean, '.2f')}\t{text(max_mean, '.2f')}" for barcode, read_id, taxid, name, rank, mean, max_mean in
+        conn.execute("SELECT barcode, read_id, taxid, name, rank, mean_identity, max_mean_identity FROM lca_perread ORDER BY barcode, rowid")]
+    return files
+
+def export(conn, prefix):
+    #One TSV with a header per table, ordered by barcode, and the legacy run level files next to them under their old names
+    output_dir = os.path.dirname(prefix)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    #Read in one transaction so every file comes from the same state of the run table
+    conn.execute("BEGIN")
+    try:
+        for table, columns in TABLES.items():
+            names = ["barcode"] + [name for name, _ in columns]
+            with replace_file(f"{prefix}_{table}.tsv") as out:
+                writer = csv.writer(out, delimiter='\t', lineterminator='\n')
+                writer.writerow(names)
+                writer.writerows(conn.execute(f"SELECT {', '.join(names)} FROM {table} ORDER BY barcode, rowid"))
+        for filename, lines in legacy_lines(conn).items():
+            with replace_file(os.path.join(output_dir, filename)) as out:
+                out.writelines(line + "\n" for line in lines)
+    finally:
+        conn.execute("COMMIT")
+
+def main():
+    parser = argparse.ArgumentParser(description="Collect barcode outputs into the run table, or export it as TSVs.")
+    parser.add_argument("--db", default=DEFAULT_DB, help=f"Run table SQLite file (default: {DEFAULT_DB})")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    add_parser = subparsers.add_parser("add", help="Add or replace barcodes in the run table")
+    add_parser.add_argument("-b", "--barcode", nargs="+", required=True, help="Barcode numbers, reads ./barcode<NN>/<NN>_*")
+    export_parser = subparsers.add_parser("export", help="Write each table as a TSV")
+    export_parser.add_argument("-o", "--output", default="run_summary", help="Output prefix (default: run_summary)")
+    args = parser.parse_args()
+
+    conn = connect(args.db)
+    try:
+        if args.command == "add":
+            for barcode_number in args.barcode:
+                # Read the files before taking the lock so other barcodes only wait for the inserts
+                rows = collect_barcode(barcode_number)
+                upsert_barcode(conn, barcode_number, rows)
+                print(f"Barcode {barcode_number}: " + ", ".join(f"{len(r)} {table}" for table, r in rows.items() if table != "barcodes"))
+        else:
+            export(conn, args.output)
+            print(f"Run table exported to {args.output}_<table>.tsv and the legacy run files in {os.path.dirname(args.output) or '.'}")
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
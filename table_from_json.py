@@ -1,6 +1,7 @@
 import sys
 import json
 import csv
+import argparse
 
 # get details from the download.json to build a table 
 # python scripts/table_from_json.py Pathogen_Database_0825/0825_download_input.json Pathogen_Database_0825/0825_database_info.tsv
@@ -13,12 +14,13 @@ def load_json(path):
     return data
 
 def main():
-    if len(sys.argv) != 3:
-        print("Usage: python table_from_json.py <input.json> <output.tsv>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Table of the selected assemblies from a download list JSON.")
+    parser.add_argument("input_json", help="Download list from Make_Pathogen_Database.py (<prefix>download_input.json)")
+    parser.add_argument("output_tsv", help="Output TSV")
+    args = parser.parse_args()
 
-    input_json = sys.argv[1]
-    output_tsv = sys.argv[2]
+    input_json = args.input_json
+    output_tsv = args.output_tsv
 
     records = load_json(input_json)
     if not records:
@@ -0,0 +1,345 @@
+#!/usr/bin/python
+
+#A compact in-memory copy of the NCBI taxonomy tree for fast lineage and LCA lookups
+#Loaded straight from the sqlite database ete3's NCBITaxa keeps locally (~/.etetoolkit/taxa.sqlite),
+#so ete3 itself does not need to be imported and no query is made per read
+#parent and depth are dense arrays indexed by taxid, names and ranks are fetched only for the taxids asked for
+#
+#The database can also be exported once into a snapshot directory of raw arrays that are memory-mapped on load:
+#python taxonomy.py export -o taxonomy_snapshot
+#Loading a snapshot is near-instant and it answers the NCBITaxa calls the scripts use
+#(get_name_translator, get_descendant_taxa, get_lineage, get_rank, get_taxid_translator) without any sqlite
+
+import os, sys, json, mmap, sqlite3, argparse
+from array import array
+from bisect import bisect_left
+
+DEFAULT_TAXDB = os.path.join(os.path.expanduser("~"), ".etetoolkit", "taxa.sqlite")
+ROOT = 1
+SNAPSHOT_VERSION = 1
+
+class Taxonomy:
+    def __init__(self, parent, depth, merged=None, taxdb=None):
+        self.parent = parent  #parent[taxid], -1 if taxid is not in the taxonomy
+        self.depth = depth    #number of steps from taxid up to the root
+        self.merged = merged or {} #old taxid -> current taxid
+        self.taxdb = taxdb
+        self._lca_cache = {}
+
+    @classmethod
+    def from_ete3_db(cls, taxdb=DEFAULT_TAXDB):
+        if not os.path.exists(taxdb):
+            raise FileNotFoundError(f"Could not find taxonomy database {taxdb}, run NCBITaxa().update_taxonomy_database() once to create it")
+        db = sqlite3.connect(taxdb)
+        try:
+            rows = db.execute("SELECT taxid, parent FROM species").fetchall()
+            merged = dict(db.execute("SELECT taxid_old, taxid_new FROM merged").fetchall())
+        finally:
+            db.close()
+        parent = _parent_array(rows)
+        return cls(parent, cls._compute_depths(parent), merged, taxdb)
+
+    @staticmethod
+    def _compute_depths(parent):
+        depth = array('i', [-1]) * len(parent)
+        depth[ROOT] = 0
+        for taxid in range(len(parent)):
+            if parent[taxid] < 0 or depth[taxid] >= 0:
+                continue
+            #walk up until a node with a known depth, then fill in on the way back down
+            path = []
+            node = taxid
+            while depth[node] < 0:
+                path.append(node)
+                node = parent[node]
+            d = depth[node]
+            for node in reversed(path):
+                d += 1
+                depth[node] = d
+        return depth
+
+    def resolve(self, taxid):
+        #Current taxid for taxid, following merges, or None if it is unknown
+        taxid = int(taxid)
+        taxid = self.merged.get(taxid, taxid)
+        if 0 < taxid < len(self.parent) and self.parent[taxid] >= 0:
+            return taxid
+        return None
+
+    def lineage(self, taxid):
+        #taxids from taxid up to and including the root
+        parent = self.parent
+        path = [taxid]
+        while taxid != ROOT:
+            taxid = parent[taxid]
+            path.append(taxid)
+        return path
+
+    def lca(self, a, b):
+        #Lowest common ancestor of two resolved taxids
+        #Lineages are short (tens of nodes) so the two are walked up to the same depth and then together,
+        #and every answer is memoised since reads keep hitting the same pairs of taxa
+        if a == b:
+            return a
+        key = (a, b) if a < b else (b, a)
+        cached = self._lca_cache.get(key)
+        if cached is not None:
+            return cached
+        parent = self.parent
+        depth = self.depth
+        x, y = key
+        while depth[x] > depth[y]:
+            x = parent[x]
+        while depth[y] > depth[x]:
+            y = parent[y]
+        while x != y:
+            x = parent[x]
+            y = parent[y]
+        self._lca_cache[key] = x
+        return x
+
+    def lca_of(self, taxids):
+        #LCA of any number of resolved taxids
+        taxids = iter(sorted(set(taxids)))
+        result = next(taxids)
+        for taxid in taxids:
+            if result == ROOT:
+                break
+            result = self.lca(result, taxid)
+        return result
+
+    def names_and_ranks(self, taxids):
+        #taxid -> (scientific name, rank), only looked up for the taxids needed in an output
+        info = {}
+        if not self.taxdb:
+            return info
+        taxids = [int(t) for t in taxids]
+        db = sqlite3.connect(self.taxdb)
+        try:
+            #sqlite limits the number of parameters, so look up in batches
+            for i in range(0, len(taxids), 500):
+                batch = taxids[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                for taxid, name, rank in db.execute(f"SELECT taxid, spname, rank FROM species WHERE taxid IN ({placeholders})", batch):
+                    info[taxid] = (name, rank)
+        finally:
+            db.close()
+        return info
+
+def _parent_array(rows):
+    max_taxid = max(taxid for taxid, _ in rows)
+    parent = array('i', [-1]) * (max_taxid + 1)
+    for taxid, parent_taxid in rows:
+        #the root is stored as its own parent (or with no parent)
+        parent[taxid] = ROOT if parent_taxid in (None, "", taxid) else int(parent_taxid)
+    parent[ROOT] = ROOT
+    return parent
+
+def _name_key(name_bytes):
+    #ete3 matches names with sqlite's NOCASE collation, which only folds ASCII letters
+    return name_bytes.lower()
+
+class _SortedNames:
+    #Sequence view of the sorted name index so bisect can search it without building a list
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __len__(self):
+        return len(self.snapshot.name_index)
+
+    def __getitem__(self, i):
+        return _name_key(self.snapshot.name_bytes(self.snapshot.name_index[i]))
+
+class TaxonomySnapshot(Taxonomy):
+    #Taxonomy backed by memory-mapped arrays exported with export_snapshot
+    #Name entries 0..n_scientific-1 are scientific names, the rest are synonyms
+    ARRAYS = {
+        "parent": 'i', "depth": 'i', "rank": 'B', "sci_name": 'i',
+        "child_offsets": 'q', "children": 'i',
+        "name_offsets": 'q', "name_taxid": 'i', "name_index": 'i',
+        "merged_old": 'i', "merged_new": 'i',
+    }
+
+    def __init__(self, snapshot_dir):
+        with open(os.path.join(snapshot_dir, "meta.json"), 'r') as meta_file:
+            meta = json.load(meta_file)
+        if meta.get("version") != SNAPSHOT_VERSION or meta.get("byteorder") != sys.byteorder:
+            raise ValueError(f"{snapshot_dir} was exported by a different version or on a different platform, export it again")
+        self.ranks = meta["ranks"]
+        self.n_scientific = meta["n_scientific"]
+        for name, typecode in self.ARRAYS.items():
+            setattr(self, name, map_array(os.path.join(snapshot_dir, name + ".bin"), typecode))
+        self.names_bin = map_array(os.path.join(snapshot_dir, "names.bin"), 'B')
+        super().__init__(self.parent, self.depth, dict(zip(self.merged_old, self.merged_new)), None)
+
+    def name_bytes(self, entry):
+        return bytes(self.names_bin[self.name_offsets[entry]:self.name_offsets[entry + 1]])
+
+    def name(self, taxid):
+        entry = self.sci_name[taxid] if 0 < taxid < len(self.sci_name) else -1
+        return self.name_bytes(entry).decode() if entry >= 0 else None
+
+    def rank_of(self, taxid):
+        return self.ranks[self.rank[taxid]]
+
+    def names_and_ranks(self, taxids):
+        return {int(t): (self.name(int(t)), self.rank_of(int(t))) for t in taxids if self.resolve(t) == int(t)}
+
+    def _lookup_name(self, name):
+        #taxids whose scientific name matches, or failing that whose synonym matches
+        key = _name_key(name.encode())
+        sorted_names = _SortedNames(self)
+        i = bisect_left(sorted_names, key)
+        scientific, synonyms = [], []
+        while i < len(sorted_names) and sorted_names[i] == key:
+            entry = self.name_index[i]
+            (scientific if entry < self.n_scientific else synonyms).append(self.name_taxid[entry])
+            i += 1
+        return scientific or synonyms
+
+    def children_of(self, taxid):
+        return self.children[self.child_offsets[taxid]:self.child_offsets[taxid + 1]]
+
+    # Same calls and return shapes as ete3's NCBITaxa, so it can be used in its place
+
+    def get_name_translator(self, names):
+        result = {}
+        for name in names:
+            taxids = self._lookup_name(str(name))
+            if taxids:
+                result[name] = sorted(taxids)
+        return result
+
+    def get_taxid_translator(self, taxids):
+        return {int(t): self.name(int(t)) for t in taxids if self.resolve(t) == int(t)}
+
+    def get_rank(self, taxids):
+        return {int(t): self.rank_of(int(t)) for t in taxids if self.resolve(t) == int(t)}
+
+    def get_lineage(self, taxid):
+        #root first, like ete3
+        taxid = self.resolve(taxid)
+        return list(reversed(self.lineage(taxid))) if taxid is not None else None
+
+    def get_descendant_taxa(self, taxid, intermediate_nodes=False):
+        #All taxids below taxid, or only the tips unless intermediate_nodes is set
+        #A taxid with nothing below it is its own tip, ete3 returns [taxid] for it
+        taxid = self.resolve(taxid)
+        if taxid is None:
+            return []
+        if not len(self.children_of(taxid)):
+            return [taxid]
+        descendants = []
+        stack = list(self.children_of(taxid))
+        while stack:
+            node = stack.pop()
+            node_children = self.children_of(node)
+            if intermediate_nodes or not node_children:
+                descendants.append(node)
+            stack.extend(node_children)
+        return descendants
+
+def map_array(path, typecode):
+    #mmap can not map an empty file, an empty array behaves the same
+    if os.path.getsize(path) == 0:
+        return array(typecode)
+    with open(path, 'rb') as array_file:
+        mm = mmap.mmap(array_file.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mm).cast(typecode)
+
+def export_snapshot(taxdb, snapshot_dir):
+    #One-time export of the ete3 sqlite taxonomy into arrays for TaxonomySnapshot
+    db = sqlite3.connect(taxdb)
+    try:
+        species = db.execute("SELECT taxid, parent, spname, rank FROM species").fetchall()
+        synonyms = db.execute("SELECT taxid, spname FROM synonym").fetchall()
+        merged = db.execute("SELECT taxid_old, taxid_new FROM merged").fetchall()
+    finally:
+        db.close()
+
+    parent = _parent_array([(taxid, parent_taxid) for taxid, parent_taxid, _, _ in species])
+    depth = Taxonomy._compute_depths(parent)
+    size = len(parent)
+
+    ranks = sorted({rank or "no rank" for _, _, _, rank in species})
+    rank_code = {rank: i for i, rank in enumerate(ranks)}
+    rank = array('B', [rank_code.get("no rank", 0)]) * size
+    for taxid, _, _, taxid_rank in species:
+        rank[taxid] = rank_code[taxid_rank or "no rank"]
+
+    #Name table: scientific names first then synonyms, each entry knows its taxid
+    names = [(taxid, spname or "") for taxid, _, spname, _ in species] + [(taxid, spname or "") for taxid, spname in synonyms]
+    name_offsets = array('q', [0])
+    name_taxid = array('i')
+    sci_name = array('i', [-1]) * size
+    encoded = []
+    for entry, (taxid, name) in enumerate(names):
+        name_bytes = name.encode()
+        encoded.append(name_bytes)
+        name_offsets.append(name_offsets[-1] + len(name_bytes))
+        name_taxid.append(taxid)
+        if entry < len(species):
+            sci_name[taxid] = entry
+    name_index = array('i', sorted(range(len(encoded)), key=lambda entry: _name_key(encoded[entry])))
+
+    #Children in compressed sparse row layout: children of t are children[child_offsets[t]:child_offsets[t + 1]]
+    child_counts = array('q', [0]) * (size + 1)
+    for taxid in range(size):
+        if parent[taxid] >= 0 and taxid != ROOT:
+            child_counts[parent[taxid] + 1] += 1
+    child_offsets = array('q', [0]) * (size + 1)
+    for taxid in range(size):
+        child_offsets[taxid + 1] = child_offsets[taxid] + child_counts[taxid + 1]
+    children = array('i', [0]) * child_offsets[size]
+    fill = array('q', child_offsets)
+    for taxid in range(size):
+        if parent[taxid] >= 0 and taxid != ROOT:
+            children[fill[parent[taxid]]] = taxid
+            fill[parent[taxid]] += 1
+
+    arrays = {
+        "parent": parent, "depth": depth, "rank": rank, "sci_name": sci_name,
+        "child_offsets": child_offsets, "children": children,
+        "name_offsets": name_offsets, "name_taxid": name_taxid, "name_index": name_index,
+        "merged_old": array('i', [old for old, _ in merged]), "merged_new": array('i', [new for _, new in merged]),
+    }
+    os.makedirs(snapshot_dir, exist_ok=True)
+    #An existing snapshot stops being complete while it is rewritten, and a name index built from it
+    #(name_matcher.py) would point at the old name entries
+    for name in ["meta.json", "fuzzy_meta.json", "fuzzy_keys.bin", "fuzzy_offsets.bin", "fuzzy_postings.bin"]:
+        path = os.path.join(snapshot_dir, name)
+        if os.path.exists(path):
+            os.remove(path)
+    for name, values in arrays.items():
+        with open(os.path.join(snapshot_dir, name + ".bin"), 'wb') as array_file:
+            values.tofile(array_file)
+    with open(os.path.join(snapshot_dir, "names.bin"), 'wb') as names_file:
+        names_file.write(b"".join(encoded))
+    meta = {"version": SNAPSHOT_VERSION, "byteorder": sys.byteorder, "source": os.path.abspath(taxdb),
+            "ranks": ranks, "n_scientific": len(species), "n_names": len(names), "max_taxid": size - 1}
+    #meta.json last, its presence marks a complete snapshot
+    with open(os.path.join(snapshot_dir, "meta.json"), 'w') as meta_file:
+        json.dump(meta, meta_file, indent=4)
+    return meta
+
+def load_taxonomy(path=DEFAULT_TAXDB):
+    #A snapshot directory if given one, otherwise the ete3 sqlite database
+    if os.path.isdir(path):
+        return TaxonomySnapshot(path)
+    return Taxonomy.from_ete3_db(path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the local NCBI taxonomy into a memory-mapped snapshot.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Export the ete3 taxonomy database to a snapshot directory")
+    export_parser.add_argument("--taxdb", default=DEFAULT_TAXDB, help=f"ete3 taxonomy sqlite database (default: {DEFAULT_TAXDB})")
+    export_parser.add_argument("-o", "--output", required=True, help="Snapshot directory to write")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(f"Exporting {args.taxdb} to {args.output}")
+        meta = export_snapshot(args.taxdb, args.output)
+        print(f"Exported {meta['n_scientific']} taxa and {meta['n_names']} names")
+
+if __name__ == "__main__":
+    main()
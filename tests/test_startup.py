@@ -0,0 +1,24 @@
+#Every pathogen_db.py command must print its --help without error, without importing pandas, requests, tqdm,
+#ete3 or Biopython, and within the startup budget of benchmarks/check_startup.py
+#python -m pytest tests
+
+import os, sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+from pathogen_db import COMMANDS
+from check_startup import HEAVY_MODULES, DEFAULT_BUDGET, run_help
+
+REPEATS = 3  #the fastest run counts, as in check_startup.py
+
+@pytest.mark.parametrize("command", list(COMMANDS))
+def test_help_is_light(command):
+    wall, imports, crashed, returncode = min((run_help(command) for _ in range(REPEATS)), key=lambda run: run[0])
+    assert not crashed, f"{command} --help raised an error"
+    assert returncode == 0, f"{command} --help exited with {returncode}"
+    heavy = sorted({module.split(".")[0] for module, _ in imports if module.split(".")[0] in HEAVY_MODULES})
+    assert not heavy, f"{command} --help imported {', '.join(heavy)}"
+    assert wall <= DEFAULT_BUDGET, f"{command} --help took {wall:.3f}s, over the {DEFAULT_BUDGET}s budget"
@@ -1,5 +1,9 @@
 #!/bin/bash
-#script that adds different variables to files shared by the pipeline
+#script that adds a barcode's outputs to the run table shared by the pipeline
+#The >> appends onto shared text files are replaced by run_table.py, which writes them into run_summary.sqlite
+#in one locked transaction (no interleaving when barcodes finish together, no duplicates on reruns)
+#The run level text files (percent_reads_retained_length_filter.txt, no_fail_reads.txt, no_reads_ignored_parse_filter.txt,
+#all_taxaID_count.tsv, lcaparse_summary.txt, lcaparse_perread.txt) are then rewritten from the table in their old layout
 
 # Check for the correct number of arguments
 if [ "$#" -ne 1 ]; then
@@ -9,26 +13,9 @@ fi
 
 # Extract the arguments
 barcode_number="$1"
-barcode_dir="barcode${barcode_number}"
 
-# Append percentage reads retained after filtering on length to file
-echo "Barcode_${barcode_number}:" "$(cat "${barcode_dir}/${barcode_number}_barcode_percent_retained.txt")" >> "percent_reads_retained_length_filter.txt"
+# Add or replace the percent retained, fail reads, ignored reads, taxaID counts and lcaparse outputs for this barcode
+python "$(dirname "$0")/run_table.py" add -b "${barcode_number}"
 
-# Check if the number of failed reads file is empty and append appropriate message
-if [ ! -s "${barcode_dir}/${barcode_number}_num_fail.txt" ]; then
-    echo "Barcode_${barcode_number}: Fail reads not analysed" >> "no_fail_reads.txt"
-else
-    echo "Barcode_${barcode_number}:" "$(cat "${barcode_dir}/${barcode_number}_num_fail.txt")" >> "no_fail_reads.txt"
-fi
-
-# Append number of ignored reads after paf parse to file
-echo "Barcode_${barcode_number}:" "$(cat "${barcode_dir}/${barcode_number}_number_ignored_reads.tsv")" >> "no_reads_ignored_parse_filter.txt"
-
-# Append the taxaID_count file to all taxaID_count file from paf parse
-echo "$(cat "${barcode_dir}/${barcode_number}_taxaID_counts.tsv")" >> "all_taxaID_count.tsv"
-
-# Add a barcode column to the lcaparse_summary file
-awk 'BEGIN {OFS="\t"} {print "'${barcode_number}'", $0}' "${barcode_dir}/${barcode_number}_lcaparse_summary.txt" >> "lcaparse_summary.txt"
-
-# Add a barcode column to the lcaparse_perread file
-awk 'BEGIN {OFS="\t"} {print "'${barcode_number}'", $0}' "${barcode_dir}/${barcode_number}_lcaparse_perread.txt" >> "lcaparse_perread.txt"
\ No newline at end of file
+# Rewrite the run level files, with every barcode added so far
+python "$(dirname "$0")/run_table.py" export -o run_summary